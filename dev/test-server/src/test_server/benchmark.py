@@ -0,0 +1,91 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark the snapshot upload throughput of the push service against the test server.
+
+Usage: python benchmark.py [snapshots] [batch size] [transport] [latency ms]
+
+The transport is either 'sync' (blocking calls on the task handler threads) or 'aio' (grpc.aio on a single event loop
+thread), or 'both' to compare them (the default). The latency is added to each call by the server, to simulate a
+remote service.
+"""
+
+import sys
+import time
+
+from deep.api.resource import Resource
+from deep.api.tracepoint import EventSnapshot, StackFrame, Variable, VariableId, TracePointConfig
+from deep.config import ConfigService
+from deep.grpc import GRPCService
+from deep.push import PushService
+from deep.task import TaskHandler
+from deep.utils import time_ns
+
+from server import create_server, SnapshotServicer
+
+PORT = 43316
+
+
+def create_snapshot() -> EventSnapshot:
+    """Create a snapshot with a small stack and a few variables."""
+    var_lookup = {index: Variable('str', 'value %s' % index, index, [], False) for index in range(20)}
+    frames = [StackFrame('/app/file.py', 'file.py', 'method', index, [VariableId(index, 'var%s' % index)], None)
+              for index in range(20)]
+    tracepoint = TracePointConfig('tp-id', '/app/file.py', 10, {}, [], [])
+    snapshot = EventSnapshot(tracepoint, time_ns(), Resource.get_empty(), frames, var_lookup)
+    snapshot.complete()
+    return snapshot
+
+
+def run(count: int, batch_size: int, transport: str, latency_ms: int):
+    """
+    Push snapshots through the push service, and report the throughput.
+
+    :param count: the number of snapshots to push
+    :param batch_size: the max snapshots per batch
+    :param transport: the transport to use
+    :param latency_ms: the latency the server adds to each call
+    """
+    servicer = SnapshotServicer(quiet=True, latency_ms=latency_ms)
+    server = create_server(servicer, PORT, max_workers=100)
+    server.start()
+
+    config = ConfigService({'SERVICE_URL': 'localhost:%s' % PORT, 'SERVICE_SECURE': 'False',
+                            'PUSH_BATCH_SIZE': batch_size, 'MAX_PENDING_SNAPSHOT_BYTES': 2 ** 40,
+                            'MAX_PENDING_SNAPSHOTS': 2 ** 40, 'GRPC_TRANSPORT': transport})
+    grpc = GRPCService(config)
+    grpc.start()
+    task_handler = TaskHandler()
+    push_service = PushService(grpc, task_handler, config)
+
+    snapshots = [create_snapshot() for _ in range(count)]
+    start = time.perf_counter()
+    for snapshot in snapshots:
+        push_service.push_snapshot(snapshot)
+    task_handler.flush()
+    grpc.shutdown()
+    duration = time.perf_counter() - start
+
+    print("transport: %s, batch size: %s, latency: %sms, snapshots: %s, received: %s, time: %.3fs, rate: %.0f/s" % (
+        transport, batch_size, latency_ms, count, servicer.received, duration, count / duration))
+    server.stop(None)
+
+
+if __name__ == '__main__':
+    selected = sys.argv[3] if len(sys.argv) > 3 else 'both'
+    for name in (['sync', 'aio'] if selected == 'both' else [selected]):
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 500, int(sys.argv[2]) if len(sys.argv) > 2 else 50, name,
+            int(sys.argv[4]) if len(sys.argv) > 4 else 0)
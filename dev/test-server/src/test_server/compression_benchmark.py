@@ -0,0 +1,166 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark the cost, and benefit, of compressing snapshots.
+
+Snapshots are captured from a small sample application using the real capture pipeline, converted to the protobuf
+messages that are sent, and then compressed with each of the algorithms supported by the GRPC_COMPRESSION config.
+For each algorithm this reports the average size, the CPU time per snapshot (to compress on the client, and to
+decompress on the server), and the bytes saved per millisecond of client CPU.
+
+Usage: python compression_benchmark.py [snapshots] [threshold]
+"""
+
+import gzip
+import os
+import sys
+import time
+import uuid
+import zlib
+from typing import List
+
+from deep import logging
+from deep.api.resource import Resource
+from deep.api.tracepoint.trigger import LineLocation, Location, LocationAction, Trigger
+from deep.config import ConfigService
+from deep.processor.trigger_handler import TriggerHandler
+from deep.push.encoder import encode_snapshot
+
+REPEATS = 5
+"""The number of times each payload is compressed, to get a stable CPU time."""
+
+
+class CollectingPushService:
+    """A push service that keeps the snapshots, rather than sending them."""
+
+    def __init__(self):
+        """Create a new push service."""
+        self.snapshots = []
+
+    def push_snapshot(self, snapshot):
+        """Keep the snapshot."""
+        self.snapshots.append(snapshot)
+
+
+class BenchmarkConfig(ConfigService):
+    """Config with an empty resource, as the config is not started."""
+
+    @property
+    def resource(self) -> Resource:
+        """The resource for the snapshots."""
+        return Resource.create()
+
+
+class Order:
+    """A sample type with some typical fields."""
+
+    def __init__(self, index: int):
+        """Create a new order."""
+        self.order_id = str(uuid.uuid4())
+        self.customer = {'id': index, 'name': 'Customer %s' % index, 'email': 'customer%s@example.com' % index}
+        self.lines = [{'sku': 'SKU-%05d' % (index * 7 + line), 'quantity': line + 1, 'price': 9.99 * (line + 1)}
+                      for line in range(index % 5 + 1)]
+        self.status = 'pending'
+
+
+def handle_request(handler: TriggerHandler, index: int):
+    """Handle a sample request, a snapshot is captured at the marked line."""
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'benchmark/1.0', 'X-Request-Id': str(uuid.uuid4())}
+    order = Order(index)
+    total = sum(line['price'] * line['quantity'] for line in order.lines)
+    handler.trace_call(sys._getframe(), 'line', None)  # capture point
+    return headers, order, total
+
+
+def capture_line() -> int:
+    """Find the line number of the capture point."""
+    with open(__file__) as file:
+        return next(number for number, line in enumerate(file, 1) if line.rstrip().endswith('# capture point'))
+
+
+def capture(count: int) -> List[bytes]:
+    """
+    Capture snapshots from the sample application.
+
+    :param count: the number of snapshots to capture
+    :return: the serialized snapshot messages
+    """
+    config = BenchmarkConfig({})
+    logging.init(config)
+    push = CollectingPushService()
+    handler = TriggerHandler(config, push)
+    location = LineLocation(os.path.basename(__file__), capture_line(), Location.Position.START)
+    handler.new_config([Trigger(location, [
+        LocationAction('tp-id', None, {'fire_count': '-1', 'fire_period': '0', 'watches': ['order.lines', 'total']},
+                       LocationAction.ActionType.Snapshot)])])
+
+    for index in range(count):
+        handle_request(handler, index)
+    return [encode_snapshot(snapshot) for snapshot in push.snapshots]
+
+
+ALGORITHMS = {
+    'none': (lambda data: data, lambda data: data),
+    # grpc uses the gzip and zlib formats, at the default compression level
+    'gzip': (gzip.compress, gzip.decompress),
+    'deflate': (zlib.compress, zlib.decompress),
+}
+
+
+def cpu_time(function, payloads: List[bytes]) -> float:
+    """
+    Measure the CPU time to process each payload.
+
+    :param function: the function to run on each payload
+    :param payloads: the payloads
+    :return: the CPU time in microseconds per payload
+    """
+    start = time.process_time()
+    for _ in range(REPEATS):
+        for payload in payloads:
+            function(payload)
+    return (time.process_time() - start) * 1000000 / (REPEATS * len(payloads))
+
+
+def run(count: int, threshold: int):
+    """
+    Capture snapshots, and report the cost and benefit of each compression algorithm.
+
+    :param count: the number of snapshots to capture
+    :param threshold: the compression threshold, payloads below this size are not compressed
+    """
+    payloads = capture(count)
+    raw_size = sum(len(payload) for payload in payloads) / len(payloads)
+    compressed = [payload for payload in payloads if len(payload) >= threshold]
+    print("snapshots: %s, average size: %.0f bytes, above threshold (%s bytes): %s" % (
+        len(payloads), raw_size, threshold, len(compressed)))
+    if len(compressed) == 0:
+        return
+
+    for name, (compress, decompress) in ALGORITHMS.items():
+        sizes = [len(compress(payload)) for payload in compressed]
+        size = (sum(sizes) + sum(len(payload) for payload in payloads if len(payload) < threshold)) / len(payloads)
+        compress_us = cpu_time(compress, compressed) * len(compressed) / len(payloads)
+        decompress_us = cpu_time(decompress, [compress(payload) for payload in compressed]) * len(compressed) / len(
+            payloads)
+        saved = raw_size - size
+        print("%-8s size: %6.0f bytes (%5.1f%%), compress: %7.1f us, decompress: %7.1f us, saved: %s" % (
+            name, size, 100 * size / raw_size, compress_us, decompress_us,
+            "%.0f bytes/ms CPU" % (saved * 1000 / compress_us) if compress_us > 0 and saved > 0 else "-"))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200, int(sys.argv[2]) if len(sys.argv) > 2 else 1024)
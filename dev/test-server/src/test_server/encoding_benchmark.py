@@ -0,0 +1,89 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark encoding snapshots with the single pass encoder, against converting to protobuf messages and serializing.
+
+Usage: python encoding_benchmark.py [variables] [iterations]
+"""
+
+import sys
+import time
+
+from deep.api.resource import Resource
+from deep.api.tracepoint import EventSnapshot, StackFrame, Variable, VariableId, TracePointConfig
+from deep.push import convert_snapshot
+from deep.push.encoder import encode_snapshot
+from deep.utils import time_ns
+
+
+def create_snapshot(variables: int) -> EventSnapshot:
+    """
+    Create a snapshot with a stack, and the given number of variables.
+
+    Every fourth variable is a collection with three children, the others are simple values.
+
+    :param variables: the number of variables in the var lookup
+    :return: the snapshot
+    """
+    var_lookup = {}
+    for index in range(variables):
+        if index % 4 == 0:
+            children = [VariableId(index + child, 'item_%s' % child) for child in range(1, 4)]
+            var_lookup[index] = Variable('dict', 'Size: 3', 140000000 + index, children, False, 3)
+        else:
+            var_lookup[index] = Variable('str', 'value of variable %s' % index, 140000000 + index, [], False)
+    frames = [StackFrame('/app/service/module_%s.py' % index, 'module_%s.py' % index, 'method_%s' % index,
+                         10 + index, [VariableId(index * 4, 'local_%s' % index)] if index < 10 else [],
+                         'Handler', app_frame=True)
+              for index in range(20)]
+    tracepoint = TracePointConfig('tp-id', '/app/service/module_0.py', 10, {}, [], [])
+    snapshot = EventSnapshot(tracepoint, time_ns(), Resource.create(), frames, var_lookup)
+    snapshot.complete()
+    return snapshot
+
+
+def measure(function, snapshot: EventSnapshot, iterations: int) -> float:
+    """
+    Measure the time to encode the snapshot.
+
+    :param function: the encoding function
+    :param snapshot: the snapshot
+    :param iterations: the number of times to encode the snapshot
+    :return: the time in milliseconds per snapshot
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(snapshot)
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def run(variables: int, iterations: int):
+    """
+    Compare the encoders, and report the time per snapshot.
+
+    :param variables: the number of variables in each snapshot
+    :param iterations: the number of times to encode the snapshot
+    """
+    snapshot = create_snapshot(variables)
+    converted = measure(lambda s: convert_snapshot(s).SerializeToString(), snapshot, iterations)
+    encoded = measure(encode_snapshot, snapshot, iterations)
+    print("variables: %s, size: %s bytes" % (variables, len(encode_snapshot(snapshot))))
+    print("convert and serialize: %.3f ms" % converted)
+    print("single pass encoder:   %.3f ms (%.1fx)" % (encoded, converted / encoded))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 200)
@@ -15,6 +15,8 @@
 
 """This is a basic example of setting up a GRPC server to consume Deep protobuf messages."""
 
+import threading
+import time
 from concurrent import futures
 
 import deepproto
@@ -27,14 +29,28 @@ from deepproto.proto.tracepoint.v1.tracepoint_pb2 import TracePointConfig, Snaps
 from deepproto.proto.tracepoint.v1.tracepoint_pb2_grpc import SnapshotServiceServicer
 
 
-def serve():
-    """Set up and start a GRPC service on port 43315 to server Deep clients."""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def create_server(snapshot_servicer=None, port=43315, max_workers=10):
+    """
+    Set up a GRPC service to serve Deep clients.
+
+    :param snapshot_servicer: the servicer to use for snapshots, defaults to a servicer that prints each snapshot
+    :param port: the port to listen on
+    :param max_workers: the number of threads used to handle requests
+    :return: the server, which has not been started
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
 
     deepproto.proto.poll.v1.poll_pb2_grpc.add_PollConfigServicer_to_server(
         PollServicer(), server)
-    deepproto.proto.tracepoint.v1.tracepoint_pb2_grpc.add_SnapshotServiceServicer_to_server(SnapshotServicer(), server)
-    server.add_insecure_port('[::]:43315')
+    deepproto.proto.tracepoint.v1.tracepoint_pb2_grpc.add_SnapshotServiceServicer_to_server(
+        snapshot_servicer or SnapshotServicer(), server)
+    server.add_insecure_port('[::]:%s' % port)
+    return server
+
+
+def serve():
+    """Set up and start a GRPC service on port 43315 to server Deep clients."""
+    server = create_server()
     server.start()
     server.wait_for_termination()
 
@@ -42,9 +58,28 @@ def serve():
 class SnapshotServicer(SnapshotServiceServicer):
     """Create class to handle snapshot send events."""
 
+    def __init__(self, quiet=False, latency_ms=0):
+        """
+        Create a new servicer.
+
+        :param quiet: if True, the snapshots are counted but not printed
+        :param latency_ms: the time to wait before responding, to simulate a remote service
+        """
+        self.quiet = quiet
+        self.latency = latency_ms / 1000
+        self.received = 0
+        self.received_bytes = 0
+        self.__lock = threading.Lock()
+
     def send(self, request, context):
         """Receive and process a snapshot request."""
-        print("hit", request.ID, request.attributes)
+        with self.__lock:
+            self.received += 1
+            self.received_bytes += request.ByteSize()
+        if not self.quiet:
+            print("hit", request.ID, request.attributes)
+        if self.latency > 0:
+            time.sleep(self.latency)
         return SnapshotResponse()
 
 
@@ -197,6 +197,9 @@ class BoundedAttributes(MutableMapping):
 
     def __iter__(self):
         """Create iterator."""
+        if getattr(self, "_immutable", False):
+            # immutable attributes cannot change while we iterate, so we do not need the lock or a copy
+            return iter(self._dict)
         with self._lock:
             return iter(self._dict.copy())
 
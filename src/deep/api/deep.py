@@ -49,7 +49,7 @@ class Deep:
         self.task_handler = TaskHandler()
         self.config.set_task_handler(self.task_handler)
         self.poll = LongPoll(self.config, self.grpc)
-        self.push = PushService(self.grpc, self.task_handler)
+        self.push = PushService(self.grpc, self.task_handler, self.config)
         self.trigger_handler = TriggerHandler(config, self.push)
 
     def start(self):
@@ -69,6 +69,7 @@ class Deep:
         self.config.resource = default_resource
         self.trigger_handler.start()
         self.grpc.start()
+        self.push.start()
         self.poll.start()
         self.started = True
 
@@ -79,6 +80,11 @@ class Deep:
         self.trigger_handler.shutdown()
         self.task_handler.flush()
         self.poll.shutdown()
+        # stop sending the spool before the channel is closed
+        self.push.stop()
+        self.grpc.shutdown()
+        # after the transport is shutdown, so snapshots that failed to send are written to the spool
+        self.push.shutdown()
         for plugin in self.config.plugins:
             plugin.shutdown()
         deep.logging.info("Deep is shutdown.")
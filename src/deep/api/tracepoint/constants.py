@@ -53,6 +53,12 @@ STACK = 'stack'
 NO_STACK = 'no_stack'
 """Do not collect the stack data"""
 
+ALL_THREADS = 'all_threads'
+"""Collect the full stack, and the stacks of all the other threads"""
+
+COLLAPSE_FRAMES = 'collapse_frames'
+"""This is the key to collapse runs of non app frames into a single frame"""
+
 LOG_MSG = 'log_msg'
 """The log message to interpolate at position of tracepoint"""
 
@@ -102,3 +108,9 @@ METHOD_STAGES = [METHOD_START, METHOD_CAPTURE, METHOD_END]
 
 WATCHES = "watches"
 """Key for watch config"""
+
+SNAPSHOT_DELTA = "snapshot_delta"
+"""Key to enable delta snapshots, only the changes from the last baseline snapshot are sent."""
+
+DELTA_BASELINE_INTERVAL = "delta_baseline_interval"
+"""The number of delta snapshots to send between each full baseline snapshot (default: 10)."""
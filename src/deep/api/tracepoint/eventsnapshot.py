@@ -19,14 +19,20 @@ import random
 from typing import Optional, Dict, List
 
 from deep.api.attributes import BoundedAttributes
-from deep.api.resource import Resource
 from deep.utils import time_ns
 
+VARIABLE_OVERHEAD = 32
+"""The approximate serialized size (in bytes) of a variable, excluding the type and value strings."""
+VARIABLE_ID_OVERHEAD = 16
+"""The approximate serialized size (in bytes) of a variable id, excluding the name."""
+FRAME_OVERHEAD = 32
+"""The approximate serialized size (in bytes) of a stack frame, excluding the file and method names."""
+
 
 class EventSnapshot:
     """This is the model for the snapshot that is uploaded to the services."""
 
-    def __init__(self, tracepoint, ts, resource, frames, var_lookup: Dict[str, 'Variable']):
+    def __init__(self, tracepoint, ts, resource, frames, var_lookup: Dict[int, 'Variable']):
         """
         Create a new snapshot object.
 
@@ -38,18 +44,28 @@ class EventSnapshot:
         """
         self._id = random.getrandbits(128)
         self._tracepoint = tracepoint
-        self._var_lookup: Dict[str, 'Variable'] = var_lookup
+        self._var_lookup: Dict[int, 'Variable'] = var_lookup
         self._ts_nanos = ts
         self._frames = frames
         self._watches = []
         self._attributes = BoundedAttributes(immutable=False)
         self._duration_nanos = 0
-        self._resource = Resource.get_empty().merge(resource)
+        # the resource is immutable, so all snapshots share the client resource rather than copying it
+        self._resource = resource
         self._log = None
+        self.delta_tracker = None
+        """The delta tracker that uses this snapshot as a baseline candidate, this is told if the snapshot is sent."""
+        self.captured_bytes: Optional[int] = None
+        """The size in bytes counted by the capture budget, or None if it is not known."""
+
+    def complete(self, captured_bytes: Optional[int] = None):
+        """
+        Close and complete the snapshot.
 
-    def complete(self):
-        """Close and complete the snapshot."""
+        :param captured_bytes: the size in bytes counted by the capture budget
+        """
         self._duration_nanos = time_ns() - self._ts_nanos
+        self.captured_bytes = captured_bytes
 
     def add_watch_result(self, watch_result: 'WatchResult'):
         """
@@ -60,7 +76,47 @@ class EventSnapshot:
         """
         self.watches.append(watch_result)
 
-    def merge_var_lookup(self, lookup: Dict[str, 'Variable']):
+    def truncate(self, reason: str):
+        """
+        Mark this snapshot as truncated.
+
+        A snapshot is truncated when we had to stop the data collection early (e.g. we ran out of time). The
+        reasons are added to the attributes as a comma separated list 'truncated_reasons'.
+
+        :param reason: the reason the snapshot was truncated
+        """
+        reasons = self._attributes.get('truncated_reasons', None)
+        if reasons is None:
+            reasons = reason
+        elif reason in reasons.split(','):
+            return
+        else:
+            reasons = reasons + ',' + reason
+        self._attributes['truncated'] = True
+        self._attributes['truncated_reasons'] = reasons
+
+    @property
+    def estimated_size(self) -> int:
+        """
+        An estimate of the serialized size of this snapshot in bytes.
+
+        The estimate only includes the captured data (frames, variables and watches), as this is the part of the
+        snapshot that can grow large.
+        """
+        size = 0
+        for variable in self._var_lookup.values():
+            size += variable.estimated_size
+            for child in variable.children:
+                size += child.estimated_size
+        for frame in self._frames:
+            size += FRAME_OVERHEAD + len(frame.file_name) + len(frame.method_name)
+            for variable_id in frame.variables:
+                size += variable_id.estimated_size
+        for watch in self._watches:
+            size += VARIABLE_ID_OVERHEAD + len(watch.expression)
+        return size
+
+    def merge_var_lookup(self, lookup: Dict[int, 'Variable']):
         """
         Merge additional variables into the var lookup.
 
@@ -182,6 +238,10 @@ class StackFrame:
         self._transpiled_column_number = transpiled_column_number
         self._variables = variables
         self._app_frame = app_frame
+        self.encoded = None
+        """The cached encoding of this frame, frames without variables can be shared between snapshots."""
+        self.encoded_bytes = None
+        """The cached wire encoding of this frame, see deep.push.encoder."""
 
     @property
     def file_name(self):
@@ -238,6 +298,19 @@ class StackFrame:
         """Variables captured on this frame."""
         return self._variables
 
+    def with_variables(self, variables: List['VariableId']) -> 'StackFrame':
+        """
+        Create a copy of this frame with different variables.
+
+        :param variables: the variables for the new frame
+        :return: the new frame, or this frame if the variables are the same
+        """
+        if variables == self._variables:
+            return self
+        return StackFrame(self._file_name, self._short_path, self._method_name, self._line_number, variables,
+                          self._class_name, self._async, self._column_number, self._transpiled_file_name,
+                          self._transpiled_line_number, self._transpiled_column_number, self._app_frame)
+
     @property
     def app_frame(self):
         """Is this frame in the user app."""
@@ -269,7 +342,7 @@ class Variable:
         :param value: the value as a string
         :param var_hash: the identity hash of the value
         :param children: list of child VariableIds
-        :param truncated: is the value string truncated.
+        :param truncated: is the value string, or the collected children, truncated.
         """
         self._type = var_type
         self._value = value
@@ -292,6 +365,11 @@ class Variable:
         """The identity hash of this value."""
         return self._hash
 
+    @property
+    def estimated_size(self) -> int:
+        """An estimate of the serialized size of this variable in bytes, excluding the children."""
+        return VARIABLE_OVERHEAD + len(self._type) + len(self._value)
+
     @property
     def children(self) -> List['VariableId']:
         """The children of this value."""
@@ -299,7 +377,7 @@ class Variable:
 
     @property
     def truncated(self):
-        """Is the string value truncated."""
+        """Is the string value, or the collected children, truncated."""
         return self._truncated
 
     def __str__(self) -> str:
@@ -362,6 +440,11 @@ class VariableId:
         """Get variable original name."""
         return self._original_name
 
+    @property
+    def estimated_size(self) -> int:
+        """An estimate of the serialized size of this variable id in bytes."""
+        return VARIABLE_ID_OVERHEAD + len(self._name)
+
     @property
     def modifiers(self):
         """Get variable modifiers."""
@@ -428,6 +511,11 @@ class WatchResult:
         """The good result."""
         return self._result
 
+    @result.setter
+    def result(self, result: Optional['VariableId']):
+        """Set the good result."""
+        self._result = result
+
     @property
     def error(self) -> Optional[str]:
         """The error."""
@@ -199,6 +199,8 @@ class TracePointConfig:
         self._line_no = line_no
         self._args = args
         self._watches = watches
+        self.encoded = None
+        """The cached wire encoding of this tracepoint, see deep.push.encoder."""
 
     @property
     def id(self):
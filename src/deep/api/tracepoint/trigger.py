@@ -37,7 +37,8 @@ from typing import Optional, Dict, List
 
 from deep.api.tracepoint.constants import WINDOW_START, WINDOW_END, FIRE_COUNT, FIRE_PERIOD, LOG_MSG, WATCHES, \
     LINE_START, METHOD_START, METHOD_END, LINE_END, LINE_CAPTURE, METHOD_CAPTURE, NO_COLLECT, SNAPSHOT, CONDITION, \
-    FRAME_TYPE, STACK_TYPE, SINGLE_FRAME_TYPE, STACK, SPAN, STAGE, METHOD_NAME, LINE_STAGES, METHOD_STAGES, METHOD
+    FRAME_TYPE, STACK_TYPE, SINGLE_FRAME_TYPE, STACK, SPAN, STAGE, METHOD_NAME, LINE_STAGES, METHOD_STAGES, METHOD, \
+    SNAPSHOT_DELTA, DELTA_BASELINE_INTERVAL, COLLAPSE_FRAMES
 from deep.api.tracepoint.tracepoint_config import TracepointWindow, TracepointExecutionStats, MetricDefinition, \
     TracePointConfig
 
@@ -85,6 +86,11 @@ class LocationAction(object):
         self.__stats = TracepointExecutionStats()
         self.__action_type = action_type
         self.__location: Optional['Location'] = None
+        self.delta_tracker = None
+        """The tracker used for delta snapshots, this is created when the first snapshot is captured."""
+        self.frame_config = None
+        """The frame processor config for snapshot actions, this is created when the config is installed."""
+        self.__tracepoint: Optional[TracePointConfig] = None
 
     @property
     def id(self) -> str:
@@ -143,14 +149,21 @@ class LocationAction(object):
 
     @property
     def tracepoint(self) -> TracePointConfig:
-        """Get the tracepoint config for this trigger."""
-        args = dict(self.__config)
-        if WATCHES in args:
-            del args[WATCHES]
-        if LOG_MSG in args and args[LOG_MSG] is None:
-            del args[LOG_MSG]
-        return TracePointConfig(self.id, self.__location.path, self.__location.line, args,
-                                self.__config.get(WATCHES, []), [])
+        """
+        Get the tracepoint config for this trigger.
+
+        The config of an action does not change, so this is created once and shared by all the snapshots for the
+        action.
+        """
+        if self.__tracepoint is None:
+            args = dict(self.__config)
+            if WATCHES in args:
+                del args[WATCHES]
+            if LOG_MSG in args and args[LOG_MSG] is None:
+                del args[LOG_MSG]
+            self.__tracepoint = TracePointConfig(self.id, self.__location.path, self.__location.line, args,
+                                                 self.__config.get(WATCHES, []), [])
+        return self.__tracepoint
 
     def __fire_period_ns(self):
         return self.fire_period * 1_000_000
@@ -326,6 +339,8 @@ class Trigger(Location):
         super().__init__()
         self.__location = location
         self.__actions = actions
+        self.frame_config = None
+        """The merged frame config of the snapshot actions, this is created when the config is installed."""
 
     def at_location(self, event: str, file: str, line: int, function_name: str, frame: FrameType) -> bool:
         """
@@ -390,6 +405,7 @@ class Trigger(Location):
     def merge_actions(self, actions: List[LocationAction]):
         """Merge more actions into this location."""
         self.__actions += actions
+        self.frame_config = None
 
 
 class LineLocation(Location):
@@ -561,14 +577,19 @@ def build_snapshot_action(tp_id: str, args: Dict[str, str], watches: List[str])
             return None
 
     condition = args[CONDITION] if CONDITION in args else None
-    return LocationAction(tp_id, condition, {
+    config = {
         WATCHES: watches,
         FRAME_TYPE: args.get(FRAME_TYPE, SINGLE_FRAME_TYPE),
         STACK_TYPE: args.get(STACK_TYPE, STACK),
         FIRE_COUNT: args.get(FIRE_COUNT, '1'),
         FIRE_PERIOD: args.get(FIRE_PERIOD, '1000'),
         LOG_MSG: args.get(LOG_MSG, None),
-    }, LocationAction.ActionType.Snapshot)
+    }
+    for key, value in args.items():
+        # pass through the collection limits (e.g. MAX_VAR_DEPTH), these are used to configure the frame collection
+        if key.startswith('MAX_') or key in [SNAPSHOT_DELTA, DELTA_BASELINE_INTERVAL, COLLAPSE_FRAMES]:
+            config[key] = value
+    return LocationAction(tp_id, condition, config, LocationAction.ActionType.Snapshot)
 
 
 def build_log_action(tp_id: str, args: Dict[str, str]) -> Optional[LocationAction]:
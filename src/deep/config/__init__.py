@@ -40,6 +40,88 @@ SERVICE_SECURE = os.getenv('DEEP_SERVICE_SECURE', 'True')
 SERVICE_AUTH_PROVIDER = os.getenv('DEEP_SERVICE_AUTH_PROVIDER', None)
 """The Auth provider to use for the service (default: None)"""
 
+GRPC_TRANSPORT = os.getenv('DEEP_GRPC_TRANSPORT', 'sync')
+"""The transport to use for the calls to the service, 'sync' for blocking calls on the task threads, or 'aio' for
+asynchronous calls on a single event loop thread (default: sync)"""
+
+GRPC_COMPRESSION = os.getenv('DEEP_GRPC_COMPRESSION', 'none')
+"""The compression for the calls to the service, one of 'none', 'gzip' or 'deflate' (default: none)"""
+
+GRPC_COMPRESSION_THRESHOLD = os.getenv('DEEP_GRPC_COMPRESSION_THRESHOLD', 1024)
+"""The size in bytes below which messages are sent uncompressed, 0 to compress all messages (default: 1024)"""
+
+GRPC_KEEPALIVE_TIME_MS = os.getenv('DEEP_GRPC_KEEPALIVE_TIME_MS', 0)
+"""The time in milliseconds between keepalive pings on the channel, 0 to disable (default: 0)"""
+
+GRPC_KEEPALIVE_TIMEOUT_MS = os.getenv('DEEP_GRPC_KEEPALIVE_TIMEOUT_MS', 10000)
+"""The time in milliseconds to wait for a keepalive ping to be acknowledged (default: 10000)"""
+
+GRPC_MAX_SEND_MESSAGE_BYTES = os.getenv('DEEP_GRPC_MAX_SEND_MESSAGE_BYTES', 16777216)
+"""The max size in bytes of a message sent on the channel (default: 16777216)"""
+
+GRPC_MAX_RECEIVE_MESSAGE_BYTES = os.getenv('DEEP_GRPC_MAX_RECEIVE_MESSAGE_BYTES', 4194304)
+"""The max size in bytes of a message received on the channel (default: 4194304)"""
+
+GRPC_MAX_RECONNECT_BACKOFF_MS = os.getenv('DEEP_GRPC_MAX_RECONNECT_BACKOFF_MS', 5000)
+"""The max time in milliseconds to wait between attempts to reconnect the channel (default: 5000)"""
+
+GRPC_SERVICE_CONFIG = os.getenv('DEEP_GRPC_SERVICE_CONFIG', None)
+"""The gRPC service config (as JSON) for the channel, e.g. to set the load balancing policy (default: None)"""
+
+POLL_TIMEOUT = os.getenv('DEEP_POLL_TIMEOUT', 10)
+"""The deadline in seconds for each poll request (default: 10)"""
+
+PUSH_TIMEOUT = os.getenv('DEEP_PUSH_TIMEOUT', 10)
+"""The deadline in seconds for each snapshot upload (default: 10)"""
+
+GRPC_MAX_RETRIES = os.getenv('DEEP_GRPC_MAX_RETRIES', 3)
+"""The number of times to retry a call that failed as the service is unavailable (default: 3)"""
+
+GRPC_RETRY_BACKOFF_MS = os.getenv('DEEP_GRPC_RETRY_BACKOFF_MS', 100)
+"""The base time in milliseconds to wait before retrying a call, this is doubled for each retry (default: 100)"""
+
+GRPC_RETRY_MAX_BACKOFF_MS = os.getenv('DEEP_GRPC_RETRY_MAX_BACKOFF_MS', 2000)
+"""The max time in milliseconds to wait before retrying a call (default: 2000)"""
+
+CIRCUIT_BREAKER_FAILURES = os.getenv('DEEP_CIRCUIT_BREAKER_FAILURES', 5)
+"""The number of consecutive failed calls that open the circuit breaker, 0 to disable (default: 5)"""
+
+CIRCUIT_BREAKER_RESET = os.getenv('DEEP_CIRCUIT_BREAKER_RESET', 30)
+"""The time in seconds to wait, once the circuit breaker is open, before probing the service (default: 30)"""
+
+MAX_SNAPSHOT_BYTES = os.getenv('DEEP_MAX_SNAPSHOT_BYTES', 1048576)
+"""The max (estimated) size in bytes of the data captured for a snapshot (default: 1048576)"""
+
+MAX_PENDING_SNAPSHOT_BYTES = os.getenv('DEEP_MAX_PENDING_SNAPSHOT_BYTES', 16777216)
+"""The max (estimated) size in bytes of the snapshots waiting to be sent, new snapshots are dropped when this is
+exceeded (default: 16777216)"""
+
+MAX_PENDING_SNAPSHOTS = os.getenv('DEEP_MAX_PENDING_SNAPSHOTS', 1000)
+"""The max number of snapshots waiting to be sent (default: 1000)"""
+
+PUSH_DROP_POLICY = os.getenv('DEEP_PUSH_DROP_POLICY', 'drop_newest')
+"""The policy used when the pending snapshot limits are exceeded, one of 'drop_newest', 'drop_oldest' or 'coalesce'
+(default: drop_newest)"""
+
+PUSH_BATCH_SIZE = os.getenv('DEEP_PUSH_BATCH_SIZE', 50)
+"""The max number of snapshots to send in a batch (default: 50)"""
+
+PUSH_BATCH_BYTES = os.getenv('DEEP_PUSH_BATCH_BYTES', 4194304)
+"""The max (estimated) size in bytes of the snapshots to send in a batch (default: 4194304)"""
+
+PUSH_BATCH_LINGER_MS = os.getenv('DEEP_PUSH_BATCH_LINGER_MS', 0)
+"""The time in milliseconds to wait for more snapshots before sending a batch (default: 0)"""
+
+SPOOL_PATH = os.getenv('DEEP_SPOOL_PATH', None)
+"""The path to the file used to spool snapshots that cannot be sent, if not set snapshots are not spooled
+(default: None)"""
+
+SPOOL_MAX_BYTES = os.getenv('DEEP_SPOOL_MAX_BYTES', 67108864)
+"""The size in bytes of the spool file, the oldest snapshots are dropped when it is full (default: 67108864)"""
+
+SPOOL_DRAIN_INTERVAL = os.getenv('DEEP_SPOOL_DRAIN_INTERVAL', 5)
+"""The time in seconds between writing the spool file, and sending the spooled snapshots (default: 5)"""
+
 APP_ROOT = ""
 """App root sets the prefix that can be removed to generate shorter file names. This value is calculated."""
 
@@ -163,6 +163,11 @@ class ConfigService:
         """Is there a configured metric processor."""
         return self._find_plugin(SpanProcessor) is not None
 
+    @property
+    def app_frame_config(self) -> Tuple[str, Tuple[str, ...], Tuple[str, ...]]:
+        """The config used by :meth:`is_app_frame` (APP_ROOT, IN_APP_INCLUDE and IN_APP_EXCLUDE)."""
+        return self.APP_ROOT, tuple(self.IN_APP_INCLUDE), tuple(self.IN_APP_EXCLUDE)
+
     def is_app_frame(self, filename: str) -> Tuple[bool, Optional[str]]:
         """
         Check if the current frame is a user application frame.
@@ -0,0 +1,116 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+An asynchronous transport for the calls to the deep services, using grpc.aio.
+
+The default transport makes blocking calls on the task handler threads, so the number of uploads in flight is limited
+by the number of threads. This transport runs a private event loop on a single thread, and the calls are made as
+coroutines on that loop, so many uploads can be in flight at once.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Coroutine, Set
+
+from deep import logging
+
+SYNC = "sync"
+"""Make blocking calls on the task handler threads."""
+AIO = "aio"
+"""Make asynchronous calls on a private event loop thread."""
+
+
+class AioTransport:
+    """Run grpc.aio calls on a private event loop thread."""
+
+    def __init__(self):
+        """Create a new transport."""
+        self.channel = None
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__run, name="Deep gRPC aio", daemon=True)
+        self.__pending: Set[Future] = set()
+        self.__lock = threading.Lock()
+
+    def start(self, channel_factory: Callable):
+        """
+        Start the event loop thread, and create the channel.
+
+        :param channel_factory: function to create the grpc.aio channel, this is called on the event loop
+        """
+        self.__thread.start()
+
+        async def create():
+            # aio channels are bound to the loop they are created on
+            return channel_factory()
+
+        self.channel = asyncio.run_coroutine_threadsafe(create(), self.__loop).result()
+
+    @property
+    def in_loop_thread(self) -> bool:
+        """True, if the current thread is the event loop thread."""
+        return threading.current_thread() is self.__thread
+
+    def __run(self):
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
+
+    def submit(self, coro: Coroutine, track: bool = True) -> Future:
+        """
+        Run a coroutine on the event loop.
+
+        :param coro: the coroutine to run
+        :param track: if False, the coroutine is not waited for by flush, use this for loops that run until cancelled
+        :return: a future that can be listened to for completion
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.__loop)
+        if track:
+            with self.__lock:
+                self.__pending.add(future)
+
+        def callback(_future: Future):
+            with self.__lock:
+                self.__pending.discard(_future)
+            if not _future.cancelled() and _future.exception() is not None:
+                logging.error("Submitted coroutine failed %s: %s", coro, _future.exception())
+
+        future.add_done_callback(callback)
+        return future
+
+    def flush(self, timeout: float = 10):
+        """
+        Await completion of the pending coroutines.
+
+        :param timeout: the time in seconds to wait for each coroutine
+        """
+        with self.__lock:
+            pending = list(self.__pending)
+        for future in pending:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+    def shutdown(self):
+        """Wait for the pending coroutines, then close the channel and stop the event loop."""
+        if not self.__thread.is_alive():
+            return
+        self.flush()
+        if self.channel is not None:
+            asyncio.run_coroutine_threadsafe(self.channel.close(), self.__loop).result(10)
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
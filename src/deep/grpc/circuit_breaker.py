@@ -0,0 +1,133 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A circuit breaker for the calls to the deep services.
+
+When the service is down every call waits for its deadline (and retries) before failing. The circuit breaker counts
+the consecutive failures, and once the threshold is reached it 'opens', so that calls fail fast. After the reset time
+a single call is allowed through as a probe, if it succeeds the breaker closes, if it fails the breaker opens again.
+"""
+
+import threading
+import time
+from typing import Optional
+
+from deep import logging
+
+CLOSED = "closed"
+"""Calls are allowed."""
+OPEN = "open"
+"""Calls are rejected, until the reset time has passed."""
+HALF_OPEN = "half_open"
+"""A single call is allowed, to probe if the service has recovered."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected as the circuit breaker is open."""
+
+    pass
+
+
+class CircuitBreaker:
+    """Track the failures of the calls to a service, and reject calls while the service is down."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        Create a new circuit breaker.
+
+        :param failure_threshold: the number of consecutive failures that open the breaker, 0 to disable the breaker
+        :param reset_timeout: the time in seconds to wait, once open, before probing the service
+        """
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__state = CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """The current state of the breaker."""
+        return self.__state
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Is the breaker open, and not ready to probe the service.
+
+        This does not change the state of the breaker, so can be used to skip work for calls that would be rejected.
+        """
+        with self.__lock:
+            return self.__state == OPEN and time.monotonic() - self.__opened_at < self.__reset_timeout
+
+    def allow(self) -> bool:
+        """
+        Check if a call is allowed.
+
+        :return: True, if the call is allowed
+        """
+        return self.admit() is not None
+
+    def admit(self) -> Optional[str]:
+        """
+        Check if a call is allowed, and if it is the probe.
+
+        If the breaker is open, and the reset time has passed, the breaker moves to half open and this call is
+        allowed as the probe. Any other call is rejected until the result of the probe is recorded, or the probe is
+        released.
+
+        :return: None if the call is rejected, HALF_OPEN if the call is the probe, otherwise CLOSED
+        """
+        with self.__lock:
+            if self.__state == CLOSED:
+                return CLOSED
+            if self.__state == OPEN and time.monotonic() - self.__opened_at >= self.__reset_timeout:
+                logging.debug("Circuit breaker half open, probing service")
+                self.__state = HALF_OPEN
+                return HALF_OPEN
+            return None
+
+    def release_probe(self):
+        """
+        End the probe, if its result was not recorded (e.g. the call was cancelled).
+
+        The breaker moves back to open, and the next call is allowed as a new probe.
+        """
+        with self.__lock:
+            if self.__state == HALF_OPEN:
+                self.__state = OPEN
+                self.__opened_at = time.monotonic() - self.__reset_timeout
+
+    def record_success(self):
+        """Record a successful call, this closes the breaker."""
+        with self.__lock:
+            if self.__state != CLOSED:
+                logging.info("Circuit breaker closed, service has recovered")
+            self.__state = CLOSED
+            self.__failures = 0
+
+    def record_failure(self):
+        """Record a failed call, this opens the breaker if the threshold is reached, or the probe failed."""
+        with self.__lock:
+            self.__failures += 1
+            if self.__failure_threshold <= 0:
+                return
+            if self.__state == HALF_OPEN or (self.__state == CLOSED and self.__failures >= self.__failure_threshold):
+                if self.__state == CLOSED:
+                    logging.warning("Circuit breaker open after %s failures, calls will be rejected for %s seconds",
+                                    self.__failures, self.__reset_timeout)
+                self.__state = OPEN
+                self.__opened_at = time.monotonic()
@@ -15,12 +15,40 @@
 
 """Service for connecting to GRPC channel."""
 
+import asyncio
+import concurrent.futures
+import random
+import time
+from typing import List, Optional, Dict, Tuple, Any
+
 import grpc
+from google.protobuf.message import Message
 
 from deep import logging
 from deep.api.auth import AuthProvider
 from deep.config import ConfigService
 from deep.utils import str2bool
+from .aio_transport import AioTransport, AIO, SYNC
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, HALF_OPEN
+
+RETRYABLE_CODES = frozenset([grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                             grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.ABORTED])
+"""The status codes that indicate the service is (temporarily) unavailable, and the call can be retried."""
+
+COMPRESSION = {'none': grpc.Compression.NoCompression, 'gzip': grpc.Compression.Gzip,
+               'deflate': grpc.Compression.Deflate}
+"""The supported compression algorithms, by config name."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check if a failed call can be retried.
+
+    :param error: the error raised by the call
+    :return: True, if the call failed with a retryable status code
+    """
+    return isinstance(error, grpc.RpcError) and callable(getattr(error, 'code', None)) \
+        and error.code() in RETRYABLE_CODES
 
 
 class GRPCService:
@@ -33,21 +61,146 @@ class GRPCService:
         :param config: the deep config
         """
         self.channel = None
+        self.transport: Optional[AioTransport] = None
+        """The asynchronous transport, if the 'aio' transport is configured and the service is started."""
         self._config = config
         self._service_url = config.SERVICE_URL
         self._secure = config.SERVICE_SECURE
         self._metadata = None
+        self._transport = config.GRPC_TRANSPORT
+        self._compression = COMPRESSION.get(str(config.GRPC_COMPRESSION).lower())
+        self._compression_threshold = int(config.GRPC_COMPRESSION_THRESHOLD)
+        self._max_retries = int(config.GRPC_MAX_RETRIES)
+        self._retry_backoff = int(config.GRPC_RETRY_BACKOFF_MS) / 1000
+        self._retry_max_backoff = int(config.GRPC_RETRY_MAX_BACKOFF_MS) / 1000
+        self.circuit_breaker = CircuitBreaker(int(config.CIRCUIT_BREAKER_FAILURES),
+                                              float(config.CIRCUIT_BREAKER_RESET))
+        self.connectivity: Optional[grpc.ChannelConnectivity] = None
+        """The last known connectivity state of the channel."""
+        self.__stubs: Dict[type, Tuple[Any, Any]] = {}
+        self.__ready_future = None
+        self.__watch_task = None
 
     def start(self):
         """Start and connect the GRPC channel."""
+        if self._transport == AIO:
+            logging.info("Using asynchronous transport")
+            self.transport = AioTransport()
+            self.transport.start(lambda: self.__create_channel(grpc.aio))
+            self.channel = self.transport.channel
+            self.__watch_task = self.transport.submit(self.__watch_connectivity(self.channel), track=False)
+        else:
+            if self._transport != SYNC:
+                logging.warning("Unknown transport %s, using %s", self._transport, SYNC)
+            self.channel = self.__create_channel(grpc)
+            self.channel.subscribe(self.__on_connectivity, try_to_connect=True)
+
+    def __create_channel(self, module):
+        options = self.channel_options()
+        compression = self._compression
+        if compression is None:
+            logging.warning("Unknown compression %s, compression is disabled", self._config.GRPC_COMPRESSION)
         if str2bool(self._secure):
             logging.info("Connecting securely")
             logging.debug("Connecting securely to: %s", self._service_url)
-            self.channel = grpc.secure_channel(self._service_url, grpc.ssl_channel_credentials())
+            return module.secure_channel(self._service_url, grpc.ssl_channel_credentials(), options=options,
+                                         compression=compression)
         else:
             logging.info("Connecting with insecure channel")
             logging.debug("Connecting with insecure channel to: %s ", self._service_url)
-            self.channel = grpc.insecure_channel(self._service_url)
+            return module.insecure_channel(self._service_url, options=options, compression=compression)
+
+    def channel_options(self) -> List[Tuple[str, Any]]:
+        """
+        Get the options to create the channel with, from the config.
+
+        :return: the channel options
+        """
+        config = self._config
+        options = [
+            ('grpc.max_send_message_length', int(config.GRPC_MAX_SEND_MESSAGE_BYTES)),
+            ('grpc.max_receive_message_length', int(config.GRPC_MAX_RECEIVE_MESSAGE_BYTES)),
+            ('grpc.max_reconnect_backoff_ms', int(config.GRPC_MAX_RECONNECT_BACKOFF_MS)),
+        ]
+        keepalive = int(config.GRPC_KEEPALIVE_TIME_MS)
+        if keepalive > 0:
+            options.append(('grpc.keepalive_time_ms', keepalive))
+            options.append(('grpc.keepalive_timeout_ms', int(config.GRPC_KEEPALIVE_TIMEOUT_MS)))
+        if config.GRPC_SERVICE_CONFIG:
+            options.append(('grpc.service_config', config.GRPC_SERVICE_CONFIG))
+        return options
+
+    def call_compression(self, request) -> Optional[grpc.Compression]:
+        """
+        Select the compression for a call.
+
+        Small messages gain little from compression, so messages below the threshold are sent uncompressed.
+
+        :param request: the request message
+        :return: the compression to use, or None to use the channel default
+        """
+        if self._compression is None or self._compression == grpc.Compression.NoCompression:
+            return None
+        if self._compression_threshold > 0 and self.__size(request) < self._compression_threshold:
+            return grpc.Compression.NoCompression
+        return self._compression
+
+    @staticmethod
+    def __size(request) -> int:
+        if isinstance(request, (bytes, bytearray)):
+            # the request is already encoded
+            return len(request)
+        if isinstance(request, Message):
+            return request.ByteSize()
+        return 0
+
+    def stub(self, stub_type):
+        """
+        Get a stub for the channel.
+
+        Stubs are cached, and only created again if the channel changes.
+
+        :param stub_type: the type of stub, e.g. SnapshotServiceStub
+        :return: the stub
+        """
+        cached = self.__stubs.get(stub_type)
+        if cached is not None and cached[0] is self.channel:
+            return cached[1]
+        stub = stub_type(self.channel)
+        self.__stubs[stub_type] = (self.channel, stub)
+        return stub
+
+    def __on_connectivity(self, state: grpc.ChannelConnectivity):
+        logging.debug("Channel connectivity changed to %s", state)
+        self.connectivity = state
+        if state == grpc.ChannelConnectivity.IDLE and self.channel is not None:
+            # the connection was dropped (e.g. by the server or after a network blip), so reconnect now rather than
+            # on the next call
+            if self.__ready_future is not None:
+                self.__ready_future.cancel()
+            self.__ready_future = grpc.channel_ready_future(self.channel)
+
+    async def __watch_connectivity(self, channel):
+        state = channel.get_state(try_to_connect=True)
+        while True:
+            self.connectivity = state
+            await channel.wait_for_state_change(state)
+            state = channel.get_state(try_to_connect=True)
+            logging.debug("Channel connectivity changed to %s", state)
+
+    def shutdown(self):
+        """Stop the connectivity watch, and the asynchronous transport if it is running."""
+        if self.__ready_future is not None:
+            self.__ready_future.cancel()
+            self.__ready_future = None
+        if self.__watch_task is not None:
+            self.__watch_task.cancel()
+            self.__watch_task = None
+        if self.transport is not None:
+            self.transport.shutdown()
+            self.transport = None
+        elif self.channel is not None and hasattr(self.channel, 'unsubscribe'):
+            self.channel.unsubscribe(self.__on_connectivity)
 
     def metadata(self):
         """
@@ -66,3 +219,221 @@ class GRPCService:
         if provider is not None:
             return provider.provide()
         return []
+
+    def call(self, rpc, request, timeout: float):
+        """
+        Make a unary call, with a deadline, retrying if the service is unavailable.
+
+        Retries use exponential backoff with full jitter. The result of each attempt is recorded in the circuit
+        breaker, and no more attempts are made once the breaker is open.
+
+        :param rpc: the stub method to call
+        :param request: the request message
+        :param timeout: the deadline, in seconds, for each attempt
+        :return: the response
+        :raises CircuitOpenError: if the circuit breaker is open
+        :raises grpc.RpcError: if the call failed
+        """
+        if self.transport is not None:
+            return self.__wait(self.call_async(rpc, request, timeout), timeout)
+        probe = self.__admit()
+        try:
+            return self._attempt(rpc, request, timeout, 0)
+        finally:
+            if probe:
+                self.circuit_breaker.release_probe()
+
+    def call_all(self, rpc, requests: List, timeout: float) -> List[Optional[Exception]]:
+        """
+        Make a unary call for each request.
+
+        All the calls are started before waiting, so they are sent concurrently on the channel. Calls that fail with
+        a retryable status are then retried, one at a time, as with :meth:`call`.
+
+        :param rpc: the stub method to call
+        :param requests: the request messages
+        :param timeout: the deadline, in seconds, for each attempt
+        :return: the error for each request, or None if the call succeeded
+        """
+        if self.transport is not None:
+            try:
+                return self.__wait(self.call_all_async(rpc, requests, timeout), timeout)
+            except concurrent.futures.TimeoutError as e:
+                return [e for _ in requests]
+        try:
+            probe = self.__admit()
+        except CircuitOpenError as e:
+            return [e for _ in requests]
+        # only a single call is sent to probe the service, the rest are sent once it has recovered
+        sending = requests[:1] if probe else requests
+        try:
+            errors = self.__send_all(rpc, sending, timeout)
+        finally:
+            if probe:
+                self.circuit_breaker.release_probe()
+        if len(sending) < len(requests):
+            errors += self.call_all(rpc, requests[len(sending):], timeout)
+        return errors
+
+    def __admit(self) -> bool:
+        """
+        Check the circuit breaker allows a call.
+
+        :return: True, if the call is the probe of a half open breaker, it must be released once the call ends
+        :raises CircuitOpenError: if the circuit breaker is open
+        """
+        state = self.circuit_breaker.admit()
+        if state is None:
+            raise CircuitOpenError("Circuit breaker is open, call to %s rejected" % self._service_url)
+        return state == HALF_OPEN
+
+    def __send_all(self, rpc, requests: List, timeout: float) -> List[Optional[Exception]]:
+        metadata = self.metadata()
+        calls = [rpc.future(request, metadata=metadata, timeout=timeout, compression=self.call_compression(request))
+                 for request in requests]
+        errors = []
+        for request, call in zip(requests, calls):
+            try:
+                call.result()
+                self.circuit_breaker.record_success()
+                errors.append(None)
+            except Exception as e:
+                errors.append(self.__retry(rpc, request, timeout, e))
+        return errors
+
+    def __retry(self, rpc, request, timeout: float, error: Exception) -> Optional[Exception]:
+        if not is_retryable(error):
+            self.circuit_breaker.record_success()
+            return error
+        self.circuit_breaker.record_failure()
+        if self._max_retries < 1 or self.circuit_breaker.is_open:
+            return error
+        try:
+            self.__backoff(1)
+            self._attempt(rpc, request, timeout, 1)
+            return None
+        except Exception as e:
+            return e
+
+    def _attempt(self, rpc, request, timeout: float, attempt: int):
+        while True:
+            try:
+                response = rpc(request, metadata=self.metadata(), timeout=timeout,
+                               compression=self.call_compression(request))
+                self.circuit_breaker.record_success()
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    # the service responded, so it is not down
+                    self.circuit_breaker.record_success()
+                    raise
+                self.circuit_breaker.record_failure()
+                attempt += 1
+                if attempt > self._max_retries or self.circuit_breaker.is_open:
+                    raise
+                logging.debug("Call failed with %s, retrying (attempt %s)", e.code(), attempt)
+                self.__backoff(attempt)
+
+    async def call_async(self, rpc, request, timeout: float):
+        """
+        Make a unary call on the asynchronous transport, as with :meth:`call`.
+
+        This must be awaited on the transport event loop.
+
+        :param rpc: the grpc.aio stub method to call
+        :param request: the request message
+        :param timeout: the deadline, in seconds, for each attempt
+        :return: the response
+        :raises CircuitOpenError: if the circuit breaker is open
+        :raises grpc.RpcError: if the call failed
+        """
+        probe = self.__admit()
+        try:
+            return await self._attempt_async(rpc, request, timeout)
+        finally:
+            if probe:
+                self.circuit_breaker.release_probe()
+
+    async def call_all_async(self, rpc, requests: List, timeout: float) -> List[Optional[Exception]]:
+        """
+        Make a unary call for each request on the asynchronous transport, as with :meth:`call_all`.
+
+        All the calls, and their retries, run concurrently on the event loop.
+
+        :param rpc: the grpc.aio stub method to call
+        :param requests: the request messages
+        :param timeout: the deadline, in seconds, for each attempt
+        :return: the error for each request, or None if the call succeeded
+        """
+        try:
+            probe = self.__admit()
+        except CircuitOpenError as e:
+            return [e for _ in requests]
+
+        async def call_one(request) -> Optional[Exception]:
+            try:
+                await self._attempt_async(rpc, request, timeout)
+                return None
+            except Exception as e:
+                return e
+
+        # only a single call is sent to probe the service, the rest are sent once it has recovered
+        sending = requests[:1] if probe else requests
+        try:
+            errors = list(await asyncio.gather(*[call_one(request) for request in sending]))
+        finally:
+            if probe:
+                self.circuit_breaker.release_probe()
+        if len(sending) < len(requests):
+            errors += await self.call_all_async(rpc, requests[len(sending):], timeout)
+        return errors
+
+    async def _attempt_async(self, rpc, request, timeout: float):
+        attempt = 0
+        while True:
+            try:
+                response = await rpc(request, metadata=self.metadata(), timeout=timeout,
+                                     compression=self.call_compression(request))
+                self.circuit_breaker.record_success()
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    self.circuit_breaker.record_success()
+                    raise
+                self.circuit_breaker.record_failure()
+                attempt += 1
+                if attempt > self._max_retries or self.circuit_breaker.is_open:
+                    raise
+                logging.debug("Call failed with %s, retrying (attempt %s)", e.code(), attempt)
+                await asyncio.sleep(self.__backoff_delay(attempt))
+
+    def __wait(self, coro, timeout: Optional[float]):
+        """
+        Run a call on the asynchronous transport, and wait for the result.
+
+        :param coro: the coroutine making the call
+        :param timeout: the deadline, in seconds, for each attempt of the call
+        :return: the result of the call
+        :raises RuntimeError: if this is called on the event loop thread, as waiting would block the loop
+        :raises concurrent.futures.TimeoutError: if the call did not complete in time for all its attempts
+        """
+        if self.transport.in_loop_thread:
+            coro.close()
+            raise RuntimeError("Cannot make a blocking gRPC call on the event loop thread, use the async calls")
+        wait = None
+        if timeout is not None:
+            # allow time for every attempt, and the longest backoff between them
+            wait = timeout * (self._max_retries + 1) + self._retry_max_backoff * self._max_retries
+        future = self.transport.submit(coro)
+        try:
+            return future.result(wait)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def __backoff(self, attempt: int):
+        time.sleep(self.__backoff_delay(attempt))
+
+    def __backoff_delay(self, attempt: int) -> float:
+        delay = min(self._retry_max_backoff, self._retry_backoff * (2 ** (attempt - 1)))
+        return random.uniform(0, delay)
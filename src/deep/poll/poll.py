@@ -20,16 +20,32 @@ Deep needs to maintain a config of the tracepoints configured by the users. The
  periodically polling the long poll service.
 """
 
+import asyncio
+
 # noinspection PyUnresolvedReferences
-from deepproto.proto.poll.v1.poll_pb2 import PollRequest, ResponseType
-from deepproto.proto.poll.v1.poll_pb2_grpc import PollConfigStub
+from deepproto.proto.poll.v1.poll_pb2 import PollRequest, PollResponse, ResponseType
 
 from deep import logging
 from deep.config import ConfigService
 from deep.grpc import convert_resource, convert_response, GRPCService
+from deep.grpc.circuit_breaker import CircuitOpenError
 from deep.utils import time_ns, RepeatedTimer
 
 
+class EncodedPollConfigStub:
+    """A stub for the poll service, that sends requests that are already encoded."""
+
+    def __init__(self, channel):
+        """
+        Create a new stub.
+
+        :param channel: the grpc channel
+        """
+        self.poll = channel.unary_unary('/deepproto.proto.poll.v1.PollConfig/poll',
+                                        request_serializer=None,
+                                        response_deserializer=PollResponse.FromString)
+
+
 class LongPoll(object):
     """This service deals with polling the remote service to get the tracepoint configs."""
 
@@ -43,13 +59,21 @@ class LongPoll(object):
         self.config = config
         self.grpc = grpc
         self.timer = None
+        self.__poll_task = None
+        self.__template = (None, None, b'')
 
     def start(self):
         """Start the long poll service."""
         logging.info("Starting Long Poll system")
-        self.timer = RepeatedTimer("Tracepoint Long Poll", self.config.POLL_TIMER, self.poll)
+        if self.grpc.transport is None:
+            self.timer = RepeatedTimer("Tracepoint Long Poll", self.config.POLL_TIMER, self.poll)
         self.__initial_poll()
-        self.timer.start()
+        if self.timer is not None:
+            self.timer.start()
+        else:
+            # poll on the transport event loop, rather than a dedicated thread
+            poll_loop = self.__poll_loop(float(self.config.POLL_TIMER))
+            self.__poll_task = self.grpc.transport.submit(poll_loop, track=False)
 
     def __initial_poll(self):
         try:
@@ -59,11 +83,42 @@ class LongPoll(object):
 
     def poll(self):
         """Check with the Deep servers for changes to the tracepoint config."""
-        stub = PollConfigStub(self.grpc.channel)
-        request = PollRequest(ts_nanos=time_ns(), current_hash=self.config.tracepoints.current_hash,
-                              resource=convert_resource(self.config.resource))
-        response = stub.poll(request, metadata=self.grpc.metadata())
+        stub = self.grpc.stub(EncodedPollConfigStub)
+        try:
+            response = self.grpc.call(stub.poll, self.__request(), float(self.config.POLL_TIMEOUT))
+        except CircuitOpenError:
+            logging.debug("Skipping poll, circuit breaker is open")
+            return
+        self.__process(response)
+
+    async def __poll_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.__poll_async()
+            except CircuitOpenError:
+                logging.debug("Skipping poll, circuit breaker is open")
+            except Exception:
+                logging.exception("Poll failed, will retry in %s seconds." % interval)
+
+    async def __poll_async(self):
+        stub = self.grpc.stub(EncodedPollConfigStub)
+        response = await self.grpc.call_async(stub.poll, self.__request(), float(self.config.POLL_TIMEOUT))
+        self.__process(response)
+
+    def __request(self) -> bytes:
+        # only the timestamp changes between most polls, so the rest of the request is encoded once and reused
+        # until the resource or the config hash changes
+        resource = self.config.resource
+        current_hash = self.config.tracepoints.current_hash
+        cached_resource, cached_hash, encoded = self.__template
+        if cached_resource is not resource or cached_hash != current_hash:
+            encoded = PollRequest(current_hash=current_hash, resource=convert_resource(resource)).SerializeToString()
+            self.__template = (resource, current_hash, encoded)
+        # fields can be encoded in any order, ts_nanos is a fixed64 (field 1)
+        return b'\x09' + time_ns().to_bytes(8, "little") + encoded
 
+    def __process(self, response):
         if response.response_type == ResponseType.NO_CHANGE:
             logging.debug("No Change in config.")
             self.config.tracepoints.update_no_change(response.ts_nanos)
@@ -76,3 +131,6 @@ class LongPoll(object):
         if self.timer:
             self.timer.stop()
         self.timer = None
+        if self.__poll_task is not None:
+            self.__poll_task.cancel()
+        self.__poll_task = None
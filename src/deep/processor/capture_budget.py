@@ -0,0 +1,117 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Limit the resources that are used when capturing data."""
+
+from typing import List, Optional
+
+from deep.utils import time_ns
+
+TRUNCATED_TIME = "max_tp_process_time"
+"""The capture was stopped as the time limit was exceeded."""
+TRUNCATED_BYTES = "max_snapshot_bytes"
+"""The capture was stopped as the size limit was exceeded."""
+TRUNCATED_FRAMES = "max_frames"
+"""The stack was truncated as it has more frames than the frame limit."""
+
+
+class CaptureBudget:
+    """
+    The budget for capturing data for an action.
+
+    The budget is shared by all the processing for an action (frames, watches, logs and captures), so that the
+    processing can be stopped, with a partial result, when the budget is used up. Once the budget has been exceeded
+    it remains exceeded.
+    """
+
+    CHECK_INTERVAL = 32
+    """The number of nodes to process between checks of the clock."""
+
+    def __init__(self, start_ns: int, max_time_ms: int, max_bytes: Optional[int] = None):
+        """
+        Create a new budget.
+
+        :param start_ns: the time (in nanoseconds) the capture started
+        :param max_time_ms: the max time (in milliseconds) to spend capturing data
+        :param max_bytes: the max (estimated) size in bytes of the captured data, or None for no limit
+        """
+        self.__deadline = start_ns + int(max_time_ms) * 1000000
+        self.__max_bytes = max_bytes
+        self.__bytes = 0
+        self.__ticks = 0
+        self.__reasons: List[str] = []
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        """The max (estimated) size in bytes of the captured data, or None for no limit."""
+        return self.__max_bytes
+
+    @property
+    def bytes_used(self) -> int:
+        """The (estimated) size in bytes of the data captured so far."""
+        return self.__bytes
+
+    @property
+    def reasons(self) -> List[str]:
+        """The reasons the budget has been exceeded."""
+        return self.__reasons
+
+    def exceeded(self) -> bool:
+        """
+        Check if the budget has been exceeded.
+
+        :return: True, if the budget has been exceeded.
+        """
+        if len(self.__reasons) > 0:
+            return True
+        if time_ns() > self.__deadline:
+            self.mark_exceeded(TRUNCATED_TIME)
+            return True
+        return False
+
+    def tick(self) -> bool:
+        """
+        Record the processing of a node, and periodically check the budget.
+
+        :return: True, if the budget has been exceeded.
+        """
+        if len(self.__reasons) > 0:
+            return True
+        self.__ticks += 1
+        if self.__ticks % self.CHECK_INTERVAL == 0:
+            return self.exceeded()
+        return False
+
+    def add_bytes(self, size: int) -> bool:
+        """
+        Record the size of newly captured data.
+
+        :param size: the (estimated) size in bytes of the data
+        :return: True, if the budget has been exceeded.
+        """
+        self.__bytes += size
+        if self.__max_bytes is not None and self.__bytes > self.__max_bytes:
+            self.mark_exceeded(TRUNCATED_BYTES)
+            return True
+        return False
+
+    def mark_exceeded(self, reason: str):
+        """
+        Mark this budget as exceeded.
+
+        :param reason: the reason the budget has been exceeded
+        """
+        if reason not in self.__reasons:
+            self.__reasons.append(reason)
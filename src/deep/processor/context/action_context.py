@@ -29,13 +29,14 @@
 """Handling for action context."""
 
 import abc
-from typing import Tuple, TYPE_CHECKING, Dict
+from typing import Tuple, TYPE_CHECKING, Dict, Optional
 
 import deep.logging
 from deep.api.tracepoint.eventsnapshot import WATCH_SOURCE_CAPTURE
 from deep.logging import logging
 from deep.api.tracepoint import WatchResult, Variable
-from deep.processor.variable_set_processor import VariableSetProcessor
+from deep.processor.capture_budget import CaptureBudget
+from deep.processor.variable_set_processor import VariableSetProcessor, VariableProcessorConfig
 from deep.utils import str2bool
 
 if TYPE_CHECKING:
@@ -46,6 +47,9 @@ if TYPE_CHECKING:
 class ActionContext(abc.ABC):
     """A context for the processing of an action."""
 
+    DEFAULT_MAX_TP_PROCESS_TIME = 100
+    """The default max time (in milliseconds) to spend processing an action."""
+
     def __init__(self, parent: 'TriggerContext', action: 'LocationAction'):
         """
         Create a new action context.
@@ -56,6 +60,7 @@ class ActionContext(abc.ABC):
         self.trigger_context: 'TriggerContext' = parent
         self.location_action: 'LocationAction' = action
         self._triggered = False
+        self.__budget = None
 
     def __enter__(self):
         """Enter and open the context."""
@@ -66,7 +71,43 @@ class ActionContext(abc.ABC):
         if self.has_triggered():
             self.location_action.record_triggered(self.trigger_context.ts)
 
-    def eval_watch(self, watch: str, source: str) -> Tuple[WatchResult, Dict[str, Variable], str]:
+    @property
+    def max_tp_process_time(self) -> int:
+        """The max time to spend processing a tracepoint."""
+        if self.location_action is None:
+            return self.DEFAULT_MAX_TP_PROCESS_TIME
+        return self.location_action.config.get('MAX_TP_PROCESS_TIME', self.DEFAULT_MAX_TP_PROCESS_TIME)
+
+    @property
+    def max_snapshot_bytes(self) -> Optional[int]:
+        """The max (estimated) size in bytes of the data captured by this action."""
+        config = self.trigger_context.config
+        default = config.MAX_SNAPSHOT_BYTES if config is not None else None
+        if self.location_action is not None:
+            default = self.location_action.config.get('MAX_SNAPSHOT_BYTES', default)
+        if default is None:
+            return None
+        return int(default)
+
+    @property
+    def budget(self) -> CaptureBudget:
+        """The budget for the data captured by this action."""
+        if self.__budget is None:
+            self.__budget = CaptureBudget(self.trigger_context.ts, self.max_tp_process_time, self.max_snapshot_bytes)
+        return self.__budget
+
+    def restart_budget(self, start_ns: int):
+        """
+        Start a new budget for this action.
+
+        This is used when processing is deferred (e.g. to the end of a method), as the original budget will have
+        been used by the time the deferred processing happens.
+
+        :param start_ns: the time (in nanoseconds) the new budget starts
+        """
+        self.__budget = CaptureBudget(start_ns, self.max_tp_process_time, self.max_snapshot_bytes)
+
+    def eval_watch(self, watch: str, source: str) -> Tuple[WatchResult, Dict[int, Variable], str]:
         """
         Evaluate an expression in the current frame.
 
@@ -74,29 +115,48 @@ class ActionContext(abc.ABC):
         :param watch: The watch expression to evaluate.
         :return: Tuple with WatchResult, collected variables, and the log string for the expression
         """
-        var_processor = VariableSetProcessor({}, self.trigger_context.var_cache)
+        if self.budget.exceeded():
+            return self.__budget_exceeded(source, watch)
+
+        var_processor = VariableSetProcessor({}, self.trigger_context.var_cache, budget=self.budget)
 
         try:
             result = self.trigger_context.evaluate_expression(watch)
-            variable_id, log_str = var_processor.process_variable(watch, result)
+            variable_id = var_processor.process_variable(watch, result)
+            if variable_id.vid is None:
+                return self.__budget_exceeded(source, watch)
 
-            return WatchResult(source, watch, variable_id), var_processor.var_lookup, log_str
+            return WatchResult(source, watch, variable_id), var_processor.var_lookup, \
+                var_processor.value_string(variable_id, result)
         except BaseException as e:
             logging.exception("Error evaluating watch %s", watch)
             return WatchResult(source, watch, None, str(e)), {}, str(e)
 
-    def process_capture_variable(self, name: str, variable: any) -> Tuple[WatchResult, Dict[str, Variable], str]:
+    def process_capture_variable(self, name: str, variable: any, config: Optional[VariableProcessorConfig] = None) \
+            -> Tuple[WatchResult, Dict[int, Variable], str]:
         """
         Process a captured variable (exception or return), into a variable set.
 
         :param name: the name to use (raised or returned)
         :param variable: the value to process
+        :param config: the config to process the variable with, or None to use the defaults
         :return: Tuple with WatchResult, collected variables, and the log string for the expression
         """
-        var_processor = VariableSetProcessor({}, self.trigger_context.var_cache)
-        variable_id, log_str = var_processor.process_variable(name, variable)
+        if self.budget.exceeded():
+            return self.__budget_exceeded(WATCH_SOURCE_CAPTURE, name)
+
+        var_processor = VariableSetProcessor({}, self.trigger_context.var_cache, config or VariableProcessorConfig(),
+                                             self.budget)
+        variable_id = var_processor.process_variable(name, variable)
+        if variable_id.vid is None:
+            return self.__budget_exceeded(WATCH_SOURCE_CAPTURE, name)
+
+        return WatchResult(WATCH_SOURCE_CAPTURE, name, variable_id), var_processor.var_lookup, \
+            var_processor.value_string(variable_id, variable)
 
-        return WatchResult(WATCH_SOURCE_CAPTURE, name, variable_id), var_processor.var_lookup, log_str
+    def __budget_exceeded(self, source: str, expression: str) -> Tuple[WatchResult, Dict[int, Variable], str]:
+        error = "Capture budget exceeded: %s" % ", ".join(self.budget.reasons)
+        return WatchResult(source, expression, None, error), {}, error
 
     def process(self):
         """Process the action."""
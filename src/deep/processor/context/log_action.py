@@ -51,7 +51,7 @@ class LogActionContext(ActionContext):
         log, watches, vars_ = self.process_log(log_msg)
         self.trigger_context.attach_result(LogActionResult(self.location_action, log))
 
-    def process_log(self, log_msg) -> Tuple[str, List['WatchResult'], Dict[str, 'Variable']]:
+    def process_log(self, log_msg) -> Tuple[str, List['WatchResult'], Dict[int, 'Variable']]:
         """
         Process the log message.
 
@@ -91,7 +91,10 @@ class LogActionContext(ActionContext):
 
                 return log_str, field_name
 
-        log_msg = "[deep] %s" % FormatExtractor().vformat(log_msg, (), FormatDict(self.trigger_context.locals))
+        # the fields are evaluated as watches, so we do not need to pass the frame locals here
+        log_msg = "[deep] %s" % FormatExtractor().vformat(log_msg, (), FormatDict())
+        # the log message is retained with the result, so it is counted as captured data
+        self.budget.add_bytes(len(log_msg))
         return log_msg, watch_results, _var_lookup
 
 
@@ -28,43 +28,45 @@
 
 """Handling for snapshot actions."""
 from types import FrameType
-from typing import Tuple, Optional, TYPE_CHECKING
+from typing import Tuple, Optional, TYPE_CHECKING, Dict
 
 import deep.logging
 from deep.api.attributes import BoundedAttributes
-from deep.api.tracepoint import EventSnapshot
-from deep.api.tracepoint.constants import FRAME_TYPE, SINGLE_FRAME_TYPE, NO_FRAME_TYPE, ALL_FRAME_TYPE, STAGE, \
-    LINE_CAPTURE, METHOD_CAPTURE
+from deep.api.tracepoint import EventSnapshot, Variable
+from deep.api.tracepoint.constants import STAGE, LINE_CAPTURE, METHOD_CAPTURE, SNAPSHOT_DELTA, \
+    DELTA_BASELINE_INTERVAL, ALL_THREADS
 from deep.api.tracepoint.eventsnapshot import WATCH_SOURCE_WATCH
 from deep.api.tracepoint.trigger import LocationAction
 from deep.processor.context.action_context import ActionContext
 from deep.processor.context.action_results import ActionResult, ActionCallback
 from deep.processor.context.log_action import LOG_MSG, LogActionContext, LogActionResult
-from deep.processor.frame_collector import FrameCollectorContext, FrameCollector
+from deep.processor.capture_budget import TRUNCATED_FRAMES
+from deep.processor.frame_collector import FrameCollectorContext, collect_thread_stacks
+from deep.processor.frame_config import FrameProcessorConfig
+from deep.processor.snapshot_delta import SnapshotDeltaTracker
 from deep.processor.variable_set_processor import VariableProcessorConfig
+from deep.utils import time_ns, str2bool
 
 if TYPE_CHECKING:
     from deep.processor.context.trigger_context import TriggerContext
 
 
-class SnapshotActionContext(FrameCollectorContext, ActionContext):
+class SnapshotActionContext(ActionContext, FrameCollectorContext):
     """The context to use when capturing a snapshot."""
 
     @property
-    def max_tp_process_time(self) -> int:
-        """The max time to spend processing a tracepoint."""
-        return self.location_action.config.get('MAX_TP_PROCESS_TIME', 100)
+    def collection_config(self) -> FrameProcessorConfig:
+        """The variable processing config."""
+        return self.frame_config
 
     @property
-    def collection_config(self) -> VariableProcessorConfig:
-        """The variable processing config."""
-        config = VariableProcessorConfig()
-        config.max_string_length = self.location_action.config.get('MAX_STRING_LENGTH',
-                                                                   config.DEFAULT_MAX_STRING_LENGTH)
-        config.max_collection_size = self.location_action.config.get('MAX_COLLECTION_SIZE',
-                                                                     config.DEFAULT_MAX_COLLECTION_SIZE)
-        config.max_variables = self.location_action.config.get('MAX_VARIABLES', config.DEFAULT_MAX_VARIABLES)
-        config.max_var_depth = self.location_action.config.get('MAX_VAR_DEPTH', config.DEFAULT_MAX_VAR_DEPTH)
+    def frame_config(self) -> FrameProcessorConfig:
+        """The frame processing config for this action."""
+        config = self.location_action.frame_config
+        if config is None:
+            # the config is normally created when the config is installed, but we can create it here if needed
+            config = FrameProcessorConfig.from_args(self.location_action.config)
+            self.location_action.frame_config = config
         return config
 
     @property
@@ -72,6 +74,11 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
         """The timestamp in nanoseconds for this trigger."""
         return self.trigger_context.ts
 
+    @property
+    def frame_limit(self) -> Optional[int]:
+        """The max number of frames to collect, or None to collect the full stack."""
+        return self.frame_config.frame_limit
+
     def should_collect_vars(self, current_frame_index: int) -> bool:
         """
         Check if we can collect data for a frame.
@@ -81,12 +88,7 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
         :param (int) current_frame_index: the current frame index.
         :return (bool): if we should collect the frame vars.
         """
-        config_type = self.location_action.config.get(FRAME_TYPE, SINGLE_FRAME_TYPE)
-        if config_type == NO_FRAME_TYPE:
-            return False
-        if config_type == ALL_FRAME_TYPE:
-            return True
-        return current_frame_index == 0
+        return self.frame_config.should_collect_vars(current_frame_index)
 
     def is_app_frame(self, filename: str) -> Tuple[bool, str]:
         """
@@ -97,6 +99,11 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
         """
         return self.trigger_context.config.is_app_frame(filename)
 
+    @property
+    def app_frame_config(self) -> any:
+        """The config used by :meth:`is_app_frame`."""
+        return self.trigger_context.config.app_frame_config
+
     @property
     def watches(self):
         """The configured watches."""
@@ -108,9 +115,11 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
         return self.location_action.config.get(LOG_MSG, None)
 
     def _process_action(self):
-        collector = FrameCollector(self, self.trigger_context.frame)
-
-        frames, variables = collector.collect(self.trigger_context.vars, self.trigger_context.var_cache)
+        collection = self.trigger_context.collect_frames(self)
+        frame_config = self.frame_config
+        frames, variables = collection.view(frame_config, self.budget)
+        for reason in collection.budget.reasons:
+            self.budget.mark_exceeded(reason)
 
         snapshot = EventSnapshot(self.location_action.tracepoint, self.trigger_context.ts,
                                  self.trigger_context.resource, frames, variables)
@@ -128,6 +137,8 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
                 LOG_MSG: log_msg,
             }, LocationAction.ActionType.Log))
             log, watches, log_vars = context.process_log(log_msg)
+            # the log has its own budget, the data it captured is part of this snapshot
+            self.budget.add_bytes(context.budget.bytes_used)
             snapshot.log_msg = log
             for watch in watches:
                 snapshot.add_watch_result(watch)
@@ -139,12 +150,63 @@ class SnapshotActionContext(FrameCollectorContext, ActionContext):
             snapshot.add_watch_result(watch)
             snapshot.merge_var_lookup(new_vars)
 
-        snapshot.complete()
+        if frame_config.stack_type == ALL_THREADS:
+            self.__capture_threads(snapshot, frame_config)
+
+        self.__add_referenced_vars(snapshot, collection.var_lookup)
+        for reason in self.budget.reasons:
+            snapshot.truncate(reason)
+        if collection.frames_truncated(frame_config):
+            snapshot.truncate(TRUNCATED_FRAMES)
+        snapshot.complete(self.budget.bytes_used)
         if self._is_deferred():
             self.trigger_context.attach_result(DeferredSnapshotActionResult(self, snapshot))
         else:
             self.trigger_context.attach_result(SendSnapshotActionResult(self, snapshot))
 
+    def __capture_threads(self, snapshot: EventSnapshot, frame_config: FrameProcessorConfig):
+        start = time_ns()
+        stacks = collect_thread_stacks(frame_config.max_thread_frames, self.budget, self.is_app_frame)
+        # the threads are the children of the result, and the frames are the children of each thread
+        config = VariableProcessorConfig(max_collection_size=max(len(stacks), frame_config.max_thread_frames + 1),
+                                         max_var_depth=3)
+        watch, new_vars, _ = self.process_capture_variable('threads', stacks, config)
+        snapshot.add_watch_result(watch)
+        snapshot.merge_var_lookup(new_vars)
+        snapshot.attributes['thread_count'] = len(stacks)
+        snapshot.attributes['thread_capture_nanos'] = time_ns() - start
+
+    @staticmethod
+    def __add_referenced_vars(snapshot: EventSnapshot, collected: Dict[int, Variable]):
+        # watches can reference variables that were collected with the frames, but trimmed from this snapshot
+        var_lookup = snapshot.var_lookup
+        queue = [watch.result.vid for watch in snapshot.watches if watch.result is not None]
+        while len(queue) > 0:
+            vid = queue.pop()
+            if vid in var_lookup or vid not in collected:
+                continue
+            variable = collected[vid]
+            var_lookup[vid] = variable
+            queue.extend(child.vid for child in variable.children)
+
+    def reduce_snapshot(self, snapshot: EventSnapshot):
+        """
+        Reduce the snapshot to the changes since the last baseline, if delta snapshots are enabled.
+
+        :param snapshot: the completed snapshot
+        """
+        config = self.location_action.config
+        if not str2bool(str(config.get(SNAPSHOT_DELTA, False))):
+            return
+        tracker = self.location_action.delta_tracker
+        if tracker is None:
+            try:
+                interval = int(config.get(DELTA_BASELINE_INTERVAL, 10))
+            except ValueError:
+                interval = 10
+            tracker = self.location_action.delta_tracker = SnapshotDeltaTracker(interval)
+        tracker.apply(snapshot)
+
     def _is_deferred(self):
         stage = self.location_action.config.get(STAGE, None)
         if stage is None:
@@ -215,10 +277,16 @@ class DeferredSnapshotActionCallback(ActionCallback):
         :return: True, to keep this callback until next match.
         """
         if event in ['exception', 'return']:
+            self.__action_context.restart_budget(time_ns())
             watch, new_vars, _ = self.__action_context.process_capture_variable(event, arg)
             self.__snapshot.add_watch_result(watch)
             self.__snapshot.merge_var_lookup(new_vars)
+            for reason in self.__action_context.budget.reasons:
+                self.__snapshot.truncate(reason)
+            if self.__snapshot.captured_bytes is not None:
+                self.__snapshot.captured_bytes += self.__action_context.budget.bytes_used
 
+        self.__action_context.reduce_snapshot(self.__snapshot)
         ctx.push_service.push_snapshot(self.__snapshot)
         return False
 
@@ -244,5 +312,6 @@ class SendSnapshotActionResult(DeferredSnapshotActionResult):
         :return: an action callback if we need to do something at the 'end', or None
         """
         snapshot = self._decorate_snapshot(ctx)
+        self.action_context.reduce_snapshot(snapshot)
         ctx.push_service.push_snapshot(snapshot)
         return None
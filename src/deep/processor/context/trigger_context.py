@@ -22,7 +22,7 @@ from typing import Dict, Optional, List
 import deep.logging
 from deep.api.plugin import TracepointLogger
 from deep.api.tracepoint import Variable
-from deep.api.tracepoint.trigger import LocationAction
+from deep.api.tracepoint.trigger import LocationAction, Trigger
 from deep.config import ConfigService
 from deep.processor.context.action_context import NoActionContext, ActionContext
 from deep.processor.context.action_results import ActionResult, ActionCallback
@@ -30,7 +30,10 @@ from deep.processor.context.log_action import LogActionContext
 from deep.processor.context.metric_action import MetricActionContext
 from deep.processor.context.snapshot_action import SnapshotActionContext
 from deep.processor.context.span_action import SpanActionContext
-from deep.processor.frame_collector import FrameCollector
+from deep.processor.capture_budget import CaptureBudget
+from deep.processor.frame_collector import FrameCollector, FrameCollection, ConfigFrameCollectorContext
+from deep.processor.expression import compile_expression
+from deep.processor.frame_config import FrameProcessorConfig
 from deep.processor.variable_set_processor import VariableCacheProvider
 from deep.push import PushService
 from deep.utils import time_ns
@@ -57,15 +60,18 @@ class TriggerContext:
         self.__push_service = push_service
         self.__event = event
         self.__frame = frame
+        self.__locals: Optional[Dict[str, any]] = None
         self.__arg = arg
         self.__config = config
         self.__results: List[ActionResult] = []
         self.__ts: int = time_ns()
         self.__id: str = str(uuid.uuid4())
-        self.__frame_collector: Optional[FrameCollector] = None
+        self.__frame_collection: Optional[FrameCollection] = None
         self.var_cache = VariableCacheProvider()
         self.callbacks: List[ActionCallback] = []
-        self.vars: Dict[str: Variable] = {}
+        self.vars: Dict[int, Variable] = {}
+        self.actions: List[LocationAction] = []
+        """The actions that are being processed at this location."""
 
     def __enter__(self):
         """Start the 'with' statement and open this context."""
@@ -94,7 +100,10 @@ class TriggerContext:
     @property
     def locals(self) -> Dict[str, any]:
         """The local frame variables."""
-        return self.__frame.f_locals
+        # reading f_locals can be expensive (the locals are copied to a dict), so only read them once
+        if self.__locals is None:
+            self.__locals = self.__frame.f_locals
+        return self.__locals
 
     @property
     def ts(self):
@@ -143,6 +152,50 @@ class TriggerContext:
             return SpanActionContext(self, action)
         return NoActionContext(self, action)
 
+    def collect_frames(self, action_context: 'SnapshotActionContext') -> FrameCollection:
+        """
+        Collect the frame data for the snapshot actions.
+
+        The frames are only collected once for this context, using the highest limits of all the snapshot actions
+        at this location. Each action can then create a view of the collection, trimmed to its own limits.
+
+        :param action_context: the action context that requires the frames
+        :return: the frame collection
+        """
+        if self.__frame_collection is None:
+            contexts = [SnapshotActionContext(self, action) for action in self.actions
+                        if action.action_type == LocationAction.ActionType.Snapshot
+                        and action is not action_context.location_action]
+            contexts.append(action_context)
+
+            configs: List[FrameProcessorConfig] = []
+            max_bytes = []
+            for context in contexts:
+                max_bytes.append(context.max_snapshot_bytes)
+                # use the merged config of the trigger if we have it, this covers all the actions of the trigger
+                trigger = context.location_action.location
+                config = trigger.frame_config if isinstance(trigger, Trigger) and trigger.frame_config is not None \
+                    else context.frame_config
+                if not any(config is existing for existing in configs):
+                    configs.append(config)
+
+            if len(configs) == 1:
+                config = configs[0]
+            else:
+                config = FrameProcessorConfig()
+                for other in configs:
+                    config.merge(other)
+                config.close()
+
+            budget = CaptureBudget(self.ts, config.max_tp_process_time,
+                                   None if None in max_bytes else max(max_bytes))
+            collector = FrameCollector(ConfigFrameCollectorContext(self.ts, config, budget, self.config.is_app_frame,
+                                                                   self.config.app_frame_config), self.__frame)
+            frames, var_lookup = collector.collect(self.vars, self.var_cache)
+            self.__frame_collection = FrameCollection(frames, var_lookup, collector.locals_ids, config, budget,
+                                                      collector.truncated)
+        return self.__frame_collection
+
     def evaluate_expression(self, expression: str) -> any:
         """
         Evaluate an expression to a value.
@@ -151,7 +204,8 @@ class TriggerContext:
         :return: the result of the expression, or the exception that was raised.
         """
         try:
-            return eval(expression, None, self.__frame.f_locals)
+            compiled = compile_expression(expression)
+            return eval(compiled.code, None, compiled.namespace(self.locals))
         except BaseException as e:
             return e
 
@@ -0,0 +1,93 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compile the expressions used by tracepoints (conditions, watches, log messages and metrics).
+
+Expressions are compiled once, and the names they use are extracted from the compiled code. When the expression is
+evaluated, only these names are copied from the frame locals into the namespace used for the evaluation. This means
+we do not have to pass the full frame locals to eval, and assignments in the expression (e.g. using ':=') do not
+change the frame.
+"""
+
+import functools
+from types import CodeType
+from typing import Optional, FrozenSet, Mapping, Set
+
+_DYNAMIC_NAMES = frozenset(['locals', 'vars', 'dir', 'eval', 'exec'])
+"""Names of functions that can look up any local name, expressions using these need the full locals."""
+
+
+class CompiledExpression:
+    """An expression that has been compiled, with the names it uses."""
+
+    def __init__(self, code: CodeType, names: Optional[FrozenSet[str]]):
+        """
+        Create a new compiled expression.
+
+        :param code: the compiled code
+        :param names: the names the expression uses, or None if the expression needs all the locals
+        """
+        self.__code = code
+        self.__names = names
+
+    @property
+    def code(self) -> CodeType:
+        """The compiled code."""
+        return self.__code
+
+    @property
+    def names(self) -> Optional[FrozenSet[str]]:
+        """The names the expression uses, or None if the expression needs all the locals."""
+        return self.__names
+
+    def namespace(self, f_locals: Mapping[str, any]) -> Mapping[str, any]:
+        """
+        Create the namespace to evaluate this expression with.
+
+        :param f_locals: the frame locals
+        :return: the locals that are used by the expression
+        """
+        if self.__names is None:
+            return f_locals
+        return {name: f_locals[name] for name in self.__names if name in f_locals}
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(expression: str) -> CompiledExpression:
+    """
+    Compile an expression.
+
+    The result is cached, so each expression is only compiled once.
+
+    :param expression: the expression to compile
+    :return: the compiled expression
+    :raises SyntaxError: if the expression is not valid
+    """
+    code = compile(expression, '<expression>', 'eval')
+    names = _names(code)
+    if not names.isdisjoint(_DYNAMIC_NAMES):
+        return CompiledExpression(code, None)
+    return CompiledExpression(code, frozenset(names))
+
+
+def _names(code: CodeType) -> Set[str]:
+    # attribute names are also in co_names, these are only copied if there is a local with the same name
+    names = set(code.co_names)
+    for const in code.co_consts:
+        # lambdas and comprehensions are compiled as nested code objects
+        if isinstance(const, CodeType):
+            names.update(_names(const))
+    return names
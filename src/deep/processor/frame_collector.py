@@ -16,13 +16,28 @@
 """Processing for frame collection."""
 
 import abc
-from types import FrameType
-from typing import Tuple, Dict, List
+import inspect
+import sys
+import threading
+import weakref
+from types import FrameType, CodeType
+from collections import deque
+from typing import Tuple, Dict, List, Set, Callable, Optional
 
-from deep.api.tracepoint import StackFrame, Variable
-from deep.utils import time_ns
+from deep.api.tracepoint import StackFrame, Variable, VariableId
+from deep.api.tracepoint.constants import NO_STACK
+from .capture_budget import CaptureBudget
+from .frame_config import FrameProcessorConfig
 from .variable_set_processor import VariableCacheProvider, VariableSetProcessor, VariableProcessorConfig
 
+_ASYNC_FLAGS = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+_interned_frames: 'weakref.WeakKeyDictionary[CodeType, Dict[Tuple[int, Optional[str]], StackFrame]]' = \
+    weakref.WeakKeyDictionary()
+"""Frames without variables, by code object, line number and class name. These are shared between snapshots."""
+_interned_config: any = None
+"""The app frame config used to create the interned frames."""
+
 
 class FrameCollectorContext(abc.ABC):
     """The context that is used to wrap a collection event."""
@@ -33,6 +48,12 @@ class FrameCollectorContext(abc.ABC):
         """The max time to spend processing a tracepoint."""
         pass
 
+    @property
+    @abc.abstractmethod
+    def budget(self) -> CaptureBudget:
+        """The budget for the data capture."""
+        pass
+
     @property
     @abc.abstractmethod
     def collection_config(self) -> VariableProcessorConfig:
@@ -45,6 +66,11 @@ class FrameCollectorContext(abc.ABC):
         """The timestamp in nanoseconds for this trigger."""
         pass
 
+    @property
+    def frame_limit(self) -> Optional[int]:
+        """The max number of frames to collect, or None to collect the full stack."""
+        return None
+
     @abc.abstractmethod
     def should_collect_vars(self, current_frame_index: int) -> bool:
         """
@@ -67,6 +93,23 @@ class FrameCollectorContext(abc.ABC):
         """
         pass
 
+    @property
+    def app_frame_config(self) -> any:
+        """The config used by :meth:`is_app_frame`, the interned frames are cleared if this changes."""
+        return None
+
+
+def _check_interned_config(app_frame_config: any):
+    """
+    Clear the interned frames, if the app frame config has changed since they were created.
+
+    :param app_frame_config: the current app frame config
+    """
+    global _interned_config
+    if app_frame_config != _interned_config:
+        _interned_frames.clear()
+        _interned_config = app_frame_config
+
 
 class FrameCollector:
     """This deals with collecting data from the paused frames."""
@@ -78,17 +121,20 @@ class FrameCollector:
         :param source: the collector context
         :param frame:  the frame data
         """
-        self.__has_time_exceeded = False
         self.__source = source
         self.__frame = frame
+        self.__locals_ids: Set[int] = set()
+        self.__truncated = False
 
-    def __time_exceeded(self) -> bool:
-        if self.__has_time_exceeded:
-            return self.__has_time_exceeded
+    @property
+    def locals_ids(self) -> Set[int]:
+        """The ids of the 'locals' variables, that have been unwrapped onto the frames."""
+        return self.__locals_ids
 
-        duration = (time_ns() - self.__source.ts) / 1000000  # make duration ms not ns
-        self.__has_time_exceeded = duration > self.__source.max_tp_process_time
-        return self.__has_time_exceeded
+    @property
+    def truncated(self) -> bool:
+        """True, if the collection stopped at the frame limit before the end of the stack."""
+        return self.__truncated
 
     def parse_short_name(self, filename) -> Tuple[str, bool]:
         """
@@ -110,8 +156,8 @@ class FrameCollector:
             return filename[len(match):], is_app_frame
         return filename, is_app_frame
 
-    def collect(self, var_lookup: Dict[str, Variable], var_cache: VariableCacheProvider) \
-            -> Tuple[List[StackFrame], Dict[str, Variable]]:
+    def collect(self, var_lookup: Dict[int, Variable], var_cache: VariableCacheProvider) \
+            -> Tuple[List[StackFrame], Dict[int, Variable]]:
         """
         Collect the data from the current frame.
 
@@ -121,21 +167,31 @@ class FrameCollector:
         """
         current_frame = self.__frame
         collected_frames = []
+        frame_limit = self.__source.frame_limit
+        # the interned frames include the short path and app frame flag, so they cannot be used with a new config
+        _check_interned_config(self.__source.app_frame_config)
+        task_frame = _task_root_frame()
         # while we still have frames process them
         while current_frame is not None:
+            if frame_limit is not None and len(collected_frames) >= frame_limit:
+                # do not walk the rest of the stack if we are not going to use it
+                self.__truncated = True
+                break
             # process the current frame
             frame = self._process_frame(var_lookup, var_cache, current_frame,
                                         self.__source.should_collect_vars(len(collected_frames)))
             collected_frames.append(frame)
+            if current_frame is task_frame:
+                # the frames after the root of the task are the event loop, these are not part of the await chain
+                break
             current_frame = current_frame.f_back
         return collected_frames, var_lookup
 
-    def _process_frame(self, var_lookup: Dict[str, Variable], var_cache: VariableCacheProvider,
+    def _process_frame(self, var_lookup: Dict[int, Variable], var_cache: VariableCacheProvider,
                        frame: FrameType, collect_vars: bool) -> StackFrame:
         # process the current frame info
         lineno = frame.f_lineno
-        filename = frame.f_code.co_filename
-        func_name = frame.f_code.co_name
+        code = frame.f_code
 
         f_locals = frame.f_locals
         _self = f_locals.get('self', None)
@@ -144,16 +200,334 @@ class FrameCollector:
             class_name = _self.__class__.__name__
 
         var_ids = []
-        # only process vars if we are under the time limit
-        if collect_vars and not self.__time_exceeded():
-            processor = VariableSetProcessor(var_lookup, var_cache, self.__source.collection_config)
-            # we process the vars as a single dict of 'locals'
-            variable, log_str = processor.process_variable("locals", f_locals)
-            # now ee 'unwrap' the locals, so they are on the frame directly.
+        # only process vars if we are within the budget
+        if collect_vars and not self.__source.budget.exceeded():
+            processor = VariableSetProcessor(var_lookup, var_cache, self.__source.collection_config,
+                                             self.__source.budget)
+            # we process the vars as a single dict of 'locals', every local is collected (the collection size limit
+            # only applies to the values of the locals)
+            variable = processor.process_variable("locals", f_locals, bounded=False)
+            # now we 'unwrap' the locals, so they are on the frame directly. The locals variable is left in the
+            # lookup, as it can be referenced by other values (e.g. a watch on 'locals()').
             if variable.vid in var_lookup:
-                variable_val = var_lookup[variable.vid]
-                del var_lookup[variable.vid]
-                var_ids = variable_val.children
+                self.__locals_ids.add(variable.vid)
+                var_ids = var_lookup[variable.vid].children
+        if len(var_ids) > 0:
+            return self.__create_frame(code, lineno, var_ids, class_name)
+        return self.__interned_frame(code, lineno, class_name)
+
+    def __interned_frame(self, code: CodeType, lineno: int, class_name: Optional[str]) -> StackFrame:
+        # frames without variables are the same every time we see the code at this line, so we can reuse them
+        frames = _interned_frames.get(code)
+        if frames is None:
+            frames = {}
+            _interned_frames[code] = frames
+        key = (lineno, class_name)
+        stack_frame = frames.get(key)
+        if stack_frame is None:
+            stack_frame = self.__create_frame(code, lineno, [], class_name)
+            frames[key] = stack_frame
+        return stack_frame
+
+    def __create_frame(self, code: CodeType, lineno: int, var_ids: List[VariableId],
+                       class_name: Optional[str]) -> StackFrame:
+        filename = code.co_filename
         short_path, app_frame = self.parse_short_name(filename)
-        return StackFrame(filename, short_path, func_name, lineno, var_ids, class_name,
-                          app_frame=app_frame)
+        return StackFrame(filename, short_path, code.co_name, lineno, var_ids, class_name,
+                          is_async=code.co_flags & _ASYNC_FLAGS != 0, app_frame=app_frame)
+
+
+def _task_root_frame() -> Optional[FrameType]:
+    """
+    Get the frame of the root coroutine of the current asyncio task.
+
+    While a task is running, the coroutines it is awaiting are linked by 'f_back', so the await chain is the stack
+    from the current frame to the root coroutine of the task.
+
+    :return: the root frame, or None if we are not in an asyncio task
+    """
+    # we do not want to import asyncio if the app is not using it
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return None
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # there is no running event loop on this thread
+        return None
+    if task is None:
+        return None
+    # Task.get_coro was added in python 3.8, before that the coroutine is only available as '_coro'
+    get_coro = getattr(task, 'get_coro', None)
+    coro = get_coro() if get_coro is not None else getattr(task, '_coro', None)
+    return getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+
+
+class ConfigFrameCollectorContext(FrameCollectorContext):
+    """A collector context that uses a frame processor config, this is used to collect for many actions at once."""
+
+    def __init__(self, ts: int, config: FrameProcessorConfig, budget: CaptureBudget,
+                 is_app_frame: Callable[[str], Tuple[bool, str]], app_frame_config: any = None):
+        """
+        Create a new context.
+
+        :param ts: the timestamp in nanoseconds of the trigger
+        :param config: the (closed) config to collect with
+        :param budget: the budget for the collection
+        :param is_app_frame: the function to check if a file is an app frame
+        :param app_frame_config: the config used by is_app_frame
+        """
+        self.__ts = ts
+        self.__config = config
+        self.__budget = budget
+        self.__is_app_frame = is_app_frame
+        self.__app_frame_config = app_frame_config
+
+    @property
+    def max_tp_process_time(self) -> int:
+        """The max time to spend processing a tracepoint."""
+        return self.__config.max_tp_process_time
+
+    @property
+    def budget(self) -> CaptureBudget:
+        """The budget for the data capture."""
+        return self.__budget
+
+    @property
+    def collection_config(self) -> FrameProcessorConfig:
+        """The variable processing config."""
+        return self.__config
+
+    @property
+    def ts(self) -> int:
+        """The timestamp in nanoseconds for this trigger."""
+        return self.__ts
+
+    @property
+    def frame_limit(self) -> Optional[int]:
+        """The max number of frames to collect, or None to collect the full stack."""
+        return self.__config.frame_limit
+
+    def should_collect_vars(self, current_frame_index: int) -> bool:
+        """
+        Check if we can collect data for a frame.
+
+        :param (int) current_frame_index: the current frame index.
+        :return (bool): if we should collect the frame vars.
+        """
+        return self.__config.should_collect_vars(current_frame_index)
+
+    def is_app_frame(self, filename: str) -> Tuple[bool, str]:
+        """
+        Check if the current frame is a user application frame.
+
+        :param filename: the frame file name
+        :return: True if add frame, else False
+        """
+        return self.__is_app_frame(filename)
+
+    @property
+    def app_frame_config(self) -> any:
+        """The config used by :meth:`is_app_frame`."""
+        return self.__app_frame_config
+
+
+class FrameCollection:
+    """
+    The result of collecting the frames for a trigger.
+
+    The frames are collected once, using the highest limits of all the actions at the location. Each action then
+    takes a view of the collection that is trimmed to its own limits.
+    """
+
+    def __init__(self, frames: List[StackFrame], var_lookup: Dict[int, Variable], locals_ids: Set[int],
+                 config: FrameProcessorConfig, budget: CaptureBudget, truncated: bool = False):
+        """
+        Create a new collection.
+
+        :param frames: the collected frames
+        :param var_lookup: the collected variables
+        :param locals_ids: the ids of the unwrapped 'locals' variables
+        :param config: the config that was used to collect
+        :param budget: the budget used for the collection
+        :param truncated: True, if the collection stopped at the frame limit before the end of the stack
+        """
+        self.__frames = frames
+        self.__truncated = truncated
+        self.__var_lookup = var_lookup
+        self.__locals_ids = locals_ids
+        self.__config = config
+        self.budget = budget
+
+    @property
+    def var_lookup(self) -> Dict[int, Variable]:
+        """All the collected variables."""
+        return self.__var_lookup
+
+    def view(self, config: FrameProcessorConfig, budget: Optional[CaptureBudget] = None) \
+            -> Tuple[List[StackFrame], Dict[int, Variable]]:
+        """
+        Create a view of the collection, trimmed to the limits of the config.
+
+        Variables that are shared with the collection are not modified, if a variable has to be trimmed then a copy
+        is created.
+
+        The collection is shared by the actions at a location, so it is collected with the highest byte limit. If a
+        budget is given, the variables of the view are added to it, and the view is trimmed when the budget is
+        exceeded.
+
+        :param config: the (closed) config of the action
+        :param budget: the budget of the action
+        :return: the frames and variables for the action
+        """
+        fits = budget is None or budget.max_bytes is None \
+            or budget.bytes_used + self.budget.bytes_used <= budget.max_bytes
+        if fits and config.same_limits(self.__config):
+            frames, var_lookup = list(self.__frames), {vid: var for vid, var in self.__var_lookup.items()
+                                                       if vid not in self.__locals_ids}
+            if budget is not None:
+                budget.add_bytes(self.budget.bytes_used)
+        else:
+            frames, var_lookup = self.__trim(config, budget)
+        if config.collapse_frames:
+            frames = collapse_frames(frames)
+        return frames, var_lookup
+
+    def frames_truncated(self, config: FrameProcessorConfig) -> bool:
+        """
+        Check if the frames of a view have been truncated by the frame limit.
+
+        :param config: the (closed) config of the action
+        :return: True, if the stack has more frames than the view contains
+        """
+        if config.stack_type == NO_STACK:
+            # the stack was not requested, so it is not truncated
+            return False
+        return self.__truncated or len(self.__frames) > config.max_frames
+
+    def __trim(self, config: FrameProcessorConfig,
+               budget: Optional[CaptureBudget]) -> Tuple[List[StackFrame], Dict[int, Variable]]:
+        var_lookup = self.__var_lookup
+        new_lookup: Dict[int, Variable] = {}
+        frames = []
+        queue = deque()
+        for index, frame in enumerate(self.__frames[:config.frame_limit]):
+            # frame variables are the children of 'locals', which is at depth 1, they are not limited by the
+            # collection size, only the values of the locals are
+            variables = frame.variables if config.should_collect_vars(index) else []
+            queue.extend((var_id, 2) for var_id in variables)
+            frames.append(frame.with_variables(variables))
+
+        max_collection_size = config.max_collection_size
+        max_string_length = config.max_string_length
+        exhausted = False
+        while len(queue) > 0:
+            var_id, depth = queue.popleft()
+            vid = var_id.vid
+            if vid in new_lookup or vid not in var_lookup:
+                continue
+            if len(new_lookup) >= config.max_variables:
+                exhausted = True
+                break
+            variable = var_lookup[vid]
+            children = variable.children
+            value = variable.value
+            truncated = variable.truncated
+            if depth + 1 >= config.max_var_depth:
+                children = []
+            elif len(children) > max_collection_size:
+                children = children[:max_collection_size]
+                truncated = True
+            if len(value) > max_string_length:
+                value = value[:max_string_length]
+                truncated = True
+            if children is not variable.children or value is not variable.value:
+                variable = Variable(variable.type, value, variable.hash, list(children), truncated)
+            if budget is not None and budget.add_bytes(
+                    variable.estimated_size + sum(child.estimated_size for child in children)):
+                exhausted = True
+                break
+            new_lookup[vid] = variable
+            queue.extend((child, depth + 1) for child in children)
+
+        if exhausted:
+            # remove any references to variables we did not include
+            for vid, variable in new_lookup.items():
+                if any(child.vid not in new_lookup for child in variable.children):
+                    new_lookup[vid] = Variable(variable.type, variable.value, variable.hash,
+                                               [child for child in variable.children if child.vid in new_lookup],
+                                               True)
+            frames = [frame.with_variables([var_id for var_id in frame.variables if var_id.vid in new_lookup])
+                      for frame in frames]
+        return frames, new_lookup
+
+
+def collapse_frames(frames: List[StackFrame]) -> List[StackFrame]:
+    """
+    Collapse runs of non app frames into a single frame.
+
+    Only frames without variables are collapsed, and the first frame (the location of the trigger) is always kept.
+    The collapsed frame uses the file and line of the first frame of the run, with a method name that shows the
+    number of frames that were collapsed.
+
+    :param frames: the frames to collapse
+    :return: the collapsed frames
+    """
+    collapsed = []
+    run: List[StackFrame] = []
+    for index, frame in enumerate(frames):
+        if index > 0 and not frame.app_frame and len(frame.variables) == 0:
+            run.append(frame)
+            continue
+        _end_run(collapsed, run)
+        collapsed.append(frame)
+    _end_run(collapsed, run)
+    return collapsed
+
+
+def _end_run(collapsed: List[StackFrame], run: List[StackFrame]):
+    if len(run) == 1:
+        collapsed.append(run[0])
+    elif len(run) > 1:
+        first = run[0]
+        collapsed.append(StackFrame(first.file_name, first.short_path, '<%d collapsed frames>' % len(run),
+                                    first.line_number, [], None, app_frame=False))
+    run.clear()
+
+
+def collect_thread_stacks(max_frames: int, budget: CaptureBudget,
+                          is_app_frame: Callable[[str], Tuple[bool, str]]) -> Dict[str, List[str]]:
+    """
+    Collect the stacks of all the other threads.
+
+    The stacks are collected as a list of strings (e.g. 'app/handler.py:12 handle'), without variables, so the time
+    spent is bounded by the number of threads and the max frames.
+
+    :param max_frames: the max number of frames to collect for each thread
+    :param budget: the budget for the capture, we stop collecting threads if this is exceeded
+    :param is_app_frame: the function to check if a file is an app frame
+    :return: the stacks, by the thread name and id
+    """
+    current = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = {}
+    # noinspection PyProtectedMember
+    for ident, frame in sys._current_frames().items():
+        if ident == current:
+            continue
+        if budget.exceeded():
+            break
+        stack = []
+        while frame is not None:
+            if len(stack) >= max_frames:
+                stack.append('...')
+                break
+            code = frame.f_code
+            filename = code.co_filename
+            _, match = is_app_frame(filename)
+            if match is not None:
+                filename = filename[len(match):]
+            stack.append('%s:%s %s' % (filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        stacks['%s (%s)' % (names.get(ident, 'unknown'), ident)] = stack
+    return stacks
@@ -15,9 +15,15 @@
 
 """Configuration options for tracepoint processing."""
 
+from typing import Dict, Optional
+
+from deep.api.tracepoint.constants import COLLAPSE_FRAMES, NO_STACK, ALL_THREADS
 from deep.api.tracepoint.tracepoint_config import SINGLE_FRAME_TYPE, STACK, \
     frame_type_ordinal, STACK_TYPE, FRAME_TYPE, \
     TracePointConfig, NO_FRAME_TYPE, ALL_FRAME_TYPE
+from deep.utils import str2bool
+
+_STACK_TYPE_ORDER = {NO_STACK: 0, STACK: 1, ALL_THREADS: 2}
 
 
 class FrameProcessorConfig:
@@ -31,6 +37,8 @@ class FrameProcessorConfig:
     DEFAULT_MAX_TP_PROCESS_TIME = 100
     DEFAULT_MAX_PROFILE_TIME = 1000
     DEFAULT_PROFILE_INTERVAL = 10
+    DEFAULT_MAX_FRAMES = 1000
+    DEFAULT_MAX_THREAD_FRAMES = 20
 
     def __init__(self):
         """Create a new config."""
@@ -42,6 +50,22 @@ class FrameProcessorConfig:
         self._max_string_length = -1
         self._max_watch_vars = -1
         self._max_tp_process_time = -1
+        self._max_frames = -1
+        self._max_thread_frames = -1
+        self._collapse_frames = None
+
+    @staticmethod
+    def from_args(args: Dict[str, any]) -> 'FrameProcessorConfig':
+        """
+        Create a closed config from the args of a tracepoint, or the config of an action.
+
+        :param args: the args to process
+        :return: the new config
+        """
+        config = FrameProcessorConfig()
+        config.process_args(args)
+        config.close()
+        return config
 
     def process_tracepoint(self, tp: TracePointConfig):
         """
@@ -51,19 +75,37 @@ class FrameProcessorConfig:
         tracepoints are single frame, then do not collect all frames.
         :param tp: the tracepoint to process
         """
-        self._max_var_depth = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_VAR_DEPTH', self._max_var_depth)
-        self._max_variables = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_VARIABLES', self._max_variables)
-        self._max_collection_size = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_COLLECTION_SIZE',
+        self.process_args(tp.args)
+
+    def process_args(self, args: Dict[str, any]):
+        """
+        Process the args of a tracepoint, or the config of an action, into this config.
+
+        :param args: the args to process
+        """
+        self._max_var_depth = FrameProcessorConfig.__get_max_or_default(args, 'MAX_VAR_DEPTH', self._max_var_depth)
+        self._max_variables = FrameProcessorConfig.__get_max_or_default(args, 'MAX_VARIABLES', self._max_variables)
+        self._max_collection_size = FrameProcessorConfig.__get_max_or_default(args, 'MAX_COLLECTION_SIZE',
                                                                               self._max_collection_size)
-        self._max_string_length = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_STRING_LENGTH',
+        self._max_string_length = FrameProcessorConfig.__get_max_or_default(args, 'MAX_STRING_LENGTH',
                                                                             self._max_string_length)
-        self._max_watch_vars = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_WATCH_VARS',
+        self._max_watch_vars = FrameProcessorConfig.__get_max_or_default(args, 'MAX_WATCH_VARS',
                                                                          self._max_watch_vars)
-        self._max_tp_process_time = FrameProcessorConfig.__get_max_or_default(tp.args, 'MAX_TP_PROCESS_TIME',
+        self._max_tp_process_time = FrameProcessorConfig.__get_max_or_default(args, 'MAX_TP_PROCESS_TIME',
                                                                               self._max_tp_process_time)
+        self._max_frames = FrameProcessorConfig.__get_max_or_default(args, 'MAX_FRAMES', self._max_frames)
+        self._max_thread_frames = FrameProcessorConfig.__get_max_or_default(args, 'MAX_THREAD_FRAMES',
+                                                                            self._max_thread_frames)
+
+        # only collapse frames if all require it
+        collapse_frames = args.get(COLLAPSE_FRAMES, None)
+        if collapse_frames is not None:
+            collapse_frames = str2bool(str(collapse_frames))
+            self._collapse_frames = collapse_frames if self._collapse_frames is None \
+                else self._collapse_frames and collapse_frames
 
         # use the highest collection type - results can be trimmed during pre upload processing
-        frame_type = tp.get_arg(FRAME_TYPE, None)
+        frame_type = args.get(FRAME_TYPE, None)
         if frame_type is not None:
             if self._frame_type is None:
                 self._frame_type = frame_type
@@ -71,12 +113,9 @@ class FrameProcessorConfig:
                 self._frame_type = frame_type
 
         # collect stack if any require it
-        stack_type = tp.get_arg(STACK_TYPE, None)
+        stack_type = args.get(STACK_TYPE, None)
         if stack_type is not None:
-            if self._stack_type is None:
-                self._stack_type = stack_type
-            elif stack_type == STACK:
-                self._stack_type = STACK
+            self._stack_type = FrameProcessorConfig.__highest_stack_type(self._stack_type, stack_type)
 
     def close(self):
         """Close the config, to check for any unconfirmed parts, and set them to defaults."""
@@ -96,6 +135,12 @@ class FrameProcessorConfig:
         self._max_tp_process_time = FrameProcessorConfig.DEFAULT_MAX_TP_PROCESS_TIME \
             if self._max_tp_process_time == -1 \
             else self._max_tp_process_time
+        self._max_frames = FrameProcessorConfig.DEFAULT_MAX_FRAMES if self._max_frames == -1 else self._max_frames
+        self._max_thread_frames = FrameProcessorConfig.DEFAULT_MAX_THREAD_FRAMES if self._max_thread_frames == -1 \
+            else self._max_thread_frames
+
+        if self._collapse_frames is None:
+            self._collapse_frames = False
 
         if self._frame_type is None:
             self._frame_type = SINGLE_FRAME_TYPE
@@ -103,6 +148,49 @@ class FrameProcessorConfig:
         if self._stack_type is None:
             self._stack_type = STACK
 
+    def merge(self, other: 'FrameProcessorConfig'):
+        """
+        Merge another config into this config, keeping the highest limits of both.
+
+        The other config should be closed, so the defaults of the other config are also considered.
+
+        :param other: the config to merge in
+        """
+        self._max_var_depth = max(self._max_var_depth, other._max_var_depth)
+        self._max_variables = max(self._max_variables, other._max_variables)
+        self._max_collection_size = max(self._max_collection_size, other._max_collection_size)
+        self._max_string_length = max(self._max_string_length, other._max_string_length)
+        self._max_watch_vars = max(self._max_watch_vars, other._max_watch_vars)
+        self._max_tp_process_time = max(self._max_tp_process_time, other._max_tp_process_time)
+        self._max_frames = max(self._max_frames, other._max_frames)
+        self._max_thread_frames = max(self._max_thread_frames, other._max_thread_frames)
+        self._collapse_frames = other._collapse_frames if self._collapse_frames is None \
+            else self._collapse_frames and other._collapse_frames
+        if self._frame_type is None or frame_type_ordinal(other._frame_type) > frame_type_ordinal(self._frame_type):
+            self._frame_type = other._frame_type
+        self._stack_type = FrameProcessorConfig.__highest_stack_type(self._stack_type, other._stack_type)
+
+    def same_limits(self, other: 'FrameProcessorConfig') -> bool:
+        """
+        Check if another config has the same collection limits as this config.
+
+        :param other: the config to compare to
+        :return: True, if the data collected by both configs would be the same
+        """
+        return self._frame_type == other._frame_type \
+            and self.frame_limit == other.frame_limit \
+            and self._max_var_depth == other._max_var_depth \
+            and self._max_variables == other._max_variables \
+            and self._max_collection_size == other._max_collection_size \
+            and self._max_string_length == other._max_string_length
+
+    @staticmethod
+    def __highest_stack_type(current: Optional[str], stack_type: Optional[str]) -> Optional[str]:
+        # all threads includes the full stack, and the full stack includes the current frame (no stack)
+        if current is None or _STACK_TYPE_ORDER.get(stack_type, 0) > _STACK_TYPE_ORDER.get(current, 0):
+            return stack_type
+        return current
+
     @staticmethod
     def __get_max_or_default(config, key, default_value):
         if key in config:
@@ -189,6 +277,48 @@ class FrameProcessorConfig:
         """
         return self._max_tp_process_time
 
+    @property
+    def max_frames(self) -> int:
+        """
+        Get the maximum number of frames to collect.
+
+        Frames beyond this limit are not processed, and the stack is marked as truncated.
+
+        :return: the max frames
+        """
+        return self._max_frames
+
+    @property
+    def max_thread_frames(self) -> int:
+        """
+        Get the maximum number of frames to collect for each of the other threads.
+
+        This is only used with the 'all_threads' stack type.
+
+        :return: the max frames per thread
+        """
+        return self._max_thread_frames
+
+    @property
+    def frame_limit(self) -> int:
+        """
+        Get the number of frames to collect, taking the stack type into account.
+
+        :return: the number of frames to collect
+        """
+        if self._stack_type == NO_STACK:
+            return 1
+        return self._max_frames
+
+    @property
+    def collapse_frames(self) -> bool:
+        """
+        Get if runs of non app frames should be collapsed into a single frame.
+
+        :return: True, if frames should be collapsed
+        """
+        return self._collapse_frames
+
     def should_collect_vars(self, current_frame_index: int) -> bool:
         """
         Check if we can collect data for a frame.
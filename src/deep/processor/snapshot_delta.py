@@ -0,0 +1,213 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Delta snapshots for tracepoints that fire repeatedly.
+
+When delta mode is enabled on a tracepoint, a full 'baseline' snapshot is sent periodically. The snapshots in between
+only contain the variables that have changed since the baseline. A variable is unchanged if the variable, and all of
+its children, have the same fingerprint as the variable at the same path (e.g. frame 0 -> 'self' -> 'name') in the
+baseline.
+
+Unchanged variables are removed from the var lookup, and references to them are replaced with a reference to the
+variable in the baseline snapshot. These references use the id format 'baseline/<id>', and the baseline snapshot id
+is set as the attribute 'delta_baseline'.
+
+A snapshot only becomes the baseline once it has been sent. Until then it is a candidate, and the following snapshots
+are either reduced against the previous baseline, or (if there is none) sent in full as further candidates. The push
+service tells the tracker when a candidate is sent (:meth:`SnapshotDeltaTracker.confirm`) or lost
+(:meth:`SnapshotDeltaTracker.discard`), using the :attr:`EventSnapshot.delta_tracker` of the snapshot.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple, Set, Optional
+
+from deep.api.tracepoint import EventSnapshot, VariableId, Variable
+
+DELTA_REF_PREFIX = "baseline/"
+"""The prefix used for variable ids that reference a variable in the baseline snapshot."""
+
+_CYCLE = hash(('cycle',))
+
+MAX_CANDIDATES = 8
+"""The max number of baseline candidates that can wait to be sent, the oldest candidate is forgotten after this."""
+
+
+class SnapshotDeltaTracker:
+    """Track the baseline snapshot for a tracepoint, and reduce new snapshots to the changes from the baseline."""
+
+    def __init__(self, baseline_interval: int):
+        """
+        Create a new tracker.
+
+        :param baseline_interval: the number of snapshots to send between each baseline snapshot
+        """
+        self.__baseline_interval = baseline_interval
+        self.__baseline_id: Optional[str] = None
+        self.__baseline: Dict[Tuple, Tuple[int, any]] = {}
+        self.__since_baseline = 0
+        self.__candidates: 'OrderedDict[str, Dict[Tuple, Tuple[int, any]]]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    @property
+    def baseline_id(self) -> Optional[str]:
+        """The id of the (sent) baseline snapshot, or None if there is no baseline yet."""
+        return self.__baseline_id
+
+    def apply(self, snapshot: EventSnapshot) -> bool:
+        """
+        Process a snapshot, either recording it as a baseline candidate or reducing it to the changes.
+
+        :param snapshot: the snapshot to process
+        :return: True, if the snapshot was reduced to a delta, False if it is a new baseline candidate
+        """
+        with self.__lock:
+            if self.__baseline_id is not None \
+                    and (self.__since_baseline < self.__baseline_interval or len(self.__candidates) > 0):
+                # while a new baseline is waiting to be sent, we continue to use the previous baseline
+                self.__since_baseline += 1
+                self.__reduce(snapshot)
+                return True
+            self.__record_candidate(snapshot)
+            return False
+
+    def confirm(self, snapshot_id: str):
+        """
+        Promote a baseline candidate to the baseline, as it has been sent.
+
+        :param snapshot_id: the id of the sent snapshot
+        """
+        with self.__lock:
+            baseline = self.__candidates.get(snapshot_id)
+            if baseline is None:
+                return
+            self.__candidates.clear()
+            self.__baseline = baseline
+            self.__baseline_id = snapshot_id
+            self.__since_baseline = 0
+
+    def discard(self, snapshot_id: str):
+        """
+        Forget a baseline candidate, as it was not sent.
+
+        :param snapshot_id: the id of the lost snapshot
+        """
+        with self.__lock:
+            self.__candidates.pop(snapshot_id, None)
+
+    def __record_candidate(self, snapshot: EventSnapshot):
+        fingerprints = _Fingerprints(snapshot.var_lookup)
+        baseline = {}
+        visited = set()
+
+        def visit(variable_id: VariableId, path: Tuple):
+            if variable_id is None:
+                return
+            baseline[path] = (fingerprints.of(variable_id.vid), variable_id.vid)
+            if variable_id.vid in visited:
+                # shared values are only expanded once, this also prevents loops
+                return
+            visited.add(variable_id.vid)
+            variable = snapshot.var_lookup.get(variable_id.vid)
+            if variable is not None:
+                for child in variable.children:
+                    visit(child, path + (child.name,))
+
+        for path, variable_id in _roots(snapshot):
+            visit(variable_id, path)
+
+        self.__candidates[snapshot.id_str] = baseline
+        while len(self.__candidates) > MAX_CANDIDATES:
+            self.__candidates.popitem(last=False)
+        snapshot.attributes['delta_baseline'] = snapshot.id_str
+        snapshot.delta_tracker = self
+
+    def __reduce(self, snapshot: EventSnapshot):
+        var_lookup = snapshot.var_lookup
+        fingerprints = _Fingerprints(var_lookup)
+        # calculate the fingerprints before we start replacing the references
+        for vid in var_lookup:
+            fingerprints.of(vid)
+        kept: Set[any] = set()
+        omitted = 0
+
+        def visit(variable_id: VariableId, path: Tuple) -> VariableId:
+            nonlocal omitted
+            if variable_id is None:
+                return variable_id
+            base = self.__baseline.get(path)
+            if base is not None and base[0] == fingerprints.of(variable_id.vid):
+                omitted += 1
+                return VariableId(DELTA_REF_PREFIX + str(base[1]), variable_id.name, variable_id.modifiers,
+                                  variable_id.original_name)
+            if variable_id.vid in kept:
+                return variable_id
+            kept.add(variable_id.vid)
+            variable = var_lookup.get(variable_id.vid)
+            if variable is not None:
+                children = [visit(child, path + (child.name,)) for child in variable.children]
+                if children != variable.children:
+                    # variables can be shared with other snapshots, so we replace rather than modify them
+                    var_lookup[variable_id.vid] = Variable(variable.type, variable.value, variable.hash, children,
+                                                           variable.truncated)
+            return variable_id
+
+        frames = snapshot.frames
+        for frame_index, frame in enumerate(frames):
+            frames[frame_index] = frame.with_variables(
+                [visit(variable_id, ('frame', frame_index, variable_id.name)) for variable_id in frame.variables])
+        for index, watch in enumerate(snapshot.watches):
+            watch.result = visit(watch.result, ('watch', index, watch.expression))
+
+        for vid in [vid for vid in var_lookup if vid not in kept]:
+            del var_lookup[vid]
+
+        snapshot.attributes['delta_baseline'] = self.__baseline_id
+        snapshot.attributes['delta_omitted'] = omitted
+
+
+def _roots(snapshot: EventSnapshot):
+    for frame_index, frame in enumerate(snapshot.frames):
+        for variable_id in frame.variables:
+            yield ('frame', frame_index, variable_id.name), variable_id
+    for index, watch in enumerate(snapshot.watches):
+        yield ('watch', index, watch.expression), watch.result
+
+
+class _Fingerprints:
+    """Calculate, and cache, the fingerprint of a variable and all of its children."""
+
+    def __init__(self, var_lookup: Dict[any, Variable]):
+        self.__var_lookup = var_lookup
+        self.__cache: Dict[any, int] = {}
+        self.__active: Set[any] = set()
+
+    def of(self, vid) -> int:
+        cached = self.__cache.get(vid)
+        if cached is not None:
+            return cached
+        variable = self.__var_lookup.get(vid)
+        if variable is None or vid in self.__active:
+            # this is a reference back up the tree, or to a value we do not have
+            return _CYCLE
+        self.__active.add(vid)
+        try:
+            fingerprint = hash((variable.type, variable.value, variable.truncated,
+                                tuple((child.name, self.of(child.vid)) for child in variable.children)))
+        finally:
+            self.__active.discard(vid)
+        self.__cache[vid] = fingerprint
+        return fingerprint
@@ -23,6 +23,7 @@ other supported action.
 """
 
 import os
+import string
 import sys
 import threading
 from collections import deque
@@ -30,11 +31,14 @@ from types import FrameType
 from typing import Tuple, TYPE_CHECKING, List, Deque, Optional
 
 from deep import logging
-from deep.api.tracepoint.trigger import Trigger
+from deep.api.tracepoint.constants import WATCHES, LOG_MSG
+from deep.api.tracepoint.trigger import Trigger, LocationAction
 from deep.config import ConfigService
 from deep.config.tracepoint_config import ConfigUpdateListener
 from deep.processor.context.callback_context import CallbackContext
 from deep.processor.context.trigger_context import TriggerContext
+from deep.processor.expression import compile_expression
+from deep.processor.frame_config import FrameProcessorConfig
 from deep.push import PushService
 from deep.thread_local import ThreadLocal
 
@@ -115,8 +119,46 @@ class TriggerHandler:
 
         :param new_config: the new config to use
         """
+        for trigger in new_config:
+            trigger.frame_config = self.__frame_config(trigger)
+            for action in trigger.actions:
+                try:
+                    self.__compile_expressions(action)
+                except Exception:
+                    # the action is still installed, its errors are reported when it is triggered
+                    logging.exception("Cannot compile expressions for action %s", action)
         self._tp_config = new_config
 
+    @staticmethod
+    def __frame_config(trigger: Trigger) -> FrameProcessorConfig:
+        # create the frame configs now, so they do not have to be created each time the trigger is hit
+        config = FrameProcessorConfig()
+        for action in trigger.actions:
+            if action.action_type == LocationAction.ActionType.Snapshot:
+                action.frame_config = FrameProcessorConfig.from_args(action.config)
+                config.merge(action.frame_config)
+        config.close()
+        return config
+
+    @staticmethod
+    def __compile_expressions(action: LocationAction):
+        # compile the expressions now, so they do not have to be compiled when the trigger is first hit
+        config = action.config
+        expressions = [action.condition] + list(config.get(WATCHES, []))
+        log_msg = config.get(LOG_MSG)
+        if log_msg is not None:
+            expressions += [field for _, field, _, _ in string.Formatter().parse(log_msg)]
+        for metric in config.get('metrics', []):
+            expressions.append(metric.expression)
+            expressions += [label.expression for label in metric.labels]
+        for expression in expressions:
+            if expression:
+                try:
+                    compile_expression(expression)
+                except SyntaxError:
+                    # invalid expressions are reported when they are evaluated
+                    pass
+
     def trace_call(self, frame: FrameType, event: str, arg):
         """
         Process the data for a trace call.
@@ -149,6 +191,7 @@ class TriggerHandler:
         if len(actions) == 0:
             return self.trace_call
 
+        trigger_context.actions = actions
         try:
             with trigger_context:
                 for action in actions:
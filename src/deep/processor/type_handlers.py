@@ -0,0 +1,449 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Handlers for capturing types that need special treatment.
+
+Some types (e.g. numpy arrays or pandas data frames) are very slow, or unhelpful, to capture using the generic
+approach of expanding `__dict__` or calling `str()`. For these types we provide handlers that create a summary of the
+value instead.
+
+Handlers for optional libraries never import the library themselves, they are only active if the library has
+already been loaded by the application.
+"""
+
+import abc
+import string
+import sys
+import weakref
+from typing import TYPE_CHECKING, Tuple, List, Optional, Dict
+
+from deep import logging
+from .bfs import Node, NodeValue, ParentNode
+
+if TYPE_CHECKING:
+    from .variable_processor import Collector
+
+
+class TypeHandler(abc.ABC):
+    """A handler that can capture values of specific types."""
+
+    size_truncates = True
+    """If True, values with a size larger than the max collection size are marked as truncated."""
+
+    @abc.abstractmethod
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        pass
+
+    @abc.abstractmethod
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        pass
+
+    def child_nodes(self, var_collector: 'Collector', parent_node: ParentNode, value: any) -> List[Node]:
+        """
+        Collect the child nodes for the value.
+
+        :param var_collector: the collector being used
+        :param parent_node: the node to use as the parent of the children
+        :param value: the value to collect the children from
+        :return: the child nodes
+        """
+        return []
+
+    def value_size(self, value: any) -> Optional[int]:
+        """
+        Get the real size of the value.
+
+        :param value: the value to check
+        :return: the size of the value, or None if the value does not have a size
+        """
+        return None
+
+
+def _as_nodes(parent_node: ParentNode, values: Dict[str, any]) -> List[Node]:
+    return [Node(value=NodeValue(name, value), parent=parent_node) for name, value in values.items()]
+
+
+def _to_python(value: any) -> any:
+    # numpy scalars have an 'item' function that returns the python equivalent
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+class NumpyScalarHandler(TypeHandler):
+    """Handle numpy scalar types (e.g. numpy.float64)."""
+
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        numpy = sys.modules.get('numpy')
+        return numpy is not None and issubclass(variable_type, numpy.generic)
+
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        return str(value), False
+
+
+class NumpyArrayHandler(TypeHandler):
+    """
+    Handle numpy arrays.
+
+    Arrays are captured as a summary of the shape, dtype and memory size, with vectorised statistics and a preview
+    of the first and last values (of the flattened array).
+    """
+
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        numpy = sys.modules.get('numpy')
+        return numpy is not None and issubclass(variable_type, numpy.ndarray)
+
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        return 'Shape: %s, DType: %s, Size: %s' % (value.shape, value.dtype, value.size), False
+
+    def value_size(self, value: any) -> Optional[int]:
+        """
+        Get the real size of the value.
+
+        :param value: the value to check
+        :return: the number of elements in the array
+        """
+        return value.size
+
+    def child_nodes(self, var_collector: 'Collector', parent_node: ParentNode, value: any) -> List[Node]:
+        """
+        Collect the child nodes for the value.
+
+        :param var_collector: the collector being used
+        :param parent_node: the node to use as the parent of the children
+        :param value: the value to collect the children from
+        :return: the child nodes
+        """
+        numpy = sys.modules['numpy']
+        summary = {
+            'shape': str(value.shape),
+            'dtype': str(value.dtype),
+            'nbytes': int(value.nbytes),
+        }
+        summary.update(self.__stats(numpy, value))
+        if value.size > 0:
+            preview = var_collector.max_collection_size
+            # 'flat' slicing only copies the values we ask for, regardless of the array layout
+            summary['head'] = value.flat[:preview].tolist()
+            if value.size > preview:
+                summary['tail'] = value.flat[value.size - preview:].tolist()
+        return _as_nodes(parent_node, summary)
+
+    @staticmethod
+    def __stats(numpy, value) -> Dict[str, any]:
+        kind = value.dtype.kind
+        # only (b)ool, (i)nt, (u)nsigned int and (f)loat have meaningful statistics
+        if value.size == 0 or kind not in 'biuf':
+            return {}
+        stats = {}
+        try:
+            if kind == 'f':
+                nan_count = int(numpy.count_nonzero(numpy.isnan(value)))
+                stats['nan_count'] = nan_count
+                if nan_count == value.size:
+                    return stats
+                stats['min'] = _to_python(numpy.nanmin(value))
+                stats['max'] = _to_python(numpy.nanmax(value))
+                stats['mean'] = _to_python(numpy.nanmean(value))
+            else:
+                stats['min'] = _to_python(numpy.min(value))
+                stats['max'] = _to_python(numpy.max(value))
+                stats['mean'] = _to_python(numpy.mean(value))
+        except Exception:
+            logging.debug("Cannot calculate statistics for array of type %s", value.dtype)
+        return stats
+
+
+class PandasDataFrameHandler(TypeHandler):
+    """
+    Handle pandas data frames.
+
+    Data frames are captured as a summary of the shape, columns and memory size, with vectorised statistics of the
+    numeric columns and a preview of the first and last rows.
+    """
+
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        pandas = sys.modules.get('pandas')
+        return pandas is not None and issubclass(variable_type, pandas.DataFrame)
+
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        return 'Shape: %s' % (value.shape,), False
+
+    def value_size(self, value: any) -> Optional[int]:
+        """
+        Get the real size of the value.
+
+        :param value: the value to check
+        :return: the number of rows in the data frame
+        """
+        return len(value)
+
+    def child_nodes(self, var_collector: 'Collector', parent_node: ParentNode, value: any) -> List[Node]:
+        """
+        Collect the child nodes for the value.
+
+        :param var_collector: the collector being used
+        :param parent_node: the node to use as the parent of the children
+        :param value: the value to collect the children from
+        :return: the child nodes
+        """
+        preview = var_collector.max_collection_size
+        # limit all per column data to the first columns, so wide frames are not fully processed
+        columns = value.iloc[:, :preview]
+        summary = {
+            'shape': str(value.shape),
+            'columns': [str(column) for column in columns.columns],
+            'dtypes': {str(column): str(dtype) for column, dtype in columns.dtypes.items()},
+            'memory_usage': int(value.memory_usage(index=True, deep=False).sum()),
+        }
+        try:
+            summary['nan_count'] = int(value.isna().values.sum())
+            numeric = columns.select_dtypes(include='number')
+            if len(numeric.columns) > 0 and len(numeric) > 0:
+                summary['min'] = self.__as_dict(numeric.min())
+                summary['max'] = self.__as_dict(numeric.max())
+                summary['mean'] = self.__as_dict(numeric.mean())
+        except Exception:
+            logging.debug("Cannot calculate statistics for data frame")
+        if len(value) > 0:
+            summary['head'] = columns.head(preview).to_string()
+            if len(value) > preview:
+                summary['tail'] = columns.tail(preview).to_string()
+        return _as_nodes(parent_node, summary)
+
+    @staticmethod
+    def __as_dict(series) -> Dict[str, any]:
+        return {str(key): _to_python(val) for key, val in series.items()}
+
+
+class PandasSeriesHandler(TypeHandler):
+    """
+    Handle pandas series.
+
+    Series are captured as a summary of the shape, dtype and memory size, with vectorised statistics and a preview
+    of the first and last values.
+    """
+
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        pandas = sys.modules.get('pandas')
+        return pandas is not None and issubclass(variable_type, pandas.Series)
+
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        return 'Shape: %s, DType: %s' % (value.shape, value.dtype), False
+
+    def value_size(self, value: any) -> Optional[int]:
+        """
+        Get the real size of the value.
+
+        :param value: the value to check
+        :return: the number of values in the series
+        """
+        return len(value)
+
+    def child_nodes(self, var_collector: 'Collector', parent_node: ParentNode, value: any) -> List[Node]:
+        """
+        Collect the child nodes for the value.
+
+        :param var_collector: the collector being used
+        :param parent_node: the node to use as the parent of the children
+        :param value: the value to collect the children from
+        :return: the child nodes
+        """
+        pandas = sys.modules['pandas']
+        preview = var_collector.max_collection_size
+        summary = {
+            'shape': str(value.shape),
+            'dtype': str(value.dtype),
+            'memory_usage': int(value.memory_usage(index=True, deep=False)),
+        }
+        try:
+            summary['nan_count'] = int(value.isna().sum())
+            if pandas.api.types.is_numeric_dtype(value.dtype) and summary['nan_count'] < len(value):
+                summary['min'] = _to_python(value.min())
+                summary['max'] = _to_python(value.max())
+                summary['mean'] = _to_python(value.mean())
+        except Exception:
+            logging.debug("Cannot calculate statistics for series of type %s", value.dtype)
+        if len(value) > 0:
+            summary['head'] = value.head(preview).tolist()
+            if len(value) > preview:
+                summary['tail'] = value.tail(preview).tolist()
+        return _as_nodes(parent_node, summary)
+
+
+_PRINTABLE = string.printable.encode('ascii')
+
+
+class BinaryHandler(TypeHandler):
+    """
+    Handle binary values (bytes, bytearray and memoryview).
+
+    Only the start of the value is read (using a memoryview slice), so large buffers are never copied. The value is
+    shown as text if the start of the value is printable ascii, otherwise it is shown as hex.
+    """
+
+    size_truncates = False
+
+    def can_handle(self, variable_type: type) -> bool:
+        """
+        Check if this handler can process values of the given type.
+
+        :param variable_type: the type to check
+        :return: True, if this handler should be used for the type
+        """
+        return issubclass(variable_type, (bytes, bytearray, memoryview))
+
+    def value_as_string(self, var_collector: 'Collector', value: any) -> Tuple[str, bool]:
+        """
+        Create the string value for the variable.
+
+        :param var_collector: the collector being used
+        :param value: the value to convert
+        :return: a tuple of the string value, and if the value was truncated
+        """
+        try:
+            view = memoryview(value).cast('B')
+        except (TypeError, ValueError):
+            # the memory is not contiguous, or has been released
+            return 'Size: %s' % self.value_size(value), True
+        with view:
+            limit = var_collector.max_string_length
+            prefix = view[:limit].tobytes()
+            size = len(view)
+        if len(prefix.translate(None, _PRINTABLE)) == 0:
+            return prefix.decode('ascii'), len(prefix) < size
+        # hex uses 2 characters per byte
+        prefix = prefix[:limit // 2]
+        return prefix.hex(), len(prefix) < size
+
+    def value_size(self, value: any) -> Optional[int]:
+        """
+        Get the real size of the value.
+
+        :param value: the value to check
+        :return: the number of bytes
+        """
+        try:
+            return value.nbytes if isinstance(value, memoryview) else len(value)
+        except ValueError:
+            # the memoryview has been released
+            return None
+
+
+TYPE_HANDLERS: List[TypeHandler] = [
+    BinaryHandler(),
+    NumpyArrayHandler(),
+    NumpyScalarHandler(),
+    PandasDataFrameHandler(),
+    PandasSeriesHandler(),
+]
+"""The available type handlers, the first handler that can handle a type is used."""
+
+_handler_cache: 'weakref.WeakKeyDictionary[type, Optional[TypeHandler]]' = weakref.WeakKeyDictionary()
+
+
+def find_type_handler(variable_type: type) -> Optional[TypeHandler]:
+    """
+    Find the handler to use for a type.
+
+    The result is cached per type, so the handlers are only checked the first time we see a type.
+
+    :param variable_type: the type to find a handler for
+    :return: the handler to use, or None if the type should be processed normally
+    """
+    try:
+        return _handler_cache[variable_type]
+    except KeyError:
+        pass
+    handler = None
+    for type_handler in TYPE_HANDLERS:
+        try:
+            if type_handler.can_handle(variable_type):
+                handler = type_handler
+                break
+        except Exception:
+            logging.debug("Type handler %s failed to check type %s", type_handler, variable_type)
+    try:
+        _handler_cache[variable_type] = handler
+    except TypeError:
+        # some types cannot be weakly referenced, so we cannot cache them
+        pass
+    return handler
@@ -22,11 +22,15 @@ and many options to consider when collecting.
 """
 
 import abc
-from typing import List
+import dataclasses
+import itertools
+import weakref
+from typing import List, Optional, Tuple, Iterable
 
 from deep import logging
 from deep.api.tracepoint import VariableId, Variable
 from .bfs import Node, ParentNode, NodeValue
+from .type_handlers import find_type_handler
 
 NO_CHILD_TYPES = [
     'str',
@@ -62,6 +66,106 @@ ITER_LIKE_TYPES = [
 NO_CHILD_TYPES += ITER_LIKE_TYPES
 
 
+class ClassFields:
+    """
+    The declared fields of a class.
+
+    Slotted classes, dataclasses and namedtuples declare the fields they hold. For these types we can read the
+    fields directly instead of going via `__dict__`, which slotted classes do not have.
+    """
+
+    def __init__(self, names: Tuple[str, ...], include_dict: bool):
+        """
+        Create a new class field descriptor.
+
+        :param names: the (mangled) names of the declared fields
+        :param include_dict: True, if instances can also have attributes in `__dict__`
+        """
+        self.names = names
+        self.include_dict = include_dict
+        self.name_set = frozenset(names)
+
+    def extra_attributes(self, value) -> Iterable[Tuple[str, any]]:
+        """
+        Get the attributes of an instance that are not declared fields.
+
+        :param value: the instance
+        :return: the attributes in `__dict__` that are not declared fields (e.g. set in `__post_init__`)
+        """
+        if not self.include_dict:
+            return ()
+        attributes = getattr(value, '__dict__', None)
+        if not isinstance(attributes, dict):
+            return ()
+        # dataclass fields are also stored in __dict__, so we skip them
+        return ((key, val) for key, val in attributes.items() if key not in self.name_set)
+
+    def count(self, value) -> int:
+        """
+        Count the fields of an instance, as they are collected.
+
+        :param value: the instance
+        :return: the number of declared fields that are set (slots can be unset), and the extra attributes
+        """
+        return sum(1 for name in self.names if hasattr(value, name)) \
+            + sum(1 for _ in self.extra_attributes(value))
+
+
+_class_fields_cache: 'weakref.WeakKeyDictionary[type, Optional[ClassFields]]' = weakref.WeakKeyDictionary()
+
+
+def _slot_names(variable_type: type) -> Tuple[str, ...]:
+    names = []
+    for cls in variable_type.__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for slot in slots:
+            if slot in ('__dict__', '__weakref__'):
+                continue
+            # private slots are stored with the class name prefix
+            if slot.startswith('__') and not slot.endswith('__'):
+                slot = '_%s%s' % (cls.__name__.lstrip('_'), slot)
+            if slot not in names:
+                names.append(slot)
+    return tuple(names)
+
+
+def class_fields(variable_type: type) -> Optional[ClassFields]:
+    """
+    Get the declared fields for a type.
+
+    The result is cached per type.
+
+    :param variable_type: the type to check
+    :return: the declared fields, or None if the type does not declare fields
+    """
+    try:
+        return _class_fields_cache[variable_type]
+    except KeyError:
+        pass
+    fields = None
+    try:
+        # instances of subclasses (without __slots__) and dataclasses can have other attributes in __dict__
+        has_dict = getattr(variable_type, '__dictoffset__', 0) != 0
+        if issubclass(variable_type, tuple) and hasattr(variable_type, '_fields'):
+            fields = ClassFields(tuple(variable_type._fields), has_dict)
+        elif dataclasses.is_dataclass(variable_type):
+            fields = ClassFields(tuple(field.name for field in dataclasses.fields(variable_type)), has_dict)
+        else:
+            slots = _slot_names(variable_type)
+            if len(slots) > 0:
+                fields = ClassFields(slots, True)
+    except Exception:
+        logging.debug("Cannot get fields for type %s", variable_type)
+    try:
+        _class_fields_cache[variable_type] = fields
+    except TypeError:
+        # some types cannot be weakly referenced, so we cannot cache them
+        pass
+    return fields
+
+
 class Collector(abc.ABC):
     """A type that is used to manage variable collection."""
 
@@ -96,7 +200,7 @@ class Collector(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def check_id(self, identity_hash_id: str) -> str:
+    def check_id(self, identity_hash_id: int) -> Optional[int]:
         """
         Check if the identity_hash_id is known to us, and return the lookup id.
 
@@ -106,17 +210,21 @@ class Collector(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def new_var_id(self, identity_hash_id: str) -> str:
+    def new_var_id(self, identity_hash_id: int, value: any) -> int:
         """
         Create a new cache id for the lookup.
 
+        The collector should keep a reference to the value, so the identity hash cannot be reused while the
+        collection is active.
+
         :param identity_hash_id: the id of the object
+        :param value: the object the id is for
         :return: the new lookup id
         """
         pass
 
     @abc.abstractmethod
-    def append_variable(self, var_id: str, variable: Variable):
+    def append_variable(self, var_id: int, variable: Variable):
         """
         Append a variable to the var lookup.
 
@@ -128,14 +236,14 @@ class Collector(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def append_child(self, variable_id: str, child: VariableId):
+    def append_child(self, variable_id: int, child: VariableId):
         """
         Append a chile to existing variable.
 
         This is called when a child variable has been processed and the result should be attached to a
         variable that has already been processed.
 
-        :param str variable_id: the internal variable id of the parent variable
+        :param int variable_id: the internal variable id of the parent variable
         :param VariableId child: the internal variable id value to attach to the parent
         """
         pass
@@ -204,16 +312,37 @@ def variable_to_string(variable_type, var_value):
             return f'{type(var_value)}@{id(var_value)}'
 
 
-def process_variable(var_collector: Collector, node: NodeValue) -> VariableResponse:
+def variable_value_string(var_collector: Collector, value: any) -> Tuple[str, bool]:
+    """
+    Get the string value of a variable, as it is collected.
+
+    The string is created by the type handler (if there is one) and truncated to 'max_string_length'.
+
+    :param var_collector: the collector being used
+    :param value: the value to convert
+    :return: the string value, and True if the string is truncated
+    """
+    variable_type = type(value)
+    handler = find_type_handler(variable_type)
+    if handler is not None:
+        value_str, handler_truncated = handler.value_as_string(var_collector, value)
+    else:
+        value_str, handler_truncated = variable_to_string(variable_type, value), False
+    value_str, truncated = truncate_string(value_str, var_collector.max_string_length)
+    return value_str, truncated or handler_truncated
+
+
+def process_variable(var_collector: Collector, node: NodeValue, bounded: bool = True) -> VariableResponse:
     """
     Process the variable into a serializable type.
 
     :param var_collector: the collector being used
     :param node: the variable node to process
+    :param bounded: if False, the children are not limited by 'max_collection_size' (e.g. the frame locals)
     :return: a response to determine if we continue
     """
     # get the variable hash id
-    identity_hash_id = str(id(node.value))
+    identity_hash_id = id(node.value)
     # guess the modifiers
     modifiers = var_modifiers(node.name)
     # check the collector cache for this id
@@ -226,15 +355,24 @@ def process_variable(var_collector: Collector, node: NodeValue) -> VariableRespo
         return VariableResponse(VariableId(cache_id, node.name, modifiers, node.original_name), process_children=False)
 
     # if we do not have a cache_id - then create one
-    var_id = var_collector.new_var_id(identity_hash_id)
+    var_id = var_collector.new_var_id(identity_hash_id, node.value)
 
     # crete the variable id to use
     variable_id = VariableId(var_id, node.name, modifiers, node.original_name)
     # extract variable type
     variable_type = type(node.value)
     # create a string value of the variable
-    variable_value_str, truncated = truncate_string(variable_to_string(variable_type, node.value),
-                                                    var_collector.max_string_length)
+    variable_value_str, truncated = variable_value_string(var_collector, node.value)
+    handler = find_type_handler(variable_type)
+    if handler is not None:
+        size = handler.value_size(node.value)
+        size_truncates = handler.size_truncates
+    else:
+        size = collection_size(variable_type, node.value)
+        size_truncates = True
+    # a collection is truncated if it has more children than we will collect
+    truncated = truncated \
+        or (bounded and size_truncates and size is not None and size > var_collector.max_collection_size)
 
     # create a variable for the lookup
     variable = Variable(str(variable_type.__name__), variable_value_str, identity_hash_id, [], truncated)
@@ -244,6 +382,35 @@ def process_variable(var_collector: Collector, node: NodeValue) -> VariableRespo
     return VariableResponse(variable_id, process_children=True)
 
 
+def collection_size(variable_type: type, value: any) -> Optional[int]:
+    """
+    Get the real size of a collection, or object.
+
+    For objects the size is the number of attributes, as these are what is collected as children.
+
+    :param variable_type: the variable type
+    :param value: the variable value
+    :return: the size of the value, or None if the value is not a collection
+    """
+    if variable_type.__name__ in NO_CHILD_TYPES:
+        return None
+    try:
+        if variable_type is dict or variable_type.__name__ in LIST_LIKE_TYPES:
+            return len(value)
+        if isinstance(value, Exception):
+            return len(value.args)
+        fields = class_fields(variable_type)
+        if fields is not None:
+            return fields.count(value)
+        attributes = getattr(value, '__dict__', None)
+        if isinstance(attributes, dict):
+            return len(attributes)
+        return None
+    except Exception:
+        logging.debug("Cannot get size of type %s", variable_type)
+    return None
+
+
 def truncate_string(string, max_length):
     """
     Truncate the incoming string to the specified length.
@@ -257,9 +424,10 @@ def truncate_string(string, max_length):
 
 def process_child_nodes(
         var_collector: Collector,
-        variable_id: str,
+        variable_id: int,
         var_value: any,
-        frame_depth: int
+        frame_depth: int,
+        bounded: bool = True
 ) -> List[Node]:
     """
     Collect the child nodes for this variable.
@@ -270,6 +438,7 @@ def process_child_nodes(
     :param variable_id: the variable if to attach children to
     :param var_value: the value we are looking at for children
     :param frame_depth: the current depth we are at
+    :param bounded: if False, the children of a dict are not limited by 'max_collection_size' (e.g. the frame locals)
     :return:
     """
     variable_type = type(var_value)
@@ -288,7 +457,7 @@ def process_child_nodes(
             var_collector.append_child(variable_id, child)
 
     # scan the child based on type
-    return find_children_for_parent(var_collector, VariableParent(), var_value, variable_type)
+    return find_children_for_parent(var_collector, VariableParent(), var_value, variable_type, bounded)
 
 
 def correct_names(name, val):
@@ -306,7 +475,7 @@ def correct_names(name, val):
 
 
 def find_children_for_parent(var_collector: Collector, parent_node: ParentNode, value: any,
-                             variable_type: type):
+                             variable_type: type, bounded: bool = True):
     """
     Scan the parent for children based on the type.
 
@@ -314,41 +483,93 @@ def find_children_for_parent(var_collector: Collector, parent_node: ParentNode,
     :param parent_node: the parent node
     :param value: the variable value we are processing
     :param variable_type: the type of the variable
+    :param bounded: if False, the children of a dict are not limited by 'max_collection_size'
     :return: list of child nodes
     """
+    handler = find_type_handler(variable_type)
+    if handler is not None:
+        return handler.child_nodes(var_collector, parent_node, value)
     if variable_type is dict:
-        return process_dict_breadth_first(parent_node, variable_type.__name__, value)
+        return process_dict_breadth_first(var_collector, parent_node, variable_type.__name__, value,
+                                          bounded=bounded)
     elif variable_type.__name__ in LIST_LIKE_TYPES:
         return process_list_breadth_first(var_collector, parent_node, value)
     elif isinstance(value, Exception):
         return process_list_breadth_first(var_collector, parent_node, value.args)
-    elif hasattr(value, '__class__'):
-        return process_dict_breadth_first(parent_node, variable_type.__name__, value.__dict__, correct_names)
-    elif hasattr(value, '__dict__'):
-        return process_dict_breadth_first(parent_node, variable_type.__name__, value.__dict__)
-    else:
-        logging.debug("Unknown type processed %s", variable_type)
-        return []
 
+    fields = class_fields(variable_type)
+    if fields is not None:
+        return process_fields_breadth_first(var_collector, parent_node, variable_type.__name__, value, fields)
 
-def process_dict_breadth_first(parent_node, type_name, value, func=lambda x, y: y) -> List[Node]:
+    attributes = getattr(value, '__dict__', None)
+    if isinstance(attributes, dict):
+        return process_dict_breadth_first(var_collector, parent_node, variable_type.__name__, attributes,
+                                          correct_names)
+    logging.debug("Unknown type processed %s", variable_type)
+    return []
+
+
+def process_fields_breadth_first(var_collector: Collector, parent_node: ParentNode, type_name: str, value,
+                                 fields: ClassFields) -> List[Node]:
     """
-    Process a dict value.
+    Process an object with declared fields.
 
-    Take a dict and collect all the child nodes for the dict.
+    Take an object and collect the child nodes from the declared fields. Returned list is limited by the config
+    'max_collection_size'. Slots that have not been set are ignored.
 
-    :param (ParentNode) parent_node: the node that represents the list, to be used as the parent for the returned nodes
+    :param (Collector) var_collector: the collector that is managing this collection
+    :param (ParentNode) parent_node: the node that represents the object, to be used as the parent for the returned
+     nodes
     :param (str) type_name: the name of the type we are processing
-    :param (any) value: the list value to process
-    :param (Callable) func: an optional function to preprocess values
+    :param (any) value: the object value to process
+    :param (ClassFields) fields: the declared fields of the type
+    :return (list): the collected child nodes
+    """
+    nodes = []
+    max_size = var_collector.max_collection_size
+    for name in fields.names:
+        if len(nodes) >= max_size:
+            return nodes
+        try:
+            field_value = getattr(value, name)
+        except AttributeError:
+            # slot has not been set
+            continue
+        nodes.append(Node(value=NodeValue(correct_names(type_name, name), field_value, name), parent=parent_node))
+
+    for key, val in itertools.islice(fields.extra_attributes(value), max_size - len(nodes)):
+        nodes.append(Node(value=NodeValue(correct_names(type_name, key), val, key), parent=parent_node))
+    return nodes
+
 
-    :param func:
+def process_dict_breadth_first(var_collector: Collector, parent_node: ParentNode, type_name: str, value,
+                               func=lambda x, y: y, bounded: bool = True) -> List[Node]:
+    """
+    Process a dict value.
+
+    Take a dict and collect the child nodes for the dict. Returned list is limited by the config
+    'max_collection_size', unless it is not bounded. Only the items we collect are read from the dict, the full key
+    set is never copied.
+
+    :param (Collector) var_collector: the collector that is managing this collection
+    :param (ParentNode) parent_node: the node that represents the dict, to be used as the parent for the returned nodes
+    :param (str) type_name: the name of the type we are processing
+    :param (any) value: the dict value to process
+    :param (Callable) func: an optional function to preprocess the keys
+    :param (bool) bounded: if False, all the items are collected (e.g. for the frame locals)
     :return (list): the collected child nodes
     """
-    # we wrap the keys() in a call to list to prevent concurrent changes
-    return [Node(value=NodeValue(func(type_name, key), value[key], key), parent=parent_node) for key in
-            list(value.keys()) if
-            key in value]
+    nodes = []
+    items = value.items()
+    if bounded:
+        items = itertools.islice(items, var_collector.max_collection_size)
+    try:
+        for key, val_ in items:
+            nodes.append(Node(value=NodeValue(func(type_name, key), val_, key), parent=parent_node))
+    except RuntimeError:
+        # the dict was changed while we were reading it, so we just use what we have collected
+        logging.debug("Collection modified during processing of %s", type_name)
+    return nodes
 
 
 def process_list_breadth_first(var_collector: Collector, parent_node: ParentNode, value) -> List[Node]:
@@ -356,7 +577,7 @@ def process_list_breadth_first(var_collector: Collector, parent_node: ParentNode
     Process a list value.
 
     Take a list and collect all the child nodes for the list. Returned list is
-    limited by the config 'max_collection_size'.
+    limited by the config 'max_collection_size'. Only the items we collect are read from the collection.
 
     :param (Collector) var_collector: the collector that is managing this collection
     :param (ParentNode) parent_node: the node that represents the list, to be used as the parent for the returned nodes
@@ -364,10 +585,10 @@ def process_list_breadth_first(var_collector: Collector, parent_node: ParentNode
     :return (list): the collected child nodes
     """
     nodes = []
-    total = 0
-    for val_ in tuple(value):
-        if total >= var_collector.max_collection_size:
-            break
-        nodes.append(Node(value=NodeValue(str(total), val_), parent=parent_node))
-        total += 1
+    try:
+        for total, val_ in enumerate(itertools.islice(value, var_collector.max_collection_size)):
+            nodes.append(Node(value=NodeValue(str(total), val_), parent=parent_node))
+    except RuntimeError:
+        # the collection was changed while we were reading it, so we just use what we have collected
+        logging.debug("Collection modified during processing of %s", type(value).__name__)
     return nodes
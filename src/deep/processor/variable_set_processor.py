@@ -28,12 +28,13 @@
 
 """Handle the processing of variables sets."""
 
-from typing import Tuple, Optional, Dict
+from typing import Optional, Dict, List
 
 from deep.api.tracepoint import Variable, VariableId
 from deep.processor.bfs import ParentNode, Node, NodeValue, breadth_first_search
+from deep.processor.capture_budget import CaptureBudget
 from deep.processor.variable_processor import process_variable, \
-    process_child_nodes, Collector
+    process_child_nodes, Collector, variable_value_string
 
 
 class VariableCacheProvider:
@@ -41,40 +42,46 @@ class VariableCacheProvider:
     Variable cache provider.
 
     Manage the caching of variables for a trigger context.
+
+    The cache is keyed by the identity (`id()`) of the values. As an id is only unique for the lifetime of the object,
+    we keep a reference to every value we have seen. This prevents short-lived values (e.g. the results of watch
+    expressions) from being garbage collected, and their id being reused by an unrelated value, while the trigger
+    context is active.
     """
 
-    __cache: Dict[str, str]
+    __cache: Dict[int, int]
+    __values: List[any]
 
     def __init__(self):
         """Create new cache."""
         self.__cache = {}
+        self.__values = []
 
-    def check_id(self, identity_hash_id) -> Optional[str]:
+    def check_id(self, identity_hash_id: int) -> Optional[int]:
         """
         Check if id is in the cache.
 
         :param identity_hash_id: the identity hash to check
         :return: the internal id for this hash, or None if not set
         """
-        if identity_hash_id in self.__cache:
-            return self.__cache[identity_hash_id]
-        return None
+        return self.__cache.get(identity_hash_id)
 
     @property
     def size(self):
         """The number of variables we have cached."""
         return len(self.__cache)
 
-    def new_var_id(self, identity_hash_id):
+    def new_var_id(self, identity_hash_id: int, value: any) -> int:
         """
         Create a new variable id from the hash id.
 
         :param identity_hash_id: the hash id to map the new id to.
+        :param value: the value the hash id is for
         :return: the new id
         """
-        var_count = self.size
-        new_id = str(var_count + 1)
+        new_id = len(self.__cache) + 1
         self.__cache[identity_hash_id] = new_id
+        self.__values.append(value)
         return new_id
 
 
@@ -106,32 +113,37 @@ class VariableProcessorConfig:
 class VariableSetProcessor(Collector):
     """Handle the processing of variables."""
 
-    def __init__(self, var_lookup: Dict[str, 'Variable'], var_cache: VariableCacheProvider,
-                 config: VariableProcessorConfig = VariableProcessorConfig()):
+    def __init__(self, var_lookup: Dict[int, 'Variable'], var_cache: VariableCacheProvider,
+                 config: VariableProcessorConfig = VariableProcessorConfig(), budget: Optional[CaptureBudget] = None):
         """
         Create a new variable set processor.
 
         :param var_lookup: the var lookup to use
         :param var_cache: the var cache to use
         :param config: the var process config to use
+        :param budget: the budget to stop processing when exceeded
         """
         self.__var_lookup = var_lookup
         self.__var_cache = var_cache
         self.__config = config
+        self.__budget = budget
+        self.__unbounded: Optional[Node] = None
 
-    def process_variable(self, name: str, value: any) -> Tuple[VariableId, str]:
+    def process_variable(self, name: str, value: any, bounded: bool = True) -> VariableId:
         """
         Process a variable name and value.
 
         :param name: the variable name
         :param value: the variable value
-        :return:
+        :param bounded: if False, the children of the value are not limited by 'max_collection_size', this is used
+                        for the frame locals, so every local is collected
+        :return: the variable id (with a vid of None, if the budget was exceeded before the value was processed)
         """
-        identity_hash_id = str(id(value))
+        identity_hash_id = id(value)
         check_id = self.__var_cache.check_id(identity_hash_id)
         if check_id is not None:
             # this means the watch result is already in the var_lookup
-            return VariableId(check_id, name), str(value)
+            return VariableId(check_id, name)
 
         # else this is an unknown value so process breadth first
         var_ids = []
@@ -144,11 +156,30 @@ class VariableSetProcessor(Collector):
         root_parent = FrameParent()
 
         initial_nodes = [Node(NodeValue(name, value), parent=root_parent)]
+        self.__unbounded = None if bounded else initial_nodes[0]
         breadth_first_search(Node(None, initial_nodes, root_parent), self.search_function)
+        self.__unbounded = None
 
         var_id = self.__var_cache.check_id(identity_hash_id)
 
-        return VariableId(var_id, name), str(value)
+        return VariableId(var_id, name)
+
+    def value_string(self, variable_id: VariableId, value: any) -> str:
+        """
+        Get the string value of a processed variable (e.g. for a log message).
+
+        This is the collected (truncated) value of the variable, rather than the full string value, as that can be
+        very large (e.g. the repr of a large collection or buffer).
+
+        :param variable_id: the id returned by :meth:`process_variable`
+        :param value: the variable value
+        :return: the string value
+        """
+        variable = self.__var_lookup.get(variable_id.vid)
+        if variable is not None:
+            return variable.value
+        # the value was collected by another processor (e.g. the frame locals), so create the same string again
+        return variable_value_string(self, value)[0]
 
     def search_function(self, node: Node) -> bool:
         """
@@ -163,13 +194,18 @@ class VariableSetProcessor(Collector):
             # we have exceeded the var count, so do not continue
             return False
 
+        if self.__budget is not None and self.__budget.tick():
+            # we have run out of time, so stop with what we have
+            return False
+
         node_value = node.value
         if node_value is None:
             # this node has no value, continue with children
             return True
 
         # process this node variable
-        process_result = process_variable(self, node_value)
+        bounded = node is not self.__unbounded
+        process_result = process_variable(self, node_value, bounded)
         var_id = process_result.variable_id
         # add the result to the parent - this maintains the hierarchy in the var look up
         node.parent.add_child(var_id)
@@ -177,7 +213,7 @@ class VariableSetProcessor(Collector):
         # some variables do not want the children processed (e.g. strings)
         if process_result.process_children:
             # process children and add to node
-            child_nodes = process_child_nodes(self, var_id.vid, node_value.value, node.depth)
+            child_nodes = process_child_nodes(self, var_id.vid, node_value.value, node.depth, bounded)
             node.add_children(child_nodes)
         return True
 
@@ -226,12 +262,14 @@ class VariableSetProcessor(Collector):
         This is called when a child variable has been processed and the result should be attached to a
         variable that has already been processed.
 
-        :param str variable_id: the internal variable id of the parent variable
+        :param int variable_id: the internal variable id of the parent variable
         :param VariableId child: the internal variable id value to attach to the parent
         """
         self.__var_lookup[variable_id].children.append(child)
+        if self.__budget is not None:
+            self.__budget.add_bytes(child.estimated_size)
 
-    def check_id(self, identity_hash_id: str) -> str:
+    def check_id(self, identity_hash_id: int) -> Optional[int]:
         """
         Check if the identity_hash_id is known to us, and return the lookup id.
 
@@ -240,14 +278,15 @@ class VariableSetProcessor(Collector):
         """
         return self.__var_cache.check_id(identity_hash_id)
 
-    def new_var_id(self, identity_hash_id: str) -> str:
+    def new_var_id(self, identity_hash_id: int, value: any) -> int:
         """
         Create a new cache id for the lookup.
 
         :param identity_hash_id: the id of the object
+        :param value: the object the id is for
         :return: the new lookup id
         """
-        return self.__var_cache.new_var_id(identity_hash_id)
+        return self.__var_cache.new_var_id(identity_hash_id, value)
 
     def append_variable(self, var_id, variable):
         """
@@ -259,3 +298,5 @@ class VariableSetProcessor(Collector):
         :param variable: the internal value of the variable
         """
         self.__var_lookup[var_id] = variable
+        if self.__budget is not None:
+            self.__budget.add_bytes(variable.estimated_size)
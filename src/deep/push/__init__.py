@@ -45,14 +45,22 @@ def __convert_tracepoint(tracepoint: TrPoCo):
 
 
 def __convert_frame(frame: StFr):
-    return StackFrame(file_name=frame.file_name, short_path=frame.short_path, method_name=frame.method_name,
-                      line_number=frame.line_number, class_name=frame.class_name, is_async=frame.is_async,
-                      column_number=frame.column_number, variables=[__convert_variable_id(v) for v in frame.variables],
-                      app_frame=frame.app_frame,
-                      transpiled_file_name=frame.transpiled_file_name,
-                      transpiled_line_number=frame.transpiled_line_number,
-                      transpiled_column_number=frame.transpiled_column_number,
-                      )
+    if frame.encoded is not None:
+        return frame.encoded
+    converted = StackFrame(file_name=frame.file_name, short_path=frame.short_path, method_name=frame.method_name,
+                           line_number=frame.line_number, class_name=frame.class_name, is_async=frame.is_async,
+                           column_number=frame.column_number,
+                           variables=[__convert_variable_id(v) for v in frame.variables],
+                           app_frame=frame.app_frame,
+                           transpiled_file_name=frame.transpiled_file_name,
+                           transpiled_line_number=frame.transpiled_line_number,
+                           transpiled_column_number=frame.transpiled_column_number,
+                           )
+    if len(frame.variables) == 0:
+        # frames without variables are not modified, so we can reuse the encoding (the message is copied when it is
+        # added to a snapshot)
+        frame.encoded = converted
+    return converted
 
 
 def __convert_watch_source(source):
@@ -65,21 +73,21 @@ def __convert_watch(watch: WaRe):
 
 
 def __convert_variable(variable: Var):
-    return Variable(type=variable.type, value=variable.value, hash=variable.hash,
+    return Variable(type=variable.type, value=variable.value, hash=str(variable.hash),
                     children=[__convert_variable_id(c) for c in variable.children], truncated=variable.truncated)
 
 
 def __convert_variable_id(variable: VarId):
     if variable is None:
         return None
-    return VariableID(ID=variable.vid, name=variable.name, modifiers=variable.modifiers,
+    return VariableID(ID=str(variable.vid), name=variable.name, modifiers=variable.modifiers,
                       original_name=variable.original_name)
 
 
 def __convert_lookup(var_lookup):
     converted = {}
     for k, v in var_lookup.items():
-        converted[k] = __convert_variable(v)
+        converted[str(k)] = __convert_variable(v)
     return converted
 
 
@@ -0,0 +1,257 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Encode snapshots directly to the protobuf wire format.
+
+Converting a snapshot with :func:`deep.push.convert_snapshot` creates a protobuf message for every variable, variable
+id and frame, which is then serialized. This encoder writes the wire format in a single pass over the captured data,
+without the intermediate messages. The result is the same as serializing the converted snapshot (the fields may be
+in a different order, which does not change the decoded message).
+
+The encoded snapshot is sent with :class:`EncodedSnapshotServiceStub`, which sends the bytes as they are.
+"""
+
+from typing import Optional, List
+
+# noinspection PyUnresolvedReferences
+from deepproto.proto.common.v1.common_pb2 import KeyValue
+# noinspection PyUnresolvedReferences
+from deepproto.proto.tracepoint.v1.tracepoint_pb2 import TracePointConfig, WatchSource, SnapshotResponse
+
+from deep import logging
+from deep.api.tracepoint import EventSnapshot, StackFrame, WatchResult, Variable, VariableId
+from deep.grpc import convert_value
+
+_VARINTS = [bytes((i,)) for i in range(128)]
+
+
+def _varint(value: int) -> bytes:
+    if value < 128:
+        return _VARINTS[value]
+    out = bytearray()
+    while value > 127:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _string(tag: bytes, value) -> bytes:
+    # empty strings are the default, so are not written
+    if not value:
+        return b''
+    encoded = value.encode('utf-8')
+    return tag + _varint(len(encoded)) + encoded
+
+
+def _optional_string(tag: bytes, value) -> bytes:
+    # optional fields are written if they are set, even if empty
+    if value is None:
+        return b''
+    encoded = value.encode('utf-8')
+    return tag + _varint(len(encoded)) + encoded
+
+
+def _uint(tag: bytes, value) -> bytes:
+    if not value:
+        return b''
+    return tag + _varint(value)
+
+
+def _optional_uint(tag: bytes, value) -> bytes:
+    if value is None:
+        return b''
+    return tag + _varint(value)
+
+
+def _optional_bool(tag: bytes, value) -> bytes:
+    if value is None:
+        return b''
+    return tag + (b'\x01' if value else b'\x00')
+
+
+def _message(tag: bytes, encoded) -> bytes:
+    return tag + _varint(len(encoded)) + encoded
+
+
+def _variable_id(variable_id: VariableId) -> bytes:
+    out = bytearray()
+    value = str(variable_id.vid)
+    if value:
+        encoded = value.encode('utf-8')
+        out += b'\x0a'
+        out += _varint(len(encoded))
+        out += encoded
+    value = variable_id.name
+    if value:
+        encoded = value.encode('utf-8')
+        out += b'\x12'
+        out += _varint(len(encoded))
+        out += encoded
+    for modifier in variable_id.modifiers:
+        out += _optional_string(b'\x1a', modifier)
+    if variable_id.original_name is not None:
+        out += _optional_string(b'\x22', variable_id.original_name)
+    return out
+
+
+_TYPES = {}
+"""The encoded type field, by type name, there are few type names so these are reused."""
+
+
+def _variable(variable: Variable) -> bytearray:
+    out = bytearray()
+    value = variable.type
+    if value:
+        encoded = _TYPES.get(value)
+        if encoded is None:
+            encoded = _TYPES[value] = _string(b'\x0a', value)
+        out += encoded
+    value = variable.value
+    if value:
+        encoded = value.encode('utf-8')
+        out += b'\x12'
+        out += _varint(len(encoded))
+        out += encoded
+    value = str(variable.hash)
+    if value:
+        encoded = value.encode('utf-8')
+        out += b'\x1a'
+        out += _varint(len(encoded))
+        out += encoded
+    for child in variable.children:
+        encoded = _variable_id(child)
+        out += b'\x22'
+        out += _varint(len(encoded))
+        out += encoded
+    value = variable.truncated
+    if value is not None:
+        out += b'\x28\x01' if value else b'\x28\x00'
+    return out
+
+
+def _var_lookup(var_lookup) -> bytearray:
+    # the map is encoded as repeated entries of (key = 1, value = 2)
+    out = bytearray()
+    for key, variable in var_lookup.items():
+        key = str(key).encode('utf-8')
+        value = _variable(variable)
+        key_length = _varint(len(key))
+        value_length = _varint(len(value))
+        out += b'\x1a'
+        out += _varint(2 + len(key_length) + len(key) + len(value_length) + len(value))
+        out += b'\x0a'
+        out += key_length
+        out += key
+        out += b'\x12'
+        out += value_length
+        out += value
+    return out
+
+
+def _frame(frame: StackFrame) -> bytes:
+    if frame.encoded_bytes is not None:
+        return frame.encoded_bytes
+    parts = [_string(b'\x0a', frame.file_name), _string(b'\x12', frame.method_name),
+             _uint(b'\x18', frame.line_number), _optional_string(b'\x22', frame.class_name),
+             _optional_bool(b'\x28', frame.is_async), _optional_uint(b'\x30', frame.column_number),
+             _optional_string(b'\x3a', frame.transpiled_file_name),
+             _optional_uint(b'\x40', frame.transpiled_line_number),
+             _optional_uint(b'\x48', frame.transpiled_column_number)]
+    for variable_id in frame.variables:
+        parts.append(_message(b'\x52', _variable_id(variable_id)))
+    parts.append(_optional_bool(b'\x58', frame.app_frame))
+    parts.append(_optional_string(b'\x6a', frame.short_path))
+    encoded = _message(b'\x2a', b''.join(parts))
+    if len(frame.variables) == 0:
+        # frames without variables are not modified, so the encoding can be shared between snapshots
+        frame.encoded_bytes = encoded
+    return encoded
+
+
+def _watch(watch: WatchResult) -> bytes:
+    parts = [_string(b'\x0a', watch.expression)]
+    if watch.error is not None:
+        parts.append(_optional_string(b'\x1a', watch.error))
+    elif watch.result is not None:
+        parts.append(_message(b'\x12', _variable_id(watch.result)))
+    parts.append(_uint(b'\x28', WatchSource.Value(watch.source)))
+    return _message(b'\x32', b''.join(parts))
+
+
+def _key_values(tag: bytes, attributes) -> List[bytes]:
+    return [_message(tag, KeyValue(key=k, value=convert_value(v)).SerializeToString()) for k, v in attributes.items()]
+
+
+def _tracepoint(tracepoint) -> bytes:
+    # the tracepoint config is shared by all the snapshots for an action, so the encoding is cached on it
+    encoded = tracepoint.encoded
+    if encoded is None:
+        encoded = tracepoint.encoded = _message(b'\x12', TracePointConfig(
+            ID=tracepoint.id, path=tracepoint.path, line_number=tracepoint.line_no, args=tracepoint.args,
+            watches=tracepoint.watches).SerializeToString())
+    return encoded
+
+
+_RESOURCE = (None, b'')
+"""The last resource encoded, and its encoding. The resource does not change unless the client is reconfigured."""
+
+
+def _resource(resource) -> bytes:
+    global _RESOURCE
+    cached, encoded = _RESOURCE
+    if cached is not resource:
+        encoded = b''.join(_key_values(b'\x4a', resource.attributes))
+        _RESOURCE = (resource, encoded)
+    return encoded
+
+
+def encode_snapshot(snapshot: EventSnapshot) -> Optional[bytes]:
+    """
+    Encode a snapshot to the protobuf wire format of the Snapshot message.
+
+    :param snapshot: the snapshot to encode
+    :return: the encoded snapshot, or None if the snapshot cannot be encoded
+    """
+    try:
+        parts = [_message(b'\x0a', snapshot.id.to_bytes(16, "big")), _tracepoint(snapshot.tracepoint)]
+        parts.append(_var_lookup(snapshot.var_lookup))
+        # ts_nanos is a fixed64
+        parts.append(b'\x21' + snapshot.ts_nanos.to_bytes(8, "little"))
+        parts.extend(_frame(frame) for frame in snapshot.frames)
+        parts.extend(_watch(watch) for watch in snapshot.watches)
+        parts.extend(_key_values(b'\x3a', snapshot.attributes))
+        parts.append(_uint(b'\x40', snapshot.duration_nanos))
+        parts.append(_resource(snapshot.resource))
+        parts.append(_optional_string(b'\x52', snapshot.log_msg))
+        return b''.join(parts)
+    except Exception:
+        logging.exception("Error encoding snapshot")
+        return None
+
+
+class EncodedSnapshotServiceStub:
+    """A stub for the snapshot service, that sends snapshots that are already encoded by :func:`encode_snapshot`."""
+
+    def __init__(self, channel):
+        """
+        Create a new stub.
+
+        :param channel: the grpc channel
+        """
+        self.send = channel.unary_unary('/deepproto.proto.tracepoint.v1.SnapshotService/send',
+                                        request_serializer=None,
+                                        response_deserializer=SnapshotResponse.FromString)
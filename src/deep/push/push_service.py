@@ -15,40 +15,460 @@
 
 """Provide service for pushing events to Deep services."""
 
-from deepproto.proto.tracepoint.v1.tracepoint_pb2_grpc import SnapshotServiceStub
+import asyncio
+import functools
+import threading
+from collections import deque
+from enum import Enum
+from typing import List, Optional, Deque, Tuple, Union
 
 from deep import logging
 from deep.api.tracepoint import EventSnapshot
-from deep.utils import snapshot_id_as_hex_str
+from deep.grpc.circuit_breaker import CircuitOpenError
+from deep.grpc.grpc_service import is_retryable
+from deep.push.encoder import encode_snapshot, EncodedSnapshotServiceStub
+from deep.push.spool import SnapshotSpool
+from deep.utils import snapshot_id_as_hex_str, time_ns, RepeatedTimer
+
+DROP_NEWEST = "drop_newest"
+"""When the queue is full, drop the new snapshot."""
+DROP_OLDEST = "drop_oldest"
+"""When the queue is full, drop the oldest snapshots that are waiting to be sent."""
+COALESCE = "coalesce"
+"""When the queue is full, replace the newest waiting snapshot from the same tracepoint with the new snapshot."""
+
+
+class _DropOutcome(Enum):
+    """What happened to a new snapshot, when the pending limit was exceeded."""
+
+    QUEUED = 1
+    """Room was made for the snapshot, and it should be queued."""
+    DROPPED = 2
+    """The snapshot was dropped."""
+    COALESCED = 3
+    """The snapshot replaced a waiting snapshot from the same tracepoint."""
+
+
+_DROP_METRICS = {
+    _DropOutcome.DROPPED: 'push_dropped_snapshots',
+    _DropOutcome.COALESCED: 'push_coalesced_snapshots',
+}
+
+
+def _sent(snapshot: EventSnapshot):
+    # a snapshot that was sent can be used as the baseline for delta snapshots
+    tracker = getattr(snapshot, 'delta_tracker', None)
+    if tracker is not None:
+        tracker.confirm(snapshot.id_str)
+
+
+def _lost(snapshot: EventSnapshot):
+    # a snapshot that was not sent (dropped, spooled or failed) must not be used as the baseline for delta snapshots
+    tracker = getattr(snapshot, 'delta_tracker', None)
+    if tracker is not None:
+        tracker.discard(snapshot.id_str)
+
+
+class _Batch:
+    """A group of snapshots that are sent by a single task."""
+
+    def __init__(self):
+        """Create a new batch."""
+        self.snapshots: List[EventSnapshot] = []
+        self.sizes: List[int] = []
+        self.size = 0
+        self.closed = False
+
+    def add(self, snapshot: EventSnapshot, size: int):
+        """
+        Add a snapshot to the batch.
+
+        :param snapshot: the snapshot
+        :param size: the (estimated) size of the snapshot
+        """
+        self.snapshots.append(snapshot)
+        self.sizes.append(size)
+        self.size += size
+
+    def remove(self, index: int) -> int:
+        """
+        Remove a snapshot from the batch.
+
+        :param index: the index of the snapshot
+        :return: the size of the removed snapshot
+        """
+        del self.snapshots[index]
+        size = self.sizes.pop(index)
+        self.size -= size
+        return size
 
 
 class PushService:
-    """This service deals with pushing the snapshots to the service endpoints."""
+    """
+    This service deals with pushing the snapshots to the service endpoints.
+
+    Snapshots are grouped into batches, each batch is sent by a single task (or coroutine, when using the
+    asynchronous transport). A batch stays open, and can take more snapshots, until the task starts (after the
+    optional linger time), or the batch is full. So when the upload is keeping up, each snapshot is sent straight
+    away, and when there is a burst of snapshots they are grouped.
+
+    The number and size of the snapshots waiting to be sent is limited. When the limit is reached the drop policy
+    decides which snapshots are dropped.
+
+    If a spool path is configured, snapshots that are dropped, or that fail to send as the service is unavailable,
+    are written to the :class:`SnapshotSpool` instead. The spool is written, and sent once the service is available,
+    by a timer thread.
+    """
 
-    def __init__(self, grpc, task_handler):
+    def __init__(self, grpc, task_handler, config=None):
         """
         Create a service to handle push events.
 
         :param grpc: the grpc service to use to send events
         :param task_handler: the task handler to offload tasks to
+        :param config: the config service, if not set the pending snapshots are not limited, not batched, and the
+                       uploads have no deadline
         """
         self.grpc = grpc
         self.task_handler = task_handler
+        self.__config = config
+        self.__max_pending_bytes = int(config.MAX_PENDING_SNAPSHOT_BYTES) if config is not None else None
+        self.__max_pending_snapshots = int(config.MAX_PENDING_SNAPSHOTS) if config is not None else None
+        self.__drop_policy = config.PUSH_DROP_POLICY if config is not None else DROP_NEWEST
+        self.__batch_size = int(config.PUSH_BATCH_SIZE) if config is not None else 1
+        self.__batch_bytes = int(config.PUSH_BATCH_BYTES) if config is not None else 0
+        self.__batch_linger = int(config.PUSH_BATCH_LINGER_MS) / 1000 if config is not None else 0
+        self.__push_timeout = float(config.PUSH_TIMEOUT) if config is not None else None
+        self.__spool = SnapshotSpool(config.SPOOL_PATH, int(config.SPOOL_MAX_BYTES)) \
+            if config is not None and config.SPOOL_PATH else None
+        self.__spool_timer: Optional[RepeatedTimer] = None
+        self.__queue: Deque[_Batch] = deque()
+        self.__pending_bytes = 0
+        self.__pending_snapshots = 0
+        self.__lock = threading.Lock()
+        self.dropped_snapshots = 0
+        """The number of snapshots dropped as the pending limit was exceeded."""
+        self.coalesced_snapshots = 0
+        """The number of waiting snapshots that were replaced by a newer snapshot from the same tracepoint."""
+        self.truncated_snapshots = 0
+        """The number of snapshots that were truncated during capture."""
+
+    @property
+    def pending_bytes(self) -> int:
+        """The (estimated) size in bytes of the snapshots waiting to be sent."""
+        return self.__pending_bytes
+
+    @property
+    def pending_snapshots(self) -> int:
+        """The number of snapshots waiting to be sent (the queue depth)."""
+        return self.__pending_snapshots
+
+    @property
+    def spool(self) -> Optional[SnapshotSpool]:
+        """The spool for snapshots that could not be sent, or None if it is not enabled."""
+        return self.__spool
+
+    def start(self):
+        """Open the snapshot spool, if it is enabled, and start the timer that writes and sends it."""
+        if self.__spool is None:
+            return
+        if not self.__spool.open():
+            self.__spool = None
+            return
+        self.__spool_timer = RepeatedTimer("Deep snapshot spool", float(self.__config.SPOOL_DRAIN_INTERVAL),
+                                           self.drain_spool)
+        self.__spool_timer.start()
+
+    def stop(self):
+        """
+        Stop the timer that sends the spool.
+
+        This must be called before the grpc service is shutdown, as a running drain waits for its calls to complete.
+        """
+        if self.__spool_timer is not None:
+            self.__spool_timer.stop()
+        self.__spool_timer = None
+
+    def shutdown(self):
+        """
+        Write the buffered snapshots to the spool, and close it.
+
+        This is called after the grpc service is shutdown, so the snapshots that failed to send are spooled.
+        """
+        self.stop()
+        if self.__spool is not None:
+            self.__spool.close()
+
+    def drain_spool(self):
+        """Write the buffered snapshots to the spool, then send the spooled snapshots, oldest first."""
+        spool = self.__spool
+        if spool is None:
+            return
+        spool.flush()
+        while not self.grpc.circuit_breaker.is_open:
+            first, records = spool.peek(self.__batch_size)
+            if len(records) == 0:
+                return
+            stub = self.grpc.stub(EncodedSnapshotServiceStub)
+            sent = 0
+            for error in self.grpc.call_all(stub.send, records, self.__push_timeout):
+                if error is not None and (isinstance(error, CircuitOpenError) or is_retryable(error)):
+                    # keep the rest in the spool, so they are sent in order when the service is available
+                    break
+                if error is not None:
+                    logging.error("Failed to upload spooled snapshot: %s", error)
+                sent += 1
+            spool.remove(first, sent)
+            logging.debug("Uploaded %s spooled snapshots", sent)
+            if sent < len(records):
+                return
 
     def push_snapshot(self, snapshot: EventSnapshot):
         """Push a snapshot to the deep services."""
-        task = self.task_handler.submit_task(self._push_task, snapshot)
-        task.add_done_callback(
-            lambda _: logging.debug("Completed uploading snapshot %s", snapshot_id_as_hex_str(snapshot.id)))
+        start = time_ns()
+        size, truncated = 0, False
+        if isinstance(snapshot, EventSnapshot):
+            # use the size counted while capturing, so we do not walk the variables on the app thread again
+            size = snapshot.captured_bytes if snapshot.captured_bytes is not None else snapshot.estimated_size
+            truncated = snapshot.attributes.get('truncated', False)
+        outcome = _DropOutcome.QUEUED
+        dropped: List[EventSnapshot] = []
+        with self.__lock:
+            if truncated:
+                self.truncated_snapshots += 1
+            if not self.__has_capacity(size, 1):
+                outcome = self.__apply_drop_policy(snapshot, size, dropped)
+                if outcome is not _DropOutcome.QUEUED:
+                    if outcome is _DropOutcome.DROPPED:
+                        _lost(snapshot)
+                        dropped.append(snapshot)
+                    self.__report_enqueue(start, self.__pending_snapshots, _DROP_METRICS[outcome])
+            if outcome is _DropOutcome.QUEUED:
+                self.__pending_bytes += size
+                self.__pending_snapshots += 1
+
+                batch = self.__queue[-1] if len(self.__queue) > 0 else None
+                new_batch = batch is None or len(batch.snapshots) >= self.__batch_size \
+                    or batch.size + size > self.__batch_bytes
+                if new_batch:
+                    batch = _Batch()
+                    self.__queue.append(batch)
+                batch.add(snapshot, size)
+                depth = self.__pending_snapshots
+
+        if self.__spool is not None:
+            # the spool encodes the snapshots, so this is done outside the lock
+            for dropped_snapshot in dropped:
+                self.__spool.add(dropped_snapshot)
+        if outcome is not _DropOutcome.QUEUED:
+            return
+
+        self.__report_enqueue(start, depth)
+        if not new_batch:
+            # the snapshot will be sent by the task of the open batch
+            return
+
+        if self.grpc.transport is not None:
+            task = self.grpc.transport.submit(self._push_task_async(batch))
+        elif self.__batch_linger > 0:
+            # wait for more snapshots to join the batch, without holding a task handler worker
+            timer = threading.Timer(self.__batch_linger, self.__submit_lingering, (batch,))
+            timer.daemon = True
+            timer.start()
+            return
+        else:
+            task = self.task_handler.submit_task(self._push_task, batch)
+        task.add_done_callback(functools.partial(self.__batch_completed, batch))
 
-    def _push_task(self, snapshot):
-        from deep.push import convert_snapshot
-        converted = convert_snapshot(snapshot)
-        if converted is None:
+    def __submit_lingering(self, batch: _Batch):
+        try:
+            task = self.task_handler.submit_task(self._push_task, batch)
+        except Exception:
+            logging.exception("Failed to submit snapshot upload")
+            self.__batch_completed(batch, None)
             return
+        task.add_done_callback(functools.partial(self.__batch_completed, batch))
 
-        logging.debug("Uploading snapshot: %s", snapshot_id_as_hex_str(snapshot.id))
+    def __batch_completed(self, batch: _Batch, _):
+        with self.__lock:
+            if not batch.closed:
+                # the task did not start, so the batch is still in the queue
+                batch.closed = True
+                self.__queue.remove(batch)
+            self.__pending_bytes -= batch.size
+            self.__pending_snapshots -= len(batch.snapshots)
+        for sent in batch.snapshots:
+            logging.debug("Completed uploading snapshot %s", snapshot_id_as_hex_str(sent.id))
 
-        stub = SnapshotServiceStub(self.grpc.channel)
+    def __has_capacity(self, size: int, count: int) -> bool:
+        if self.__max_pending_bytes is not None and self.__pending_bytes + size > self.__max_pending_bytes:
+            return False
+        if self.__max_pending_snapshots is not None \
+                and self.__pending_snapshots + count > self.__max_pending_snapshots:
+            return False
+        return True
+
+    def __apply_drop_policy(self, snapshot: EventSnapshot, size: int, dropped: List[EventSnapshot]) -> _DropOutcome:
+        """
+        Make room for a new snapshot, when the pending limit is exceeded.
+
+        :param snapshot: the new snapshot
+        :param size: the size of the new snapshot
+        :param dropped: the list to add the waiting snapshots that are dropped to
+        :return: what happened to the new snapshot
+        """
+        if self.__drop_policy == COALESCE and isinstance(snapshot, EventSnapshot):
+            # replace the newest waiting snapshot from the same tracepoint
+            for batch in reversed(self.__queue):
+                for index in range(len(batch.snapshots) - 1, -1, -1):
+                    if getattr(batch.snapshots[index], 'tracepoint', None) is not None \
+                            and batch.snapshots[index].tracepoint.id == snapshot.tracepoint.id:
+                        old_size = batch.sizes[index]
+                        if not self.__has_capacity(size - old_size, 0):
+                            continue
+                        _lost(batch.snapshots[index])
+                        batch.snapshots[index] = snapshot
+                        batch.sizes[index] = size
+                        batch.size += size - old_size
+                        self.__pending_bytes += size - old_size
+                        self.coalesced_snapshots += 1
+                        return _DropOutcome.COALESCED
+        elif self.__drop_policy == DROP_OLDEST:
+            # drop the oldest waiting snapshots until the new snapshot fits
+            removed = 0
+            while not self.__has_capacity(size, 1):
+                batch = next((batch for batch in self.__queue if len(batch.snapshots) > 0), None)
+                if batch is None:
+                    break
+                _lost(batch.snapshots[0])
+                dropped.append(batch.snapshots[0])
+                self.__pending_bytes -= batch.remove(0)
+                self.__pending_snapshots -= 1
+                self.dropped_snapshots += 1
+                removed += 1
+            if removed > 0:
+                logging.debug("Dropped %s waiting snapshots, pending snapshot limit exceeded", removed)
+            if self.__has_capacity(size, 1):
+                return _DropOutcome.QUEUED
+
+        self.dropped_snapshots += 1
+        logging.debug("Dropping snapshot %s, pending snapshot limit exceeded", snapshot_id_as_hex_str(snapshot.id))
+        return _DropOutcome.DROPPED
+
+    def __report_enqueue(self, start: int, depth: int, dropped: Optional[str] = None):
+        config = self.__config
+        if config is None or not config.has_metric_processor:
+            return
+        latency = (time_ns() - start) / 1000000
+        for processor in config.metric_processors:
+            try:
+                processor.gauge('push_queue_depth', {}, 'deep', 'The number of snapshots waiting to be sent', '',
+                                depth)
+                processor.histogram('push_enqueue_latency', {}, 'deep', 'The time taken to queue a snapshot', 'ms',
+                                    latency)
+                if dropped is not None:
+                    processor.counter(dropped, {'policy': self.__drop_policy}, 'deep',
+                                      'The number of snapshots dropped, or replaced, as the pending limit was exceeded',
+                                      '', 1)
+            except Exception:
+                logging.exception("Failed to report push metrics to %s", processor)
+
+    def _push_task(self, batch: _Batch):
+        snapshots, encoded = self.__take_batch(batch)
+        if len(encoded) == 0:
+            return
 
-        stub.send(converted, metadata=self.grpc.metadata())
+        stub = self.grpc.stub(EncodedSnapshotServiceStub)
+        if len(encoded) == 1:
+            try:
+                self.grpc.call(stub.send, encoded[0], self.__push_timeout)
+            except CircuitOpenError:
+                self.__shed([encoded[0]])
+                _lost(snapshots[0])
+            except Exception as error:
+                _lost(snapshots[0])
+                if not self.__spool_failed(encoded[0], error):
+                    raise
+            else:
+                _sent(snapshots[0])
+            return
+
+        self.__report_errors(snapshots, encoded, self.grpc.call_all(stub.send, encoded, self.__push_timeout))
+
+    async def _push_task_async(self, batch: _Batch):
+        if self.__batch_linger > 0:
+            await asyncio.sleep(self.__batch_linger)
+        snapshots, encoded = self.__take_batch(batch)
+        if len(encoded) == 0:
+            return
+
+        stub = self.grpc.stub(EncodedSnapshotServiceStub)
+        self.__report_errors(snapshots, encoded,
+                             await self.grpc.call_all_async(stub.send, encoded, self.__push_timeout))
+
+    def __take_batch(self, batch: _Batch) -> Tuple[List[EventSnapshot], List[bytes]]:
+        """
+        Close the batch, and encode the snapshots to send.
+
+        :param batch: the batch
+        :return: the snapshots and their encodings, empty if the snapshots were shed as the circuit breaker is open
+        """
+        with self.__lock:
+            if not batch.closed:
+                batch.closed = True
+                self.__queue.remove(batch)
+            snapshots = list(batch.snapshots)
+
+        if self.grpc.circuit_breaker.is_open:
+            # the service is down, so shed the snapshots rather than wait for the calls to fail
+            self.__shed(snapshots)
+            for snapshot in snapshots:
+                _lost(snapshot)
+            return [], []
+
+        sent, encoded = [], []
+        for snapshot in snapshots:
+            encoded_snapshot = encode_snapshot(snapshot)
+            if encoded_snapshot is not None:
+                logging.debug("Uploading snapshot: %s", snapshot_id_as_hex_str(snapshot.id))
+                sent.append(snapshot)
+                encoded.append(encoded_snapshot)
+            else:
+                _lost(snapshot)
+        return sent, encoded
+
+    def __report_errors(self, snapshots: List[EventSnapshot], encoded: List[bytes],
+                        errors: List[Optional[Exception]]):
+        for snapshot, encoded_snapshot, error in zip(snapshots, encoded, errors):
+            if error is None:
+                _sent(snapshot)
+                continue
+            _lost(snapshot)
+            if isinstance(error, CircuitOpenError):
+                self.__shed([encoded_snapshot])
+            elif not self.__spool_failed(encoded_snapshot, error):
+                logging.error("Failed to upload snapshot %s: %s", snapshot_id_as_hex_str(snapshot.id), error)
+
+    def __spool_failed(self, encoded_snapshot: bytes, error: Exception) -> bool:
+        """
+        Spool a snapshot that failed to send, if the failure is temporary.
+
+        :param encoded_snapshot: the encoded snapshot
+        :param error: the error from the call
+        :return: True, if the snapshot was spooled
+        """
+        if self.__spool is None or not is_retryable(error):
+            return False
+        self.__spool.add(encoded_snapshot)
+        logging.debug("Spooled snapshot, upload failed: %s", error)
+        return True
+
+    def __shed(self, snapshots: List[Union[EventSnapshot, bytes]]):
+        if self.__spool is not None:
+            for snapshot in snapshots:
+                self.__spool.add(snapshot)
+            logging.debug("Spooled %s snapshots, circuit breaker is open", len(snapshots))
+            return
+        with self.__lock:
+            self.dropped_snapshots += len(snapshots)
+        logging.debug("Dropped %s snapshots, circuit breaker is open", len(snapshots))
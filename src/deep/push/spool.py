@@ -0,0 +1,262 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A durable, on-disk spool for snapshots that could not be sent.
+
+The spool is a ring file, that is memory mapped. The file starts with a header that holds the position of the oldest
+record (the head), the position to write the next record (the tail), and the number of bytes in use. After the header
+each record is the length of the encoded snapshot (4 bytes) followed by the encoded snapshot. When a record does not
+fit before the end of the file, the rest of the file is skipped (marked with a length of 0xFFFFFFFF, if there is
+space) and the record is written at the start. When the file is full the oldest records are dropped.
+
+Snapshots are added to an in memory buffer, which is written to the file in batches, by :meth:`SnapshotSpool.flush`.
+So adding a snapshot never waits for disk I/O, and can be done on application threads.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import deque
+from typing import Optional, Deque, Tuple, List, Union
+
+from deep import logging
+from deep.api.tracepoint import EventSnapshot
+from deep.push.encoder import encode_snapshot
+
+_MAGIC = b'DSP1'
+_HEADER = struct.Struct('<4s4xQQQ')
+"""The file header: the magic bytes, the head position, the tail position, and the bytes in use."""
+_LENGTH = struct.Struct('<I')
+_SKIP = 0xFFFFFFFF
+"""The length that marks the rest of the file as unused."""
+
+
+class SnapshotSpool:
+    """A memory mapped ring file of encoded snapshots."""
+
+    FLUSH_BYTES = 1048576
+    """The size of the buffered snapshots that causes them to be written to the spool file."""
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Create a new spool.
+
+        :param path: the path to the spool file
+        :param max_bytes: the max size of the spool file
+        """
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__capacity = max_bytes - _HEADER.size
+        self.__map: Optional[mmap.mmap] = None
+        self.__head = 0
+        self.__tail = 0
+        self.__used = 0
+        self.__count = 0
+        self.__first = 0
+        self.__lock = threading.Lock()
+        self.__pending: Deque[bytes] = deque()
+        self.__pending_bytes = 0
+        self.__pending_lock = threading.Lock()
+        self.dropped_snapshots = 0
+        """The number of snapshots dropped, as the spool was full."""
+
+    @property
+    def path(self) -> str:
+        """The path to the spool file."""
+        return self.__path
+
+    def __len__(self):
+        """Get the number of snapshots in the spool file."""
+        return self.__count
+
+    def open(self) -> bool:
+        """
+        Open, or create, the spool file.
+
+        Snapshots left in an existing spool file, of the same size, are kept.
+
+        :return: True, if the spool file was opened
+        """
+        if self.__capacity <= _LENGTH.size:
+            logging.error("Snapshot spool size %s is too small", self.__max_bytes)
+            return False
+        try:
+            fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                existing = os.fstat(fd).st_size
+                if existing != self.__max_bytes:
+                    os.ftruncate(fd, self.__max_bytes)
+                spool_map = mmap.mmap(fd, self.__max_bytes)
+            finally:
+                # the map keeps its own handle to the file
+                os.close(fd)
+        except Exception:
+            logging.exception("Failed to open snapshot spool %s", self.__path)
+            return False
+
+        with self.__lock:
+            self.__map = spool_map
+            magic, head, tail, used = _HEADER.unpack_from(spool_map, 0)
+            if existing == self.__max_bytes and magic == _MAGIC and used <= self.__capacity \
+                    and head <= self.__capacity and tail <= self.__capacity:
+                self.__head, self.__tail, self.__used = head, tail, used
+                self.__count = self.__count_records()
+            else:
+                self.__head, self.__tail, self.__used, self.__count = 0, 0, 0, 0
+                self.__write_header()
+        logging.info("Opened snapshot spool %s with %s snapshots", self.__path, self.__count)
+        return True
+
+    def close(self):
+        """Write the buffered snapshots, and close the spool file."""
+        self.flush()
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.flush()
+                self.__map.close()
+            self.__map = None
+
+    def add(self, snapshot: Union[EventSnapshot, bytes]):
+        """
+        Add a snapshot to the spool.
+
+        The snapshot is encoded, so the snapshot itself is not kept, and buffered in memory until the next
+        :meth:`flush`, or until 'FLUSH_BYTES' are buffered. If the buffer is larger than the spool file, the oldest
+        buffered snapshots are dropped, as they would be overwritten in the file.
+
+        :param snapshot: the snapshot, or the snapshot encoded by :func:`deep.push.encoder.encode_snapshot`
+        """
+        if isinstance(snapshot, EventSnapshot):
+            snapshot = encode_snapshot(snapshot)
+            if snapshot is None:
+                return
+        with self.__pending_lock:
+            self.__pending.append(snapshot)
+            self.__pending_bytes += len(snapshot)
+            while self.__pending_bytes > self.__max_bytes and len(self.__pending) > 1:
+                self.__pending_bytes -= len(self.__pending.popleft())
+                self.dropped_snapshots += 1
+            full = self.__pending_bytes >= self.FLUSH_BYTES
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered snapshots to the spool file."""
+        with self.__pending_lock:
+            if len(self.__pending) == 0:
+                return
+            encoded = self.__pending
+            self.__pending = deque()
+            self.__pending_bytes = 0
+
+        with self.__lock:
+            if self.__map is None:
+                self.dropped_snapshots += len(encoded)
+                logging.debug("Dropped %s snapshots, snapshot spool is not open", len(encoded))
+                return
+            for record in encoded:
+                self.__append(record)
+            self.__write_header()
+            self.__map.flush()
+
+    def peek(self, max_records: int) -> Tuple[int, List[bytes]]:
+        """
+        Read the oldest snapshots in the spool file, without removing them.
+
+        :param max_records: the max number of snapshots to read
+        :return: the sequence number of the first snapshot (to pass to :meth:`remove`), and the encoded snapshots
+        """
+        with self.__lock:
+            records = []
+            if self.__map is None:
+                return self.__first, records
+            head, used = self.__head, self.__used
+            while used > 0 and len(records) < max_records:
+                head, used, record = self.__read(head, used)
+                records.append(record)
+            return self.__first, records
+
+    def remove(self, first: int, count: int):
+        """
+        Remove snapshots that were read by :meth:`peek`.
+
+        Snapshots that were dropped, as the spool was full, since they were read are not removed again.
+
+        :param first: the sequence number returned by :meth:`peek`
+        :param count: the number of snapshots to remove
+        """
+        with self.__lock:
+            if self.__map is None:
+                return
+            while self.__first < first + count and self.__count > 0:
+                self.__remove_oldest()
+            self.__write_header()
+
+    def __count_records(self) -> int:
+        head, used, count = self.__head, self.__used, 0
+        while used > 0:
+            head, used, _ = self.__read(head, used)
+            count += 1
+        return count
+
+    def __read(self, head: int, used: int) -> Tuple[int, int, bytes]:
+        # skip the unused space at the end of the file
+        if self.__capacity - head < _LENGTH.size \
+                or _LENGTH.unpack_from(self.__map, _HEADER.size + head)[0] == _SKIP:
+            used -= self.__capacity - head
+            head = 0
+        length = _LENGTH.unpack_from(self.__map, _HEADER.size + head)[0]
+        start = _HEADER.size + head + _LENGTH.size
+        record = self.__map[start:start + length]
+        return head + _LENGTH.size + length, used - _LENGTH.size - length, record
+
+    def __remove_oldest(self):
+        self.__head, self.__used, _ = self.__read(self.__head, self.__used)
+        self.__count -= 1
+        self.__first += 1
+        if self.__used == 0:
+            self.__head, self.__tail = 0, 0
+
+    def __append(self, record: bytes):
+        size = _LENGTH.size + len(record)
+        if size > self.__capacity:
+            self.dropped_snapshots += 1
+            logging.debug("Dropped snapshot of %s bytes, it is larger than the snapshot spool", len(record))
+            return
+        # if the record does not fit before the end of the file, the rest of the file is skipped
+        wrap = self.__tail + size > self.__capacity
+        skipped = self.__capacity - self.__tail if wrap else 0
+        while self.__capacity - self.__used < size + skipped:
+            self.__remove_oldest()
+            self.dropped_snapshots += 1
+            if self.__used == 0:
+                # the spool is empty, so the record is written at the start
+                wrap, skipped = False, 0
+        if wrap:
+            if skipped >= _LENGTH.size:
+                _LENGTH.pack_into(self.__map, _HEADER.size + self.__tail, _SKIP)
+            self.__used += skipped
+            self.__tail = 0
+        offset = _HEADER.size + self.__tail
+        _LENGTH.pack_into(self.__map, offset, len(record))
+        self.__map[offset + _LENGTH.size:offset + size] = record
+        self.__tail += size
+        self.__used += size
+        self.__count += 1
+
+    def __write_header(self):
+        _HEADER.pack_into(self.__map, 0, _MAGIC, self.__head, self.__tail, self.__used)
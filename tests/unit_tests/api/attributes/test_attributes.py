@@ -182,3 +182,15 @@ class TestBoundedAttributes(unittest.TestCase):
         bdict = BoundedAttributes()
         with self.assertRaises(TypeError):
             bdict["should-not-work"] = "dict immutable"
+
+    def test_immutable_iteration(self):
+        bdict = BoundedAttributes(attributes={"a": 1, "b": 2})
+        self.assertEqual(["a", "b"], list(bdict))
+        self.assertEqual({"a": 1, "b": 2}, dict(bdict.items()))
+
+        mutable = BoundedAttributes(immutable=False)
+        mutable["a"] = 1
+        for _ in mutable:
+            # mutable attributes iterate over a copy, so they can be changed during iteration
+            mutable["b"] = 2
+        self.assertEqual(["a", "b"], list(mutable))
@@ -0,0 +1,169 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import concurrent.futures
+import threading
+import time
+import unittest
+
+import grpc
+import mockito
+
+import deep.logging
+from deep.api.resource import Resource
+from deep.config import ConfigService
+from deep.grpc import GRPCService
+from deep.grpc.circuit_breaker import CircuitOpenError, HALF_OPEN
+from deep.poll import LongPoll
+from deep.push import PushService
+from utils import MockRpcError, mock_snapshot
+
+# noinspection PyUnresolvedReferences
+from deepproto.proto.poll.v1.poll_pb2 import PollResponse, ResponseType
+
+
+class AsyncMockRpc:
+    """A grpc.aio stub method that fails with the given errors, before returning the response."""
+
+    def __init__(self, response=None, *errors):
+        self.response = response
+        self.errors = list(errors)
+        self.calls = []
+
+    async def __call__(self, request, **kwargs):
+        self.calls.append((request, threading.current_thread().name, kwargs))
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return self.response
+
+
+class TestAioTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigService({'GRPC_TRANSPORT': 'aio', 'SERVICE_URL': 'localhost:1', 'SERVICE_SECURE': 'False',
+                                     'GRPC_RETRY_BACKOFF_MS': 0})
+        deep.logging.init(self.config)
+        self.service = GRPCService(self.config)
+        self.service.start()
+
+    def tearDown(self):
+        self.service.shutdown()
+        mockito.unstub()
+
+    def test_start_creates_aio_channel(self):
+        self.assertIsNotNone(self.service.transport)
+        self.assertIsInstance(self.service.channel, grpc.aio.Channel)
+
+    def test_call_runs_on_event_loop(self):
+        rpc = AsyncMockRpc("response", MockRpcError(grpc.StatusCode.UNAVAILABLE))
+        self.assertEqual("response", self.service.call(rpc, "request", 5))
+
+        self.assertEqual(2, len(rpc.calls))
+        self.assertEqual("Deep gRPC aio", rpc.calls[0][1])
+        self.assertEqual(5, rpc.calls[0][2]['timeout'])
+
+    def test_call_all_runs_concurrently(self):
+        rpc = AsyncMockRpc("response", MockRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+        errors = self.service.call_all(rpc, ["one", "two", "three"], 5)
+
+        self.assertEqual(3, len(rpc.calls))
+        self.assertEqual(1, len([error for error in errors if error is not None]))
+
+    def test_cancelled_probe_is_released(self):
+        config = ConfigService({'GRPC_TRANSPORT': 'aio', 'SERVICE_URL': 'localhost:1', 'SERVICE_SECURE': 'False',
+                                'GRPC_RETRY_BACKOFF_MS': 0, 'CIRCUIT_BREAKER_FAILURES': 1,
+                                'CIRCUIT_BREAKER_RESET': 0.1})
+        service = GRPCService(config)
+        service.start()
+        self.addCleanup(service.shutdown)
+        breaker = service.circuit_breaker
+        breaker.record_failure()
+        time.sleep(0.1)
+
+        rpc = AsyncMockRpc("response", asyncio.CancelledError(), MockRpcError(grpc.StatusCode.UNAVAILABLE))
+        with self.assertRaises(concurrent.futures.CancelledError):
+            service.call(rpc, "request", 5)
+        self.assertNotEqual(HALF_OPEN, breaker.state)
+
+        # the released probe lets the next call probe the service, its failure rejects the rest of the batch
+        errors = service.call_all(rpc, ["one", "two"], 5)
+        self.assertEqual(2, len(rpc.calls))
+        self.assertIsInstance(errors[1], CircuitOpenError)
+
+    def test_blocking_call_on_event_loop_thread(self):
+        rpc = AsyncMockRpc("response")
+
+        async def call_on_loop():
+            return self.service.call(rpc, "request", 5)
+
+        with self.assertRaises(RuntimeError):
+            self.service.transport.submit(call_on_loop()).result(5)
+        self.assertEqual(0, len(rpc.calls))
+
+    def test_blocking_call_times_out(self):
+        config = ConfigService({'GRPC_TRANSPORT': 'aio', 'SERVICE_URL': 'localhost:1', 'SERVICE_SECURE': 'False',
+                                'GRPC_MAX_RETRIES': 0})
+        service = GRPCService(config)
+        service.start()
+        self.addCleanup(service.shutdown)
+
+        # noinspection PyUnusedLocal
+        async def slow_rpc(request, **kwargs):
+            await asyncio.sleep(10)
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            service.call(slow_rpc, "request", 0.1)
+        errors = service.call_all(slow_rpc, ["one", "two"], 0.1)
+        self.assertTrue(all(isinstance(error, concurrent.futures.TimeoutError) for error in errors))
+
+    def test_push_uses_transport(self):
+        handler = mockito.mock()
+        rpc = AsyncMockRpc()
+        mock_channel = mockito.mock()
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(rpc)
+        self.service.channel = mock_channel
+        push = PushService(self.service, handler, self.config)
+
+        push.push_snapshot(mock_snapshot())
+        push.push_snapshot(mock_snapshot())
+        self.service.transport.flush()
+
+        mockito.verify(handler, times=0).submit_task(mockito.ANY, mockito.ANY)
+        self.assertLessEqual(1, len(rpc.calls))
+        self.assertTrue(all(call[1] == "Deep gRPC aio" for call in rpc.calls))
+        self.assertEqual(0, push.pending_snapshots)
+
+    def test_poll_uses_transport(self):
+        tracepoints = mockito.mock()
+        tracepoints.current_hash = '123'
+        config = ConfigService({'POLL_TIMER': 0.01}, tracepoints=tracepoints)
+        config.resource = Resource.create()
+        rpc = AsyncMockRpc(PollResponse(response_type=ResponseType.NO_CHANGE))
+        mock_channel = mockito.mock()
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(rpc)
+        self.service.channel = mock_channel
+        poll = LongPoll(config, self.service)
+
+        poll.start()
+        deadline = time.time() + 5
+        while len(rpc.calls) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        poll.shutdown()
+
+        self.assertIsNone(poll.timer)
+        self.assertLessEqual(3, len(rpc.calls))
+        self.assertTrue(all(call[1] == "Deep gRPC aio" for call in rpc.calls))
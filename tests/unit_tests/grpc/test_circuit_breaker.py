@@ -0,0 +1,89 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+from deep.grpc.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(3, 60)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(OPEN, breaker.state)
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(2, 60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_probe_after_reset(self):
+        breaker = CircuitBreaker(1, 0)
+        breaker.record_failure()
+        self.assertEqual(OPEN, breaker.state)
+        self.assertFalse(breaker.is_open)
+
+        # only a single probe is allowed
+        self.assertTrue(breaker.allow())
+        self.assertEqual(HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_opens(self):
+        breaker = CircuitBreaker(1, 0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(OPEN, breaker.state)
+
+    def test_released_probe(self):
+        breaker = CircuitBreaker(1, 60)
+        breaker.record_failure()
+        self.assertIsNone(breaker.admit())
+
+        breaker = CircuitBreaker(1, 0)
+        breaker.record_failure()
+        self.assertEqual(HALF_OPEN, breaker.admit())
+        self.assertIsNone(breaker.admit())
+
+        # the probe ended without a result, so the next call is a new probe
+        breaker.release_probe()
+        self.assertEqual(OPEN, breaker.state)
+        self.assertEqual(HALF_OPEN, breaker.admit())
+
+        # releasing does nothing once the result is recorded
+        breaker.record_success()
+        breaker.release_probe()
+        self.assertEqual(CLOSED, breaker.admit())
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(0, 60)
+        for _ in range(10):
+            breaker.record_failure()
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
@@ -0,0 +1,215 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import time
+import unittest
+from concurrent.futures import Future
+
+import grpc
+import mockito
+# noinspection PyUnresolvedReferences
+from deepproto.proto.tracepoint.v1.tracepoint_pb2 import Snapshot
+# noinspection PyUnresolvedReferences
+from deepproto.proto.tracepoint.v1.tracepoint_pb2_grpc import SnapshotServiceStub
+
+from deep.config import ConfigService
+from deep.grpc import GRPCService
+from deep.grpc.circuit_breaker import CircuitOpenError, OPEN, CLOSED, HALF_OPEN
+from utils import MockRpcError
+
+
+class MockRpc:
+    """A stub method that fails with the given errors, before returning the request."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def __call__(self, request, **kwargs):
+        self.calls.append(kwargs)
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return request
+
+    def future(self, request, **kwargs):
+        future = Future()
+        try:
+            future.set_result(self(request, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestGRPCService(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigService({'GRPC_RETRY_BACKOFF_MS': 0, 'CIRCUIT_BREAKER_FAILURES': 3})
+        self.service = GRPCService(self.config)
+
+    def tearDown(self):
+        self.service.shutdown()
+        mockito.unstub()
+
+    def test_stubs_are_cached(self):
+        self.service.channel = mockito.mock()
+        stub = self.service.stub(SnapshotServiceStub)
+        self.assertIs(stub, self.service.stub(SnapshotServiceStub))
+
+        # a new channel needs a new stub
+        self.service.channel = mockito.mock()
+        self.assertIsNot(stub, self.service.stub(SnapshotServiceStub))
+
+    def test_channel_options(self):
+        options = dict(self.service.channel_options())
+        self.assertEqual(16777216, options['grpc.max_send_message_length'])
+        self.assertEqual(5000, options['grpc.max_reconnect_backoff_ms'])
+        self.assertNotIn('grpc.keepalive_time_ms', options)
+        self.assertNotIn('grpc.service_config', options)
+
+        service = GRPCService(ConfigService({'GRPC_KEEPALIVE_TIME_MS': '30000',
+                                             'GRPC_SERVICE_CONFIG': '{"loadBalancingConfig": [{"round_robin": {}}]}'}))
+        options = dict(service.channel_options())
+        self.assertEqual(30000, options['grpc.keepalive_time_ms'])
+        self.assertEqual(10000, options['grpc.keepalive_timeout_ms'])
+        self.assertEqual('{"loadBalancingConfig": [{"round_robin": {}}]}', options['grpc.service_config'])
+
+    def test_call_compression(self):
+        small = Snapshot(ID=b'small')
+        large = Snapshot(ID=b'a' * 2048)
+        self.assertIsNone(self.service.call_compression(large))
+
+        service = GRPCService(ConfigService({'GRPC_COMPRESSION': 'gzip'}))
+        self.assertEqual(grpc.Compression.NoCompression, service.call_compression(small))
+        self.assertEqual(grpc.Compression.Gzip, service.call_compression(large))
+
+        service = GRPCService(ConfigService({'GRPC_COMPRESSION': 'deflate', 'GRPC_COMPRESSION_THRESHOLD': 0}))
+        self.assertEqual(grpc.Compression.Deflate, service.call_compression(small))
+
+    def test_call_uses_compression(self):
+        service = GRPCService(ConfigService({'GRPC_COMPRESSION': 'gzip'}))
+        rpc = MockRpc()
+        service.call(rpc, Snapshot(ID=b'a' * 2048), 5)
+        service.call_all(rpc, [Snapshot(ID=b'small'), Snapshot(ID=b'a' * 2048)], 5)
+
+        self.assertEqual([grpc.Compression.Gzip, grpc.Compression.NoCompression, grpc.Compression.Gzip],
+                         [call['compression'] for call in rpc.calls])
+
+    def test_start_watches_connectivity(self):
+        service = GRPCService(ConfigService({'SERVICE_URL': 'localhost:1', 'SERVICE_SECURE': 'False',
+                                             'GRPC_COMPRESSION': 'gzip'}))
+        service.start()
+        deadline = time.time() + 5
+        while service.connectivity is None and time.time() < deadline:
+            time.sleep(0.01)
+        service.shutdown()
+
+        self.assertIsNotNone(service.connectivity)
+
+    def test_reconnect_when_idle(self):
+        self.service.channel = mockito.mock()
+        mockito.when(grpc).channel_ready_future(self.service.channel).thenReturn(mockito.mock())
+
+        # noinspection PyUnresolvedReferences
+        self.service._GRPCService__on_connectivity(grpc.ChannelConnectivity.READY)
+        mockito.verify(grpc, times=0).channel_ready_future(mockito.ANY)
+
+        # noinspection PyUnresolvedReferences
+        self.service._GRPCService__on_connectivity(grpc.ChannelConnectivity.IDLE)
+        mockito.verify(grpc, times=1).channel_ready_future(self.service.channel)
+        self.assertEqual(grpc.ChannelConnectivity.IDLE, self.service.connectivity)
+
+    def test_call_has_deadline(self):
+        rpc = MockRpc()
+        self.assertEqual("request", self.service.call(rpc, "request", 5))
+        self.assertEqual(5, rpc.calls[0]['timeout'])
+
+    def test_call_retries_unavailable(self):
+        rpc = MockRpc(MockRpcError(grpc.StatusCode.UNAVAILABLE), MockRpcError(grpc.StatusCode.DEADLINE_EXCEEDED))
+        self.assertEqual("request", self.service.call(rpc, "request", 5))
+        self.assertEqual(3, len(rpc.calls))
+
+    def test_call_does_not_retry_other_errors(self):
+        rpc = MockRpc(MockRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+        with self.assertRaises(grpc.RpcError):
+            self.service.call(rpc, "request", 5)
+        self.assertEqual(1, len(rpc.calls))
+
+    def test_call_stops_when_breaker_opens(self):
+        rpc = MockRpc(*[MockRpcError(grpc.StatusCode.UNAVAILABLE) for _ in range(5)])
+        with self.assertRaises(grpc.RpcError):
+            self.service.call(rpc, "request", 5)
+        self.assertEqual(3, len(rpc.calls))
+        self.assertEqual(OPEN, self.service.circuit_breaker.state)
+
+        with self.assertRaises(CircuitOpenError):
+            self.service.call(rpc, "request", 5)
+        self.assertEqual(3, len(rpc.calls))
+
+    def test_call_all_retries_failed_calls(self):
+        rpc = MockRpc(MockRpcError(grpc.StatusCode.UNAVAILABLE), MockRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+        errors = self.service.call_all(rpc, ["one", "two", "three"], 5)
+
+        self.assertEqual(None, errors[0])
+        self.assertEqual(grpc.StatusCode.INVALID_ARGUMENT, errors[1].code())
+        self.assertEqual(None, errors[2])
+        # the first call is retried
+        self.assertEqual(4, len(rpc.calls))
+        self.assertTrue(all(call['timeout'] == 5 for call in rpc.calls))
+
+    def test_call_all_when_breaker_open(self):
+        for _ in range(3):
+            self.service.circuit_breaker.record_failure()
+        rpc = MockRpc()
+        errors = self.service.call_all(rpc, ["one", "two"], 5)
+
+        self.assertTrue(all(isinstance(error, CircuitOpenError) for error in errors))
+        self.assertEqual(0, len(rpc.calls))
+
+    def half_open_service(self) -> GRPCService:
+        service = GRPCService(ConfigService({'GRPC_RETRY_BACKOFF_MS': 0, 'CIRCUIT_BREAKER_FAILURES': 1,
+                                             'CIRCUIT_BREAKER_RESET': 0.1}))
+        self.addCleanup(service.shutdown)
+        service.circuit_breaker.record_failure()
+        # wait for the reset time, so the next call probes the service
+        time.sleep(0.1)
+        return service
+
+    def test_call_all_sends_single_probe(self):
+        service = self.half_open_service()
+        rpc = MockRpc(MockRpcError(grpc.StatusCode.UNAVAILABLE))
+        errors = service.call_all(rpc, ["one", "two", "three"], 5)
+
+        # the probe failed, so the other calls are rejected
+        self.assertEqual(1, len(rpc.calls))
+        self.assertEqual(grpc.StatusCode.UNAVAILABLE, errors[0].code())
+        self.assertTrue(all(isinstance(error, CircuitOpenError) for error in errors[1:]))
+
+        time.sleep(0.1)
+        rpc = MockRpc()
+        self.assertEqual([None, None, None], service.call_all(rpc, ["one", "two", "three"], 5))
+        self.assertEqual(3, len(rpc.calls))
+        self.assertEqual(CLOSED, service.circuit_breaker.state)
+
+    def test_probe_is_released_without_result(self):
+        class Cancelled(BaseException):
+            pass
+
+        service = self.half_open_service()
+        with self.assertRaises(Cancelled):
+            service.call(MockRpc(Cancelled()), "request", 5)
+        self.assertNotEqual(HALF_OPEN, service.circuit_breaker.state)
+
+        # the next call can probe the service
+        self.assertEqual("request", service.call(MockRpc(), "request", 5))
+        self.assertEqual(CLOSED, service.circuit_breaker.state)
@@ -19,10 +19,11 @@ import mockito
 import deep
 from deep.api.resource import Resource
 from deep.config import ConfigService
+from deep.grpc import GRPCService
 from deep.poll import LongPoll
 
 # noinspection PyUnresolvedReferences
-from deepproto.proto.poll.v1.poll_pb2 import PollResponse, ResponseType
+from deepproto.proto.poll.v1.poll_pb2 import PollRequest, PollResponse, ResponseType
 
 
 class TestPoll(unittest.TestCase):
@@ -32,7 +33,7 @@ class TestPoll(unittest.TestCase):
         self.tracepoints.current_hash = '123'
         self.config = ConfigService(tracepoints=self.tracepoints)
         self.config.resource = Resource.create(attributes={"test": "test_poll"})
-        self.grpc_service = mockito.mock()
+        self.grpc_service = GRPCService(self.config)
         self.handler = mockito.mock()
         # mock for stub sending
         mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenReturn(mockito.mock())
@@ -45,7 +46,7 @@ class TestPoll(unittest.TestCase):
 
         # noinspection PyUnusedLocal
         def mock_poll(request, **kwargs):
-            self.poll_request = request
+            self.poll_request = PollRequest.FromString(request)
             return PollResponse(response_type=ResponseType.NO_CHANGE)
 
         mock_channel = mockito.mock()
@@ -71,7 +72,7 @@ class TestPoll(unittest.TestCase):
 
         # noinspection PyUnusedLocal
         def mock_poll(request, **kwargs):
-            self.poll_request = request
+            self.poll_request = PollRequest.FromString(request)
             return PollResponse(response_type=ResponseType.UPDATE)
 
         mock_channel = mockito.mock()
@@ -90,3 +91,48 @@ class TestPoll(unittest.TestCase):
 
         mockito.verify(self.tracepoints, mockito.times(0)).update_no_change(mockito.ANY)
         mockito.verify(self.tracepoints, mockito.times(1)).update_new_config(mockito.ANY, mockito.ANY, mockito.ANY)
+
+    def test_poll_skipped_when_breaker_open(self):
+        poll = LongPoll(self.config, self.grpc_service)
+        for _ in range(int(self.config.CIRCUIT_BREAKER_FAILURES)):
+            self.grpc_service.circuit_breaker.record_failure()
+
+        mock_channel = mockito.mock()
+        self.grpc_service.channel = mock_channel
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(mockito.mock())
+
+        poll.poll()
+
+        mockito.verify(self.tracepoints, mockito.times(0)).update_no_change(mockito.ANY)
+        mockito.verify(self.tracepoints, mockito.times(0)).update_new_config(mockito.ANY, mockito.ANY, mockito.ANY)
+
+    def test_poll_request_reused(self):
+        poll = LongPoll(self.config, self.grpc_service)
+
+        requests = []
+
+        # noinspection PyUnusedLocal
+        def mock_poll(request, **kwargs):
+            requests.append(request)
+            return PollResponse(response_type=ResponseType.NO_CHANGE)
+
+        mock_channel = mockito.mock()
+        self.grpc_service.channel = mock_channel
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(mock_poll)
+
+        poll.poll()
+        poll.poll()
+        self.tracepoints.current_hash = '456'
+        poll.poll()
+        self.config.resource = Resource.create(attributes={"test": "changed"})
+        poll.poll()
+
+        decoded = [PollRequest.FromString(request) for request in requests]
+        # everything but the timestamp is reused
+        self.assertEqual(requests[0][9:], requests[1][9:])
+        self.assertEqual(['123', '123', '456', '456'], [request.current_hash for request in decoded])
+        self.assertEqual(["test_poll", "test_poll", "test_poll", "changed"],
+                         [request.resource.attributes[3].value.string_value for request in decoded])
+        self.assertTrue(all(request.ts_nanos > 0 for request in decoded))
@@ -53,7 +53,7 @@ class TestLogMessages(unittest.TestCase):
         ["some log message", "[deep] some log message", {}, []],
         ["some log message: {name}", "[deep] some log message: bob", {'name': 'bob'}, ['bob']],
         ["some log message: {len(name)}", "[deep] some log message: 3", {'name': 'bob'}, ['3']],
-        ["some log message: {person}", "[deep] some log message: {'name': 'bob'}",
+        ["some log message: {person}", "[deep] some log message: Size: 1",
          {'person': {'name': 'bob'}}, ["Size: 1"]],
         ["some log message: {person.name}", "[deep] some log message: 'dict' object has no attribute 'name'",
          {'person': {'name': 'bob'}}, ["'dict' object has no attribute 'name'"]],
@@ -0,0 +1,91 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from deep.processor.capture_budget import CaptureBudget, TRUNCATED_TIME, TRUNCATED_BYTES
+from deep.processor.variable_set_processor import VariableSetProcessor, VariableCacheProvider, VariableProcessorConfig
+from deep.utils import time_ns
+
+
+class TestCaptureBudget(unittest.TestCase):
+
+    def test_not_exceeded(self):
+        budget = CaptureBudget(time_ns(), 10000)
+        self.assertFalse(budget.exceeded())
+        self.assertFalse(budget.tick())
+        self.assertEqual([], budget.reasons)
+
+    def test_time_exceeded(self):
+        budget = CaptureBudget(time_ns(), -1)
+        self.assertTrue(budget.exceeded())
+        self.assertEqual([TRUNCATED_TIME], budget.reasons)
+
+    def test_tick_only_checks_on_interval(self):
+        budget = CaptureBudget(time_ns(), -1)
+        for _ in range(CaptureBudget.CHECK_INTERVAL - 1):
+            self.assertFalse(budget.tick())
+        self.assertTrue(budget.tick())
+        # once exceeded, it stays exceeded
+        self.assertTrue(budget.tick())
+
+    def test_mark_exceeded(self):
+        budget = CaptureBudget(time_ns(), 10000)
+        budget.mark_exceeded("test")
+        budget.mark_exceeded("test")
+        self.assertTrue(budget.exceeded())
+        self.assertEqual(["test"], budget.reasons)
+
+    def test_processor_stops_when_exceeded(self):
+        budget = CaptureBudget(time_ns(), -1)
+        processor = VariableSetProcessor({}, VariableCacheProvider(), budget=budget)
+
+        var_id = processor.process_variable("big", {str(i): list(range(10)) for i in range(100)})
+
+        self.assertEqual(1, var_id.vid)
+        # only the nodes processed before the first check are collected
+        self.assertLess(len(processor.var_lookup), CaptureBudget.CHECK_INTERVAL)
+
+    def test_bytes_exceeded(self):
+        budget = CaptureBudget(time_ns(), 10000, 100)
+        self.assertFalse(budget.add_bytes(60))
+        self.assertTrue(budget.add_bytes(60))
+        self.assertEqual(120, budget.bytes_used)
+        self.assertEqual([TRUNCATED_BYTES], budget.reasons)
+        self.assertTrue(budget.tick())
+
+    def test_processor_stops_when_bytes_exceeded(self):
+        budget = CaptureBudget(time_ns(), 10000, 500)
+        processor = VariableSetProcessor({}, VariableCacheProvider(), budget=budget)
+
+        processor.process_variable("big", ["a" * 100 + str(i) for i in range(10)])
+
+        self.assertEqual([TRUNCATED_BYTES], budget.reasons)
+        self.assertLess(len(processor.var_lookup), 11)
+
+    def test_processor_does_not_convert_the_whole_value(self):
+        class Unrepresentable:
+            def __repr__(self):
+                raise AssertionError("the value is beyond the max depth, it should not be converted to a string")
+
+        budget = CaptureBudget(time_ns(), 10000)
+        processor = VariableSetProcessor({}, VariableCacheProvider(), VariableProcessorConfig(max_var_depth=2),
+                                         budget)
+        value = {'a': {'b': {'c': {'d': Unrepresentable()}}}}
+
+        var_id = processor.process_variable("locals", value, bounded=False)
+
+        self.assertEqual("Size: 1", processor.value_string(var_id, value))
+        self.assertEqual([], budget.reasons)
@@ -0,0 +1,63 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from parameterized import parameterized
+
+from deep.processor.expression import compile_expression
+
+
+class TestExpression(unittest.TestCase):
+
+    @parameterized.expand([
+        ["name", {'name'}],
+        ["name.attr", {'name', 'attr'}],
+        ["len(items) > limit", {'len', 'items', 'limit'}],
+        ["[value for value in items]", {'items'}],
+        ["locals()", None],
+        ["vars()['name']", None],
+    ])
+    def test_names(self, expression, names):
+        compiled = compile_expression(expression)
+        if names is None:
+            self.assertIsNone(compiled.names)
+        else:
+            self.assertTrue(names.issubset(compiled.names))
+
+    def test_compile_is_cached(self):
+        self.assertIs(compile_expression("a + b"), compile_expression("a + b"))
+
+    def test_namespace_only_contains_used_names(self):
+        compiled = compile_expression("a + b")
+        f_locals = {'a': 1, 'b': 2, 'c': 3}
+        namespace = compiled.namespace(f_locals)
+        self.assertEqual({'a': 1, 'b': 2}, namespace)
+        self.assertEqual(3, eval(compiled.code, None, namespace))
+
+    def test_namespace_dynamic(self):
+        compiled = compile_expression("locals()")
+        f_locals = {'a': 1}
+        self.assertIs(f_locals, compiled.namespace(f_locals))
+
+    def test_assignment_does_not_change_locals(self):
+        compiled = compile_expression("(a := 5)")
+        f_locals = {'a': 1}
+        self.assertEqual(5, eval(compiled.code, None, compiled.namespace(f_locals)))
+        self.assertEqual({'a': 1}, f_locals)
+
+    def test_invalid_expression(self):
+        with self.assertRaises(SyntaxError):
+            compile_expression("a +")
@@ -40,17 +40,19 @@ class TestLogMessages(unittest.TestCase):
         ["some log message", "[deep] some log message", {}, []],
         ["some log message: {name}", "[deep] some log message: bob", {'name': 'bob'}, ['bob']],
         ["some log message: {len(name)}", "[deep] some log message: 3", {'name': 'bob'}, ['3']],
-        ["some log message: {person}", "[deep] some log message: {'name': 'bob'}",
+        ["some log message: {person}", "[deep] some log message: Size: 1",
          {'person': {'name': 'bob'}}, ["Size: 1"]],
         ["some log message: {person.name}", "[deep] some log message: 'dict' object has no attribute 'name'",
          {'person': {'name': 'bob'}}, ["'dict' object has no attribute 'name'"]],
         ["some log message: {person['name']}", "[deep] some log message: bob", {'person': {'name': 'bob'}}, ["bob"]],
+        ["some log message: {data}", "[deep] some log message: " + "a" * 1024, {'data': b'a' * 5000}, ["a" * 1024]],
     ])
     def test_simple_log_interpolation(self, log_msg, expected_msg, _locals, expected_watches):
         context = LogActionContext(TriggerContext(None, None, MockFrame(_locals), "test", None), None)
         log, watches, _vars = context.process_log(log_msg)
 
         self.assertEqual(expected_msg, log)
+        self.assertLessEqual(len(log), context.budget.bytes_used)
         self.assertEqual(len(expected_watches), len(watches))
         for i, watch in enumerate(watches):
             if watch.error is None:
@@ -0,0 +1,136 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from deep.api.tracepoint import WatchResult
+from deep.api.tracepoint.eventsnapshot import WATCH_SOURCE_WATCH
+from deep.processor.snapshot_delta import SnapshotDeltaTracker, DELTA_REF_PREFIX
+from deep.processor.variable_set_processor import VariableSetProcessor, VariableCacheProvider
+from utils import mock_snapshot, mock_frame
+
+
+def capture(local_vars, watch=None):
+    var_lookup = {}
+    processor = VariableSetProcessor(var_lookup, VariableCacheProvider())
+    locals_id = processor.process_variable("locals", local_vars)
+    frame_vars = var_lookup[locals_id.vid].children
+    del var_lookup[locals_id.vid]
+    snapshot = mock_snapshot(frames=[mock_frame(variables=frame_vars)], var_lookup=var_lookup)
+    if watch is not None:
+        watch_id = processor.process_variable(watch, local_vars[watch])
+        snapshot.add_watch_result(WatchResult(WATCH_SOURCE_WATCH, watch, watch_id))
+    return snapshot
+
+
+def sent_baseline(tracker, snapshot):
+    # apply the snapshot as a baseline candidate, and confirm it was sent
+    applied = tracker.apply(snapshot)
+    tracker.confirm(snapshot.id_str)
+    return applied
+
+
+class TestSnapshotDelta(unittest.TestCase):
+
+    def test_first_snapshot_is_baseline(self):
+        tracker = SnapshotDeltaTracker(10)
+        snapshot = capture({'name': 'bob', 'age': 50})
+
+        self.assertFalse(tracker.apply(snapshot))
+        self.assertEqual(snapshot.id_str, snapshot.attributes['delta_baseline'])
+        self.assertEqual(2, len(snapshot.var_lookup))
+
+    def test_unchanged_variables_are_omitted(self):
+        tracker = SnapshotDeltaTracker(10)
+        baseline = capture({'name': 'bob', 'person': {'age': 50}})
+        sent_baseline(tracker, baseline)
+
+        delta = capture({'name': 'alice', 'person': {'age': 50}})
+        self.assertTrue(tracker.apply(delta))
+
+        self.assertEqual(baseline.id_str, delta.attributes['delta_baseline'])
+        self.assertEqual(1, delta.attributes['delta_omitted'])
+        self.assertEqual(['alice'], [var.value for var in delta.var_lookup.values()])
+        person = [var for var in delta.frames[0].variables if var.name == 'person'][0]
+        self.assertTrue(person.vid.startswith(DELTA_REF_PREFIX))
+        baseline_person = [var for var in baseline.frames[0].variables if var.name == 'person'][0]
+        self.assertEqual(DELTA_REF_PREFIX + str(baseline_person.vid), person.vid)
+
+    def test_changed_child_keeps_parent(self):
+        tracker = SnapshotDeltaTracker(10)
+        sent_baseline(tracker, capture({'person': {'name': 'bob', 'age': 50}}))
+
+        delta = capture({'person': {'name': 'bob', 'age': 51}})
+        tracker.apply(delta)
+
+        values = sorted(var.value for var in delta.var_lookup.values())
+        self.assertEqual(['51', 'Size: 2'], values)
+        self.assertEqual(1, delta.attributes['delta_omitted'])
+
+    def test_watch_results_are_reduced(self):
+        tracker = SnapshotDeltaTracker(10)
+        sent_baseline(tracker, capture({'name': 'bob'}, watch='name'))
+
+        delta = capture({'name': 'bob'}, watch='name')
+        tracker.apply(delta)
+
+        self.assertEqual(0, len(delta.var_lookup))
+        self.assertTrue(delta.frames[0].variables[0].vid.startswith(DELTA_REF_PREFIX))
+
+    def test_baseline_interval(self):
+        tracker = SnapshotDeltaTracker(2)
+        self.assertFalse(sent_baseline(tracker, capture({'name': 'bob'})))
+        self.assertTrue(tracker.apply(capture({'name': 'bob'})))
+        self.assertTrue(tracker.apply(capture({'name': 'bob'})))
+        self.assertFalse(sent_baseline(tracker, capture({'name': 'bob'})))
+
+    def test_baseline_is_not_used_until_sent(self):
+        tracker = SnapshotDeltaTracker(10)
+        first = capture({'name': 'bob'})
+        self.assertFalse(tracker.apply(first))
+        # the first candidate has not been sent, so this is also sent in full
+        second = capture({'name': 'bob'})
+        self.assertFalse(tracker.apply(second))
+        self.assertIsNone(tracker.baseline_id)
+
+        tracker.confirm(second.id_str)
+        self.assertEqual(second.id_str, tracker.baseline_id)
+        # the other candidates are forgotten, so confirming them later does not change the baseline
+        tracker.confirm(first.id_str)
+        self.assertEqual(second.id_str, tracker.baseline_id)
+
+        delta = capture({'name': 'bob'})
+        self.assertTrue(tracker.apply(delta))
+        self.assertEqual(second.id_str, delta.attributes['delta_baseline'])
+
+    def test_lost_baseline_is_discarded(self):
+        tracker = SnapshotDeltaTracker(1)
+        baseline = capture({'name': 'bob'})
+        sent_baseline(tracker, baseline)
+        self.assertTrue(tracker.apply(capture({'name': 'bob'})))
+
+        # the interval is reached, so a new candidate is recorded
+        lost = capture({'name': 'bob'})
+        self.assertFalse(tracker.apply(lost))
+        # while the candidate is waiting to be sent, the snapshots are reduced against the sent baseline
+        delta = capture({'name': 'bob'})
+        self.assertTrue(tracker.apply(delta))
+        self.assertEqual(baseline.id_str, delta.attributes['delta_baseline'])
+
+        tracker.discard(lost.id_str)
+        tracker.confirm(lost.id_str)
+        self.assertEqual(baseline.id_str, tracker.baseline_id)
+        # the lost candidate is gone, so the next snapshot is a new candidate
+        self.assertFalse(tracker.apply(capture({'name': 'bob'})))
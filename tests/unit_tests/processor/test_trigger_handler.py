@@ -26,10 +26,12 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import threading
 import unittest
 from threading import Thread
 from typing import List
+from unittest.mock import patch
 
 import mockito
 
@@ -38,15 +40,18 @@ from deep.api.plugin import TracepointLogger
 from deep.api.plugin.metric import MetricProcessor
 from deep.api.plugin.span import SpanProcessor
 from deep.api.resource import Resource
-from deep.api.tracepoint.constants import LOG_MSG, WATCHES, METHOD_CAPTURE, STAGE
+from deep.api.tracepoint.constants import LOG_MSG, WATCHES, METHOD_CAPTURE, STAGE, FRAME_TYPE, NO_FRAME_TYPE, \
+    STACK_TYPE, NO_STACK, COLLAPSE_FRAMES, FIRE_COUNT, FIRE_PERIOD, ALL_THREADS
 from deep.api.tracepoint.eventsnapshot import EventSnapshot
 from deep.api.tracepoint.tracepoint_config import MetricDefinition
 
 from deep.api.tracepoint.trigger import Location, LocationAction, LineLocation, Trigger, FunctionLocation
 from deep.config import ConfigService
+from deep.processor.frame_collector import FrameCollector, _task_root_frame
+from deep.processor.frame_config import FrameProcessorConfig
 from deep.processor.trigger_handler import TriggerHandler
 from deep.push.push_service import PushService
-from unit_tests.test_target import some_test_function, some_test_error
+from unit_tests.test_target import some_test_function, some_test_error, some_async_caller, some_large_function
 
 
 class MockPushService(PushService):
@@ -205,6 +210,346 @@ class TestTriggerHandler(unittest.TestCase):
         self.assertEqual("arg", pushed[0].watches[0].expression)
         self.assertEqual("arg", pushed[0].watches[0].result.name)
         self.assertEqual("input", pushed[0].var_lookup[pushed[0].watches[0].result.vid].value)
+        self.assertLess(0, pushed[0].captured_bytes)
+
+    def test_snapshot_action_collects_all_locals(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 47, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_large_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        snapshot = push.pushed[0]
+        # the frame has more locals than the max collection size, they are all collected
+        names = [variable.name for variable in snapshot.frames[0].variables]
+        self.assertGreater(len(names), FrameProcessorConfig.DEFAULT_MAX_COLLECTION_SIZE)
+        self.assertEqual({'arg'} | {'v%s' % i for i in range(14)}, set(names))
+        self.assertNotIn('truncated', snapshot.attributes)
+
+    def test_snapshot_action_trimmed_view_collects_all_locals(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 47, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_small", None, {'MAX_COLLECTION_SIZE': 2}, LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_large_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        pushed = {snapshot.tracepoint.id: snapshot for snapshot in push.pushed}
+        # the smaller collection size only limits the values of the locals
+        self.assertEqual(15, len(pushed['tp_id'].frames[0].variables))
+        self.assertEqual(15, len(pushed['tp_small'].frames[0].variables))
+
+    def test_snapshot_action_shared_frames_use_action_bytes(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 47, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_strict", None, {'MAX_SNAPSHOT_BYTES': 200}, LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_large_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        pushed = {snapshot.tracepoint.id: snapshot for snapshot in push.pushed}
+        # the frames are collected without a byte limit, the strict action still trims its view
+        self.assertEqual(15, len(pushed['tp_id'].frames[0].variables))
+        self.assertNotIn('truncated', pushed['tp_id'].attributes)
+        strict = pushed['tp_strict']
+        self.assertLess(len(strict.frames[0].variables), 15)
+        self.assertTrue(all(var_id.vid in strict.var_lookup for var_id in strict.frames[0].variables))
+        self.assertEqual("max_snapshot_bytes", strict.attributes['truncated_reasons'])
+
+    def test_snapshot_action_time_exceeded(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {WATCHES: ['arg'], 'MAX_TP_PROCESS_TIME': 0},
+                           LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        pushed = push.pushed
+        self.assertEqual(1, len(pushed))
+        self.assertEqual(0, len(pushed[0].var_lookup))
+        self.assertEqual(0, len(pushed[0].frames[0].variables))
+        self.assertIsNone(pushed[0].watches[0].result)
+        self.assertIn("max_tp_process_time", pushed[0].watches[0].error)
+        self.assertTrue(pushed[0].attributes['truncated'])
+        self.assertEqual("max_tp_process_time", pushed[0].attributes['truncated_reasons'])
+
+    def test_snapshot_actions_share_frames(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_short", None, {'MAX_STRING_LENGTH': 2}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_no_frame", None, {FRAME_TYPE: NO_FRAME_TYPE}, LocationAction.ActionType.Snapshot),
+        ])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        with patch.object(FrameCollector, 'collect', autospec=True, side_effect=FrameCollector.collect) as collect:
+            handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+            self.assertEqual(1, collect.call_count)
+
+        pushed = {snapshot.tracepoint.id: snapshot for snapshot in push.pushed}
+        self.assertEqual(3, len(pushed))
+
+        full = pushed['tp_id']
+        self.assertEqual(2, len(full.frames[0].variables))
+        self.assertEqual(2, len(full.var_lookup))
+        arg = [var_id for var_id in full.frames[0].variables if var_id.name == 'arg'][0]
+        self.assertEqual("input", full.var_lookup[arg.vid].value)
+
+        short = pushed['tp_short']
+        self.assertEqual(2, len(short.frames[0].variables))
+        variable = short.var_lookup[arg.vid]
+        self.assertEqual("in", variable.value)
+        self.assertTrue(variable.truncated)
+        # the shared variable is not modified
+        self.assertEqual("input", full.var_lookup[arg.vid].value)
+
+        no_frame = pushed['tp_no_frame']
+        self.assertEqual(0, len(no_frame.frames[0].variables))
+        self.assertEqual(0, len(no_frame.var_lookup))
+
+    def test_snapshot_action_stack_limits(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_no_stack", None, {STACK_TYPE: NO_STACK}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_max_frames", None, {'MAX_FRAMES': 2}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_collapse", None, {COLLAPSE_FRAMES: 'True'}, LocationAction.ActionType.Snapshot),
+        ])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        pushed = {snapshot.tracepoint.id: snapshot for snapshot in push.pushed}
+        self.assertEqual(4, len(pushed))
+
+        full = pushed['tp_id']
+        self.assertGreater(len(full.frames), 2)
+        self.assertNotIn('truncated', full.attributes)
+
+        no_stack = pushed['tp_no_stack']
+        self.assertEqual(1, len(no_stack.frames))
+        self.assertEqual(2, len(no_stack.frames[0].variables))
+        self.assertNotIn('truncated', no_stack.attributes)
+
+        max_frames = pushed['tp_max_frames']
+        self.assertEqual(2, len(max_frames.frames))
+        self.assertEqual("max_frames", max_frames.attributes['truncated_reasons'])
+
+        collapse = pushed['tp_collapse']
+        self.assertLess(len(collapse.frames), len(full.frames))
+        self.assertEqual(full.frames[0].line_number, collapse.frames[0].line_number)
+        self.assertIn('collapsed frames', ''.join(frame.method_name for frame in collapse.frames))
+
+    def test_snapshot_frames_are_interned(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {FIRE_COUNT: '-1', FIRE_PERIOD: '0'}, LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+        handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+
+        self.assertEqual(2, len(push.pushed))
+        first, second = push.pushed
+        # the frame with variables is created for each snapshot
+        self.assertIsNot(first.frames[0], second.frames[0])
+        # the frames without variables are shared
+        self.assertGreater(len(first.frames), 1)
+        for index in range(1, len(first.frames)):
+            self.assertIs(first.frames[index], second.frames[index])
+
+    def test_interned_frames_use_current_app_config(self):
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        capture = TraceCallCapture()
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        pushed = []
+        for custom in [{}, {'IN_APP_EXCLUDE': []}]:
+            push = MockPushService(None, None)
+            handler = TriggerHandler(MockConfigService(custom), push)
+            handler.new_config([Trigger(location, [
+                LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot)])])
+            handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+            pushed.append(push.pushed[0])
+
+        first, second = pushed
+        # the thread start frame is interned, it is only an app frame when nothing is excluded
+        self.assertEqual(0, len(first.frames[-1].variables))
+        self.assertFalse(first.frames[-1].app_frame)
+        self.assertTrue(second.frames[-1].app_frame)
+
+    def test_snapshot_async_frames(self):
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 35, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {}, LocationAction.ActionType.Snapshot)])])
+
+        # noinspection PyUnresolvedReferences
+        current = threading._trace_hook
+        threading.settrace(handler.trace_call)
+        thread = Thread(target=asyncio.run, args=(some_async_caller('input'),))
+        thread.start()
+        thread.join(10)
+        threading.settrace(current)
+
+        self.assertEqual(1, len(push.pushed))
+        frames = push.pushed[0].frames
+        # the stack ends at the root of the task, the event loop frames are not included
+        self.assertEqual(['some_async_function', 'some_async_caller'], [frame.method_name for frame in frames])
+        self.assertTrue(all(frame.is_async for frame in frames))
+
+    def test_task_root_frame_without_get_coro(self):
+        # python 3.7 tasks do not have get_coro, the coroutine is stored as '_coro'
+        async def root():
+            task = asyncio.current_task()
+
+            class OldTask:
+                _coro = task.get_coro()
+
+            with patch.object(asyncio, 'current_task', return_value=OldTask()):
+                return _task_root_frame()
+
+        frame = asyncio.run(root())
+        self.assertEqual('root', frame.f_code.co_name)
+
+    def test_snapshot_all_threads(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {STACK_TYPE: ALL_THREADS, 'MAX_THREAD_FRAMES': 2},
+                           LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        waiting = threading.Event()
+        thread = Thread(target=waiting.wait, name='waiting-thread')
+        thread.start()
+        try:
+            handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+        finally:
+            waiting.set()
+            thread.join(10)
+
+        snapshot = push.pushed[0]
+        self.assertGreater(len(snapshot.frames), 1)
+        self.assertGreater(snapshot.attributes['thread_count'], 0)
+        self.assertIn('thread_capture_nanos', snapshot.attributes)
+
+        watch = snapshot.watches[0]
+        self.assertEqual('threads', watch.expression)
+        threads = {child.name: child for child in snapshot.var_lookup[watch.result.vid].children}
+        name = 'waiting-thread (%s)' % thread.ident
+        self.assertIn(name, threads)
+        children = sorted(snapshot.var_lookup[threads[name].vid].children, key=lambda child: int(child.name))
+        frames = [snapshot.var_lookup[child.vid].value for child in children]
+        # the frames are limited, and the stack is marked as incomplete
+        self.assertEqual(3, len(frames))
+        self.assertIn(' wait', frames[0])
+        self.assertEqual('...', frames[2])
+
+    def test_new_config_creates_frame_configs(self):
+        config = MockConfigService({})
+        handler = TriggerHandler(config, MockPushService(None, None))
+
+        trigger = Trigger(LineLocation('test_target.py', 27, Location.Position.START), [
+            LocationAction("tp_id", None, {'MAX_VAR_DEPTH': '2'}, LocationAction.ActionType.Snapshot),
+            LocationAction("tp_deep", None, {'MAX_VAR_DEPTH': '8', STACK_TYPE: NO_STACK},
+                           LocationAction.ActionType.Snapshot),
+            LocationAction("tp_log", None, {LOG_MSG: 'some log'}, LocationAction.ActionType.Log),
+        ])
+        handler.new_config([trigger])
+
+        actions = trigger.actions
+        self.assertEqual(2, actions[0].frame_config.max_var_depth)
+        self.assertEqual(8, actions[1].frame_config.max_var_depth)
+        self.assertIsNone(actions[2].frame_config)
+        self.assertEqual(8, trigger.frame_config.max_var_depth)
+        self.assertEqual('stack', trigger.frame_config.stack_type)
+
+    def test_new_config_with_malformed_log_msg(self):
+        config = MockConfigService({})
+        handler = TriggerHandler(config, MockPushService(None, None))
+
+        bad = Trigger(LineLocation('test_target.py', 27, Location.Position.START), [
+            LocationAction("tp_bad", None, {LOG_MSG: 'x={a'}, LocationAction.ActionType.Log)])
+        good = Trigger(LineLocation('test_target.py', 37, Location.Position.START), [
+            LocationAction("tp_good", None, {LOG_MSG: 'x={arg}'}, LocationAction.ActionType.Log)])
+        handler.new_config([bad, good])
+
+        # the malformed log message does not stop the config from being installed
+        self.assertEqual([bad, good], handler._tp_config)
+
+    def test_snapshot_action_no_stack_only_walks_top_frame(self):
+        capture = TraceCallCapture()
+        config = MockConfigService({})
+        push = MockPushService(None, None)
+        handler = TriggerHandler(config, push)
+
+        location = LineLocation('test_target.py', 27, Location.Position.START)
+        handler.new_config([Trigger(location, [
+            LocationAction("tp_id", None, {STACK_TYPE: NO_STACK}, LocationAction.ActionType.Snapshot)])])
+
+        self.call_and_capture(location, some_test_function, ['input'], capture)
+
+        with patch.object(FrameCollector, '_process_frame', autospec=True,
+                          side_effect=FrameCollector._process_frame) as process_frame:
+            handler.trace_call(capture.captured_frame, capture.captured_event, capture.captured_args)
+            self.assertEqual(1, process_frame.call_count)
+
+        self.assertEqual(1, len(push.pushed[0].frames))
 
     def test_snapshot_action_with_condition(self):
         capture = TraceCallCapture()
@@ -0,0 +1,197 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from deep.processor.bfs import NodeValue
+from deep.processor.type_handlers import find_type_handler, NumpyArrayHandler, PandasDataFrameHandler, \
+    BinaryHandler
+from deep.processor.variable_processor import process_variable, process_child_nodes
+from deep.processor.variable_set_processor import VariableSetProcessor, VariableCacheProvider
+from unit_tests.processor.test_variable_processor import MockCollector
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+def child_values(nodes):
+    return {node.value.name: node.value.value for node in nodes}
+
+
+class TestTypeHandlers(unittest.TestCase):
+
+    def test_no_handler_for_builtin(self):
+        self.assertIsNone(find_type_handler(str))
+        self.assertIsNone(find_type_handler(dict))
+
+    def test_binary_text(self):
+        collector = MockCollector()
+        value = b'some text'
+
+        self.assertIsInstance(find_type_handler(bytes), BinaryHandler)
+
+        response = process_variable(collector, NodeValue("value", value))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual("bytes", variable.type)
+        self.assertEqual("some text", variable.value)
+        self.assertEqual(9, find_type_handler(bytes).value_size(value))
+        self.assertFalse(variable.truncated)
+        self.assertEqual([], process_child_nodes(collector, response.variable_id.vid, value, 0))
+
+    def test_binary_hex(self):
+        collector = MockCollector()
+        value = bytearray(b'\x00\x01\xff')
+
+        response = process_variable(collector, NodeValue("value", value))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual("bytearray", variable.type)
+        self.assertEqual("0001ff", variable.value)
+        self.assertFalse(variable.truncated)
+        # the view is released, so the bytearray can still be resized
+        value.append(1)
+
+    def test_binary_truncated(self):
+        collector = MockCollector()
+        value = memoryview(b'a' * 5000 + b'\x00' * 5000)
+
+        response = process_variable(collector, NodeValue("value", value))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual("memoryview", variable.type)
+        self.assertEqual('a' * 1024, variable.value)
+        self.assertEqual(10000, find_type_handler(memoryview).value_size(value))
+        self.assertTrue(variable.truncated)
+
+        response = process_variable(collector, NodeValue("value", memoryview(b'\x00' * 5000)))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual('00' * 512, variable.value)
+        self.assertTrue(variable.truncated)
+
+    def test_binary_value_string_is_preview(self):
+        value = bytearray(b'a' * 5000)
+        cache = VariableCacheProvider()
+        frame_processor = VariableSetProcessor({}, cache)
+        frame_processor.process_variable("locals", {'value': value}, bounded=False)
+
+        # the watch finds the value in the cache, the string is still only the preview of the value
+        watch_processor = VariableSetProcessor({}, cache)
+        var_id = watch_processor.process_variable("value", value)
+        self.assertEqual(0, len(watch_processor.var_lookup))
+        self.assertEqual('a' * 1024, watch_processor.value_string(var_id, value))
+
+        other = memoryview(b'b' * 5000)
+        var_id = watch_processor.process_variable("other", other)
+        self.assertEqual('b' * 1024, watch_processor.value_string(var_id, other))
+
+    def test_binary_released(self):
+        collector = MockCollector()
+        value = memoryview(b'data')
+        value.release()
+
+        response = process_variable(collector, NodeValue("value", value))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual("Size: None", variable.value)
+        self.assertTrue(variable.truncated)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_array(self):
+        collector = MockCollector()
+        array = numpy.arange(100, dtype=numpy.float64)
+        array[5] = numpy.nan
+
+        self.assertIsInstance(find_type_handler(type(array)), NumpyArrayHandler)
+
+        response = process_variable(collector, NodeValue("array", array))
+        variable = collector.var_lookup[response.variable_id.vid]
+        self.assertEqual("ndarray", variable.type)
+        self.assertEqual("Shape: (100,), DType: float64, Size: 100", variable.value)
+
+        children = child_values(process_child_nodes(collector, response.variable_id.vid, array, 0))
+        self.assertEqual("(100,)", children['shape'])
+        self.assertEqual(800, children['nbytes'])
+        self.assertEqual(1, children['nan_count'])
+        self.assertEqual(0.0, children['min'])
+        self.assertEqual(99.0, children['max'])
+        self.assertEqual(10, len(children['head']))
+        self.assertEqual([0.0, 1.0, 2.0, 3.0, 4.0], children['head'][:5])
+        self.assertEqual([float(i) for i in range(90, 100)], children['tail'])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_array_non_numeric(self):
+        collector = MockCollector()
+        array = numpy.array(["a", "b"])
+
+        children = child_values(process_child_nodes(collector, 1, array, 0))
+        self.assertNotIn('min', children)
+        self.assertEqual(["a", "b"], children['head'])
+        self.assertNotIn('tail', children)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_scalar(self):
+        collector = MockCollector()
+        value = numpy.float64(1.5)
+
+        response = process_variable(collector, NodeValue("scalar", value))
+        self.assertEqual("1.5", collector.var_lookup[response.variable_id.vid].value)
+        self.assertEqual([], process_child_nodes(collector, response.variable_id.vid, value, 0))
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_pandas_data_frame(self):
+        collector = MockCollector()
+        frame = pandas.DataFrame({'a': range(20), 'b': ['x'] * 20})
+
+        self.assertIsInstance(find_type_handler(type(frame)), PandasDataFrameHandler)
+
+        response = process_variable(collector, NodeValue("frame", frame))
+        self.assertEqual("Shape: (20, 2)", collector.var_lookup[response.variable_id.vid].value)
+
+        children = child_values(process_child_nodes(collector, response.variable_id.vid, frame, 0))
+        self.assertEqual(['a', 'b'], children['columns'])
+        self.assertEqual({'a': 0}, children['min'])
+        self.assertEqual({'a': 19}, children['max'])
+        self.assertEqual(0, children['nan_count'])
+        self.assertIn('head', children)
+        self.assertIn('tail', children)
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_pandas_wide_data_frame(self):
+        collector = MockCollector()
+        frame = pandas.DataFrame({'column_%s' % i: range(20) for i in range(50)})
+
+        children = child_values(process_child_nodes(collector, 1, frame, 0))
+        # only the first columns are previewed
+        self.assertEqual(collector.max_collection_size, len(children['columns']))
+        for preview in ['head', 'tail']:
+            self.assertIn('column_9', children[preview])
+            self.assertNotIn('column_10', children[preview])
+
+    @unittest.skipIf(pandas is None, "pandas is not installed")
+    def test_pandas_series(self):
+        collector = MockCollector()
+        series = pandas.Series([1.0, None, 3.0])
+
+        response = process_variable(collector, NodeValue("series", series))
+        self.assertEqual("Shape: (3,), DType: float64", collector.var_lookup[response.variable_id.vid].value)
+
+        children = child_values(process_child_nodes(collector, response.variable_id.vid, series, 0))
+        self.assertEqual(1, children['nan_count'])
+        self.assertEqual(2.0, children['mean'])
+        self.assertEqual(3, len(children['head']))
@@ -13,15 +13,65 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import dataclasses
 import unittest
+from collections import namedtuple
 
 from parameterized import parameterized
 
 from deep.api.tracepoint import VariableId, Variable
 from deep.processor.bfs import Node, NodeValue
 from deep.processor.frame_config import FrameProcessorConfig
+from deep.processor.variable_set_processor import VariableCacheProvider, VariableSetProcessor
 from deep.processor.variable_processor import var_modifiers, variable_to_string, process_variable, Collector, \
-    truncate_string, process_child_nodes
+    truncate_string, process_child_nodes, class_fields, collection_size
+
+
+class SlotsClass:
+    __slots__ = ('a', '__private', 'unset')
+
+    def __init__(self):
+        self.a = 1
+        self.__private = 2
+
+
+class SlotsChild(SlotsClass):
+    __slots__ = 'b'
+
+    def __init__(self):
+        super().__init__()
+        self.b = 3
+
+
+class SlotsWithDict(SlotsClass):
+
+    def __init__(self):
+        super().__init__()
+        self.c = 4
+
+
+@dataclasses.dataclass
+class DataClass:
+    x: int
+    y: str
+
+
+@dataclasses.dataclass
+class PostInitDataClass:
+    x: int
+
+    def __post_init__(self):
+        self.cache = self.x * 2
+
+
+Point = namedtuple('Point', ['x', 'y'])
+
+
+class PointWithDict(Point):
+
+    def __init__(self, *args):
+        super().__init__()
+        self.label = 'point'
 
 
 class MockVariable(Variable):
@@ -92,9 +142,8 @@ class MockCollector(Collector):
             return self._var_cache[identity_hash_id]
         return None
 
-    def new_var_id(self, identity_hash_id: str) -> str:
-        var_count = len(self._var_cache)
-        new_id = str(var_count + 1)
+    def new_var_id(self, identity_hash_id, value):
+        new_id = len(self._var_cache) + 1
         self._var_cache[identity_hash_id] = new_id
         return new_id
 
@@ -124,20 +173,20 @@ class TestVariableProcessor(unittest.TestCase):
         self.assertEqual(variable_to_string(type(_input), _input), expected)
 
     @parameterized.expand([
-        ["string", "some string", VariableId('1', "string"), True,
+        ["string", "some string", VariableId(1, "string"), True,
          MockVariable('str', "some string", "139916521692464", [], False)],
-        ["int", 123, VariableId('1', "int"), True, MockVariable('int', "123", "", [], False)],
-
-        ["float", 1.23, VariableId('1', "float"), True, MockVariable('float', "1.23", "", [], False)],
-        ["bool", True, VariableId('1', "bool"), True, MockVariable('bool', "True", "", [], False)],
-        ["tuple", ("one", 2), VariableId('1', "tuple"), True, MockVariable('tuple', "Size: 2", "", [], False)],
-        ["list", ["one", 2], VariableId('1', "list"), True, MockVariable('list', "Size: 2", "", [], False)],
-        ["set", {"one", 2}, VariableId('1', "set"), True, MockVariable('set', "Size: 2", "", [], False)],
-        ["frozen", frozenset({"one", 2}), VariableId('1', "frozen"), True,
+        ["int", 123, VariableId(1, "int"), True, MockVariable('int', "123", "", [], False)],
+
+        ["float", 1.23, VariableId(1, "float"), True, MockVariable('float', "1.23", "", [], False)],
+        ["bool", True, VariableId(1, "bool"), True, MockVariable('bool', "True", "", [], False)],
+        ["tuple", ("one", 2), VariableId(1, "tuple"), True, MockVariable('tuple', "Size: 2", "", [], False)],
+        ["list", ["one", 2], VariableId(1, "list"), True, MockVariable('list', "Size: 2", "", [], False)],
+        ["set", {"one", 2}, VariableId(1, "set"), True, MockVariable('set', "Size: 2", "", [], False)],
+        ["frozen", frozenset({"one", 2}), VariableId(1, "frozen"), True,
          MockVariable('frozenset', "Size: 2", "", [], False)],
-        ["list_iter", iter(["one", 2]), VariableId('1', "list_iter"), True,
+        ["list_iter", iter(["one", 2]), VariableId(1, "list_iter"), True,
          MockVariable('list_iterator', "Iterator of type: <class 'list_iterator'>", "", [], False)],
-        ["list_reverse_iter", reversed([1, 2, 3]), VariableId('1', "list_reverse_iter"), True,
+        ["list_reverse_iter", reversed([1, 2, 3]), VariableId(1, "list_reverse_iter"), True,
          MockVariable('list_reverseiterator', "Iterator of type: <class 'list_reverseiterator'>", "", [], False)],
     ])
     def test_process_variable(self, name, _input, expected_var_id: VariableId, expected_process_children, expected_var):
@@ -171,7 +220,94 @@ class TestVariableProcessor(unittest.TestCase):
     ])
     def test_process_child_nodes(self, name, in_var, in_depth, expected):
         collector = MockCollector()
-        nodes = process_child_nodes(collector, "1", in_var, in_depth)
+        nodes = process_child_nodes(collector, 1, in_var, in_depth)
         if nodes != expected:
             print(nodes)
         self.assertEqual(nodes, expected)
+
+    def test_process_child_nodes_limits_dict(self):
+        collector = MockCollector()
+        big_dict = {str(i): i for i in range(1000)}
+        nodes = process_child_nodes(collector, 1, big_dict, 0)
+        self.assertEqual(collector.max_collection_size, len(nodes))
+        self.assertEqual("0", nodes[0].value.name)
+
+    def test_process_child_nodes_limits_object(self):
+        class ManyAttributes:
+            def __init__(self):
+                for i in range(100):
+                    setattr(self, "attr_%s" % i, i)
+
+        collector = MockCollector()
+        nodes = process_child_nodes(collector, 1, ManyAttributes(), 0)
+        self.assertEqual(collector.max_collection_size, len(nodes))
+
+    @parameterized.expand([
+        ["small_dict", {"a": 1}, 1, False],
+        ["big_dict", {i: i for i in range(50)}, 50, True],
+        ["big_list", list(range(11)), 11, True],
+        ["string", "a" * 50, None, False],
+    ])
+    def test_process_variable_truncated_by_size(self, name, _input, expected_size, expected_truncated):
+        self.assertEqual(expected_size, collection_size(type(_input), _input))
+        collector = MockCollector()
+        variable_response = process_variable(collector, NodeValue(name, _input))
+        variable = collector.var_lookup[variable_response.variable_id.vid]
+        self.assertEqual(expected_truncated, variable.truncated)
+
+    @parameterized.expand([
+        ["slots", SlotsClass(), {'a': 1, '__private': 2}],
+        ["slots_inherited", SlotsChild(), {'b': 3, 'a': 1, '_SlotsClass__private': 2}],
+        ["slots_with_dict", SlotsWithDict(), {'a': 1, '_SlotsClass__private': 2, 'c': 4}],
+        ["dataclass", DataClass(1, "two"), {'x': 1, 'y': "two"}],
+        ["namedtuple", Point(1, 2), {'x': 1, 'y': 2}],
+        ["dataclass_post_init", PostInitDataClass(1), {'x': 1, 'cache': 2}],
+        ["namedtuple_with_dict", PointWithDict(1, 2), {'x': 1, 'y': 2, 'label': 'point'}],
+    ])
+    def test_process_child_nodes_fields(self, name, _input, expected):
+        collector = MockCollector()
+        nodes = process_child_nodes(collector, 1, _input, 0)
+        self.assertEqual(expected, {node.value.name: node.value.value for node in nodes})
+
+    def test_process_child_nodes_limits_fields(self):
+        collector = MockCollector()
+        big_tuple = namedtuple('BigTuple', ["f_%s" % i for i in range(100)])(*range(100))
+        nodes = process_child_nodes(collector, 1, big_tuple, 0)
+        self.assertEqual(collector.max_collection_size, len(nodes))
+
+        variable_response = process_variable(collector, NodeValue("big", big_tuple))
+        variable = collector.var_lookup[variable_response.variable_id.vid]
+        self.assertEqual(100, collection_size(type(big_tuple), big_tuple))
+        self.assertTrue(variable.truncated)
+
+    def test_post_init_attribute_is_counted(self):
+        self.assertEqual(2, collection_size(PostInitDataClass, PostInitDataClass(1)))
+
+    def test_unset_slots_are_not_counted(self):
+        collector = MockCollector()
+        names = ["s_%s" % i for i in range(collector.max_collection_size + 2)]
+        value = type('ManySlots', (), {'__slots__': tuple(names)})()
+        for name in names[:collector.max_collection_size]:
+            setattr(value, name, 1)
+
+        self.assertEqual(collector.max_collection_size, collection_size(type(value), value))
+        variable_response = process_variable(collector, NodeValue("value", value))
+        # every set slot is collected, so the value is not truncated
+        self.assertFalse(collector.var_lookup[variable_response.variable_id.vid].truncated)
+
+    def test_class_fields_cached(self):
+        self.assertIs(class_fields(SlotsClass), class_fields(SlotsClass))
+        self.assertEqual(('a', '_SlotsClass__private', 'unset'), class_fields(SlotsClass).names)
+        self.assertIsNone(class_fields(MockCollector))
+
+    def test_cache_keeps_values_alive(self):
+        cache = VariableCacheProvider()
+        processor = VariableSetProcessor({}, cache)
+
+        first = processor.process_variable("first", object())
+        # the first value is kept alive by the cache, so this new value cannot reuse its id
+        second = processor.process_variable("second", object())
+
+        self.assertEqual(1, first.vid)
+        self.assertEqual(2, second.vid)
+        self.assertEqual(2, cache.size)
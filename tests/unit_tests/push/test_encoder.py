@@ -0,0 +1,102 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# noinspection PyUnresolvedReferences
+from deepproto.proto.tracepoint.v1.tracepoint_pb2 import Snapshot
+
+from deep.api.resource import Resource
+from deep.api.tracepoint import WatchResult, VariableId
+from deep.api.tracepoint.eventsnapshot import WATCH_SOURCE_WATCH, WATCH_SOURCE_LOG
+from deep.push import convert_snapshot
+from deep.push.encoder import encode_snapshot
+from utils import mock_snapshot, mock_frame, mock_variable, mock_variable_id, mock_tracepoint
+
+
+def assert_encoded_as_converted(event_snapshot):
+    encoded = encode_snapshot(event_snapshot)
+    assert encoded is not None
+    assert convert_snapshot(event_snapshot) == Snapshot.FromString(encoded)
+
+
+def test_encode_snapshot():
+    assert_encoded_as_converted(mock_snapshot())
+
+
+def test_encode_snapshot_with_frames():
+    assert_encoded_as_converted(mock_snapshot(frames=[
+        mock_frame(),
+        mock_frame(variables=[mock_variable_id(vid=1), mock_variable_id(vid=2, modifiers=['private'])],
+                   is_async=True, column_number=12, app_frame=False, class_name=None),
+        mock_frame(transpiled_file_name='file.ts', transpiled_line_number=300, transpiled_column_number=0,
+                   line_number=0)]))
+
+
+def test_encode_snapshot_with_var_lookup():
+    event_snapshot = mock_snapshot(
+        frames=[mock_frame(variables=[mock_variable_id(vid=1)])],
+        var_lookup={
+            1: mock_variable(var_type='dict', value='Size: 2', var_hash=1234,
+                             children=[VariableId(2, 'a', original_name='_a'), VariableId(3, 'ü', ['static'])]),
+            2: mock_variable(value='', truncated=True),
+            3: mock_variable(value='a' * 300, var_hash='')})
+    assert_encoded_as_converted(event_snapshot)
+
+
+def test_encode_snapshot_with_watches():
+    event_snapshot = mock_snapshot()
+    event_snapshot.add_watch_result(WatchResult(WATCH_SOURCE_WATCH, "test", mock_variable_id()))
+    event_snapshot.add_watch_result(WatchResult(WATCH_SOURCE_LOG, "error", None, 'test error'))
+    event_snapshot.add_watch_result(WatchResult(WATCH_SOURCE_WATCH, "empty", None, ''))
+    assert_encoded_as_converted(event_snapshot)
+
+
+def test_encode_snapshot_with_attributes():
+    event_snapshot = mock_snapshot(resource=Resource.create({'service.name': 'test', 'count': 3}))
+    event_snapshot.log_msg = ''
+    event_snapshot.attributes['truncated'] = True
+    event_snapshot.attributes['ratio'] = 0.5
+    event_snapshot.complete()
+    assert_encoded_as_converted(event_snapshot)
+
+
+def test_encode_snapshot_reuses_frame_encoding():
+    frame = mock_frame()
+    first = encode_snapshot(mock_snapshot(frames=[frame]))
+    assert frame.encoded_bytes is not None
+
+    with_vars = mock_frame(variables=[mock_variable_id(vid=1)])
+    encode_snapshot(mock_snapshot(frames=[with_vars], var_lookup={1: mock_variable()}))
+    assert with_vars.encoded_bytes is None
+
+    second = Snapshot.FromString(encode_snapshot(mock_snapshot(frames=[frame])))
+    assert Snapshot.FromString(first).frames[0] == second.frames[0]
+
+
+def test_encode_snapshot_reuses_tracepoint_and_resource():
+    tracepoint = mock_tracepoint()
+    resource = Resource.create({'service.name': 'test'})
+    first = encode_snapshot(mock_snapshot(tracepoint=tracepoint, resource=resource))
+    assert tracepoint.encoded is not None
+
+    changed = Resource.create({'service.name': 'changed'})
+    assert_encoded_as_converted(mock_snapshot(tracepoint=tracepoint, resource=changed))
+
+    second = Snapshot.FromString(encode_snapshot(mock_snapshot(tracepoint=tracepoint, resource=resource)))
+    assert Snapshot.FromString(first).tracepoint == second.tracepoint
+    assert Snapshot.FromString(first).resource == second.resource
+
+
+def test_encode_error():
+    # noinspection PyTypeChecker
+    assert encode_snapshot({}) is None
@@ -12,6 +12,7 @@
 #
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from deep.api.resource import Resource
 from deep.api.tracepoint import WatchResult
 from deep.api.tracepoint.eventsnapshot import WATCH_SOURCE_WATCH
 from deep.push import convert_snapshot
@@ -77,3 +78,38 @@ def test_convert_error():
     # noinspection PyTypeChecker
     snapshot = convert_snapshot({})
     assert snapshot is None
+
+
+def test_convert_snapshot_with_int_ids():
+    event_snapshot = mock_snapshot(frames=[mock_frame(variables=[mock_variable_id(vid=1)])],
+                                   var_lookup={1: mock_variable(var_hash=1234)})
+    snapshot = convert_snapshot(event_snapshot)
+    assert snapshot is not None
+
+    assert "1" == snapshot.frames[0].variables[0].ID
+    assert "1234" == snapshot.var_lookup['1'].hash
+
+
+def test_convert_snapshot_reuses_frame_encoding():
+    frame = mock_frame()
+    first = convert_snapshot(mock_snapshot(frames=[frame]))
+    assert frame.encoded is not None
+
+    second = convert_snapshot(mock_snapshot(frames=[frame]))
+    assert first.frames[0] == second.frames[0]
+    assert "file_name" == second.frames[0].file_name
+
+
+def test_convert_snapshot_does_not_cache_frame_with_vars():
+    frame = mock_frame(variables=[mock_variable_id(vid=1)])
+    convert_snapshot(mock_snapshot(frames=[frame], var_lookup={1: mock_variable()}))
+    assert frame.encoded is None
+
+
+def test_convert_snapshot_shares_resource():
+    resource = Resource.create({'service.name': 'test'})
+    event_snapshot = mock_snapshot(resource=resource)
+    assert event_snapshot.resource is resource
+
+    snapshot = convert_snapshot(event_snapshot)
+    assert 'test' in [attr.value.string_value for attr in snapshot.resource if attr.key == 'service.name']
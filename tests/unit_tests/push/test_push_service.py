@@ -12,21 +12,29 @@
 #
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import threading
 import unittest
+from concurrent.futures import Future
 
+import grpc
 import mockito
 
 import deep.logging
 from deep.config import ConfigService
+from deep.grpc import GRPCService
+from deep.processor.snapshot_delta import SnapshotDeltaTracker
 from deep.push import PushService
-from utils import mock_snapshot, Captor
+from unit_tests.grpc.test_grpc_service import MockRpc
+from utils import mock_snapshot, Captor, mock_variable, mock_tracepoint, MockRpcError
 
 
 class TestPushService(unittest.TestCase):
 
     def setUp(self):
         self.config = ConfigService()
-        self.grpc_service = mockito.mock()
+        self.grpc_service = GRPCService(self.config)
         self.handler = mockito.mock()
         # mock for stub sending
         mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenReturn(mockito.mock())
@@ -108,3 +116,337 @@ class TestPushService(unittest.TestCase):
         task(snapshot)
 
         self.assertIsNone(self.sent_snap)
+
+    def test_drop_when_pending_limit_exceeded(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOT_BYTES': 100})
+        service = PushService(self.grpc_service, self.handler, config)
+
+        small = mock_snapshot()
+        service.push_snapshot(small)
+        self.assertEqual(0, service.dropped_snapshots)
+
+        big = mock_snapshot(var_lookup={1: mock_variable(value="a" * 200)})
+        service.push_snapshot(big)
+
+        self.assertEqual(1, service.dropped_snapshots)
+        mockito.verify(self.handler, times=1).submit_task(mockito.ANY, mockito.ANY)
+
+    def test_pending_bytes_released_on_completion(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOT_BYTES': 1000})
+        future = Future()
+        mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenReturn(future)
+        service = PushService(self.grpc_service, self.handler, config)
+
+        service.push_snapshot(mock_snapshot(var_lookup={1: mock_variable(value="a" * 200)}))
+        self.assertLess(200, service.pending_bytes)
+
+        future.set_result(None)
+        self.assertEqual(0, service.pending_bytes)
+
+    def test_pending_bytes_use_captured_bytes(self):
+        future = Future()
+        mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenReturn(future)
+        service = PushService(self.grpc_service, self.handler, ConfigService({}))
+
+        snapshot = mock_snapshot(var_lookup={1: mock_variable(value="a" * 200)})
+        snapshot.complete(42)
+        service.push_snapshot(snapshot)
+        self.assertEqual(42, service.pending_bytes)
+
+    def test_batch_linger_does_not_hold_worker(self):
+        config = ConfigService({'PUSH_BATCH_SIZE': 3, 'PUSH_BATCH_LINGER_MS': 50})
+        service = PushService(self.grpc_service, self.handler, config)
+        submitted = threading.Event()
+        mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenAnswer(
+            lambda *_: submitted.set() or Future())
+
+        service.push_snapshot(mock_snapshot())
+        service.push_snapshot(mock_snapshot())
+        # the batch is only submitted once the linger time has passed
+        mockito.verify(self.handler, times=0).submit_task(mockito.ANY, mockito.ANY)
+        self.assertTrue(submitted.wait(5))
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler, times=1).submit_task(task_captor, batch_captor)
+        self.assertEqual(2, len(batch_captor.get_value().snapshots))
+
+    def test_snapshots_are_batched(self):
+        config = ConfigService({'PUSH_BATCH_SIZE': 3})
+        service = PushService(self.grpc_service, self.handler, config)
+
+        for _ in range(5):
+            service.push_snapshot(mock_snapshot())
+
+        batch_captor = Captor()
+        mockito.verify(self.handler, times=2).submit_task(mockito.ANY, batch_captor)
+        self.assertEqual([3, 2], [len(batch.snapshots) for batch in batch_captor.values])
+
+    def test_batch_is_closed_when_sent(self):
+        config = ConfigService({})
+        service = PushService(self.grpc_service, self.handler, config)
+        service.push_snapshot(mock_snapshot())
+        service.push_snapshot(mock_snapshot())
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler, times=1).submit_task(task_captor, batch_captor)
+
+        sent = []
+
+        class MockSend:
+            # noinspection PyUnusedLocal
+            def __call__(self, snap, **kwargs):
+                sent.append(snap)
+
+            # noinspection PyUnusedLocal
+            def future(self, snap, **kwargs):
+                sent.append(snap)
+                future = Future()
+                future.set_result(None)
+                return future
+
+        mock_channel = mockito.mock()
+        self.grpc_service.channel = mock_channel
+        mockito.when(self.grpc_service).metadata().thenReturn([])
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(MockSend())
+
+        task_captor.get_value()(batch_captor.get_value())
+        self.assertEqual(2, len(sent))
+
+        # the batch has been sent, so a new batch is created
+        service.push_snapshot(mock_snapshot())
+        mockito.verify(self.handler, times=2).submit_task(mockito.ANY, mockito.ANY)
+
+    def test_drop_newest_when_queue_is_full(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOTS': 2, 'PUSH_BATCH_SIZE': 1})
+        service = PushService(self.grpc_service, self.handler, config)
+
+        for _ in range(3):
+            service.push_snapshot(mock_snapshot())
+
+        self.assertEqual(2, service.pending_snapshots)
+        self.assertEqual(1, service.dropped_snapshots)
+        mockito.verify(self.handler, times=2).submit_task(mockito.ANY, mockito.ANY)
+
+    def test_drop_oldest_when_queue_is_full(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOTS': 2, 'PUSH_BATCH_SIZE': 1, 'PUSH_DROP_POLICY': 'drop_oldest'})
+        service = PushService(self.grpc_service, self.handler, config)
+
+        snapshots = [mock_snapshot() for _ in range(3)]
+        for snapshot in snapshots:
+            service.push_snapshot(snapshot)
+
+        self.assertEqual(2, service.pending_snapshots)
+        self.assertEqual(1, service.dropped_snapshots)
+
+        batch_captor = Captor()
+        mockito.verify(self.handler, times=3).submit_task(mockito.ANY, batch_captor)
+        self.assertEqual([[], [snapshots[1]], [snapshots[2]]], [batch.snapshots for batch in batch_captor.values])
+
+    def test_coalesce_when_queue_is_full(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOTS': 2, 'PUSH_BATCH_SIZE': 5, 'PUSH_DROP_POLICY': 'coalesce'})
+        service = PushService(self.grpc_service, self.handler, config)
+
+        first = mock_snapshot(tracepoint=mock_tracepoint(tp_id="one"))
+        second = mock_snapshot(tracepoint=mock_tracepoint(tp_id="two"))
+        replacement = mock_snapshot(tracepoint=mock_tracepoint(tp_id="one"))
+        other = mock_snapshot(tracepoint=mock_tracepoint(tp_id="three"))
+        for snapshot in [first, second, replacement, other]:
+            service.push_snapshot(snapshot)
+
+        self.assertEqual(2, service.pending_snapshots)
+        self.assertEqual(1, service.coalesced_snapshots)
+        # there is no waiting snapshot for this tracepoint, so it is dropped
+        self.assertEqual(1, service.dropped_snapshots)
+
+        batch_captor = Captor()
+        mockito.verify(self.handler, times=1).submit_task(mockito.ANY, batch_captor)
+        self.assertEqual([replacement, second], batch_captor.get_value().snapshots)
+
+    def test_pending_snapshots_released_on_completion(self):
+        config = ConfigService({})
+        future = Future()
+        mockito.when(self.handler).submit_task(mockito.ANY, mockito.ANY).thenReturn(future)
+        service = PushService(self.grpc_service, self.handler, config)
+
+        service.push_snapshot(mock_snapshot())
+        service.push_snapshot(mock_snapshot())
+        self.assertEqual(2, service.pending_snapshots)
+
+        future.set_result(None)
+        self.assertEqual(0, service.pending_snapshots)
+
+        # the batch was removed from the queue, so a new batch is created
+        service.push_snapshot(mock_snapshot())
+        mockito.verify(self.handler, times=2).submit_task(mockito.ANY, mockito.ANY)
+
+    def test_queue_metrics(self):
+        processor = mockito.mock()
+        config = ConfigService({'MAX_PENDING_SNAPSHOTS': 1})
+        mockito.when(ConfigService).has_metric_processor.thenReturn(True)
+        mockito.when(ConfigService).metric_processors.thenReturn([processor])
+        service = PushService(self.grpc_service, self.handler, config)
+
+        service.push_snapshot(mock_snapshot())
+        service.push_snapshot(mock_snapshot())
+
+        mockito.verify(processor, times=2).gauge('push_queue_depth', {}, 'deep', mockito.ANY, '', 1)
+        mockito.verify(processor, times=2).histogram('push_enqueue_latency', {}, 'deep', mockito.ANY, 'ms',
+                                                     mockito.ANY)
+        mockito.verify(processor, times=1).counter('push_dropped_snapshots', {'policy': 'drop_newest'}, 'deep',
+                                                   mockito.ANY, '', 1)
+
+    def test_snapshots_are_shed_when_breaker_open(self):
+        service = PushService(self.grpc_service, self.handler, self.config)
+        service.push_snapshot(mock_snapshot())
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler).submit_task(task_captor, batch_captor)
+
+        for _ in range(int(self.config.CIRCUIT_BREAKER_FAILURES)):
+            self.grpc_service.circuit_breaker.record_failure()
+        mock_channel = mockito.mock()
+        self.grpc_service.channel = mock_channel
+
+        task_captor.get_value()(batch_captor.get_value())
+
+        self.assertEqual(1, service.dropped_snapshots)
+        mockito.verify(mock_channel, times=0).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                                          response_deserializer=mockito.ANY)
+
+    def spool_config(self, **kwargs):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        config = ConfigService(dict({'SPOOL_PATH': os.path.join(spool_dir.name, 'snapshots.spool'),
+                                     'SPOOL_DRAIN_INTERVAL': 3600, 'GRPC_RETRY_BACKOFF_MS': 0}, **kwargs))
+        self.grpc_service = GRPCService(config)
+        return config
+
+    def mock_rpc(self, rpc):
+        mock_channel = mockito.mock()
+        self.grpc_service.channel = mock_channel
+        mockito.when(mock_channel).unary_unary(mockito.ANY, request_serializer=mockito.ANY,
+                                               response_deserializer=mockito.ANY).thenReturn(rpc)
+
+    def test_snapshots_are_spooled_when_breaker_open(self):
+        config = self.spool_config()
+        service = PushService(self.grpc_service, self.handler, config)
+        service.start()
+        self.addCleanup(service.shutdown)
+        snapshot = mock_snapshot()
+        service.push_snapshot(snapshot)
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler).submit_task(task_captor, batch_captor)
+
+        for _ in range(int(config.CIRCUIT_BREAKER_FAILURES)):
+            self.grpc_service.circuit_breaker.record_failure()
+        task_captor.get_value()(batch_captor.get_value())
+
+        self.assertEqual(0, service.dropped_snapshots)
+        # the spool is not sent while the breaker is open
+        service.drain_spool()
+        self.assertEqual(1, len(service.spool))
+
+        # the service is available again
+        self.grpc_service.circuit_breaker.record_success()
+        rpc = MockRpc()
+        self.mock_rpc(rpc)
+        service.drain_spool()
+
+        self.assertEqual(0, len(service.spool))
+        self.assertEqual(1, len(rpc.calls))
+
+    def test_dropped_snapshots_are_spooled(self):
+        config = self.spool_config(MAX_PENDING_SNAPSHOTS=1, PUSH_BATCH_SIZE=1)
+        service = PushService(self.grpc_service, self.handler, config)
+        service.start()
+        self.addCleanup(service.shutdown)
+
+        snapshots = [mock_snapshot() for _ in range(3)]
+        for snapshot in snapshots:
+            service.push_snapshot(snapshot)
+        self.assertEqual(2, service.dropped_snapshots)
+
+        rpc = MockRpc()
+        self.mock_rpc(rpc)
+        service.drain_spool()
+
+        self.assertEqual(0, len(service.spool))
+        self.assertEqual(2, len(rpc.calls))
+
+    def test_failed_snapshots_are_spooled_in_order(self):
+        config = self.spool_config(GRPC_MAX_RETRIES=0, PUSH_BATCH_SIZE=2)
+        service = PushService(self.grpc_service, self.handler, config)
+        service.start()
+        self.addCleanup(service.shutdown)
+
+        self.mock_rpc(MockRpc(MockRpcError(grpc.StatusCode.UNAVAILABLE), MockRpcError(grpc.StatusCode.UNAVAILABLE)))
+        snapshots = [mock_snapshot(), mock_snapshot()]
+        for snapshot in snapshots:
+            service.push_snapshot(snapshot)
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler).submit_task(task_captor, batch_captor)
+        task_captor.get_value()(batch_captor.get_value())
+
+        # the first spooled snapshot fails again, so both are kept
+        self.mock_rpc(MockRpc(MockRpcError(grpc.StatusCode.UNAVAILABLE)))
+        service.drain_spool()
+        self.assertEqual(2, len(service.spool))
+
+        first, records = service.spool.peek(5)
+        self.assertEqual([snapshot.id.to_bytes(16, "big") for snapshot in snapshots],
+                         [record[2:18] for record in records])
+
+        self.mock_rpc(MockRpc())
+        service.drain_spool()
+        self.assertEqual(0, len(service.spool))
+
+    def test_sent_snapshot_becomes_delta_baseline(self):
+        service = PushService(self.grpc_service, self.handler, self.config)
+        tracker = SnapshotDeltaTracker(10)
+        snapshot = mock_snapshot()
+        tracker.apply(snapshot)
+        service.push_snapshot(snapshot)
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler).submit_task(task_captor, batch_captor)
+        self.mock_rpc(MockRpc())
+        task_captor.get_value()(batch_captor.get_value())
+
+        self.assertEqual(snapshot.id_str, tracker.baseline_id)
+
+    def test_dropped_snapshot_is_not_delta_baseline(self):
+        config = ConfigService({'MAX_PENDING_SNAPSHOTS': 1, 'PUSH_BATCH_SIZE': 1, 'PUSH_DROP_POLICY': 'drop_oldest'})
+        service = PushService(self.grpc_service, self.handler, config)
+        tracker = SnapshotDeltaTracker(10)
+        dropped = mock_snapshot()
+        tracker.apply(dropped)
+        service.push_snapshot(dropped)
+        service.push_snapshot(mock_snapshot())
+
+        tracker.confirm(dropped.id_str)
+        self.assertIsNone(tracker.baseline_id)
+
+    def test_failed_snapshot_is_not_delta_baseline(self):
+        service = PushService(self.grpc_service, self.handler, self.config)
+        tracker = SnapshotDeltaTracker(10)
+        snapshot = mock_snapshot()
+        tracker.apply(snapshot)
+        service.push_snapshot(snapshot)
+
+        task_captor = Captor()
+        batch_captor = Captor()
+        mockito.verify(self.handler).submit_task(task_captor, batch_captor)
+        self.mock_rpc(MockRpc(MockRpcError(grpc.StatusCode.INVALID_ARGUMENT)))
+        with self.assertRaises(grpc.RpcError):
+            task_captor.get_value()(batch_captor.get_value())
+
+        tracker.confirm(snapshot.id_str)
+        self.assertIsNone(tracker.baseline_id)
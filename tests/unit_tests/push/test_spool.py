@@ -0,0 +1,180 @@
+#       Copyright (C) 2024  Intergral GmbH
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gc
+import os
+import tempfile
+import unittest
+import weakref
+
+from deepproto.proto.tracepoint.v1.tracepoint_pb2 import Snapshot
+
+from deep.push.spool import SnapshotSpool
+from utils import mock_snapshot
+
+
+class TestSnapshotSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'snapshots.spool')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def create(self, max_bytes=1024):
+        spool = SnapshotSpool(self.path, max_bytes)
+        self.assertTrue(spool.open())
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_add_is_buffered_until_flush(self):
+        spool = self.create()
+        spool.add(b'one')
+        self.assertEqual(0, len(spool))
+
+        spool.flush()
+        self.assertEqual(1, len(spool))
+        self.assertEqual(1024, os.path.getsize(self.path))
+
+    def test_records_are_read_in_order(self):
+        spool = self.create()
+        for record in [b'one', b'two', b'three']:
+            spool.add(record)
+        spool.flush()
+
+        first, records = spool.peek(2)
+        self.assertEqual([b'one', b'two'], records)
+        spool.remove(first, len(records))
+
+        first, records = spool.peek(5)
+        self.assertEqual([b'three'], records)
+        spool.remove(first, len(records))
+        self.assertEqual(0, len(spool))
+        self.assertEqual([], spool.peek(5)[1])
+
+    def test_snapshots_are_encoded(self):
+        spool = self.create()
+        snapshot = mock_snapshot()
+        spool.add(snapshot)
+        spool.flush()
+
+        self.assertEqual(snapshot.id.to_bytes(16, "big"), Snapshot.FromString(spool.peek(1)[1][0]).ID)
+
+    def test_oldest_records_are_dropped_when_full(self):
+        # 32 byte header, so there is space for 4 records of 100 bytes (+4 byte length)
+        spool = self.create(max_bytes=32 + 4 * 104)
+        records = [bytes([i]) * 100 for i in range(10)]
+        for record in records:
+            spool.add(record)
+            spool.flush()
+
+        self.assertEqual(4, len(spool))
+        self.assertEqual(6, spool.dropped_snapshots)
+        self.assertEqual(records[6:], spool.peek(10)[1])
+
+    def test_records_wrap_around(self):
+        spool = self.create(max_bytes=32 + 250)
+        written = []
+        for i in range(20):
+            record = bytes([i]) * (30 + i * 7 % 50)
+            written.append(record)
+            spool.add(record)
+            spool.flush()
+            first, records = spool.peek(10)
+            # the newest records are always kept, in order
+            self.assertEqual(written[-len(records):], records)
+            if i % 3 == 0:
+                spool.remove(first, 1)
+                written = written[-len(records) + 1:] if len(records) > 1 else []
+
+    def test_remove_skips_dropped_records(self):
+        spool = self.create(max_bytes=32 + 2 * 104)
+        spool.add(b'a' * 100)
+        spool.add(b'b' * 100)
+        spool.flush()
+        first, records = spool.peek(2)
+
+        # the oldest record is overwritten while the records are being sent
+        spool.add(b'c' * 100)
+        spool.flush()
+        spool.remove(first, len(records))
+
+        self.assertEqual([b'c' * 100], spool.peek(5)[1])
+
+    def test_record_larger_than_spool(self):
+        spool = self.create(max_bytes=64)
+        spool.add(b'a' * 100)
+        spool.flush()
+
+        self.assertEqual(0, len(spool))
+        self.assertEqual(1, spool.dropped_snapshots)
+
+    def test_buffer_is_bounded(self):
+        spool = SnapshotSpool(self.path, 256)
+        for _ in range(10):
+            spool.add(b'a' * 100)
+        # only the newest snapshots that fit in the spool are buffered
+        self.assertEqual(8, spool.dropped_snapshots)
+
+    def test_snapshots_are_not_kept_in_buffer(self):
+        spool = self.create()
+        snapshot = mock_snapshot()
+        ref = weakref.ref(snapshot)
+        spool.add(snapshot)
+        del snapshot
+        gc.collect()
+        # the snapshot is encoded when it is added, so only the encoded snapshot is buffered
+        self.assertIsNone(ref())
+
+        spool.flush()
+        self.assertEqual(1, len(spool))
+
+    def test_buffer_is_written_when_full(self):
+        spool = self.create()
+        spool.FLUSH_BYTES = 10
+        spool.add(b'a' * 5)
+        self.assertEqual(0, len(spool))
+        spool.add(b'b' * 5)
+        self.assertEqual(2, len(spool))
+
+    def test_records_are_kept_when_reopened(self):
+        spool = SnapshotSpool(self.path, 1024)
+        self.assertTrue(spool.open())
+        spool.add(b'one')
+        spool.add(b'two')
+        spool.close()
+
+        reopened = self.create()
+        self.assertEqual(2, len(reopened))
+        self.assertEqual([b'one', b'two'], reopened.peek(5)[1])
+
+    def test_reset_when_size_changes(self):
+        spool = SnapshotSpool(self.path, 1024)
+        self.assertTrue(spool.open())
+        spool.add(b'one')
+        spool.close()
+
+        reopened = self.create(max_bytes=2048)
+        self.assertEqual(0, len(reopened))
+        self.assertEqual(2048, os.path.getsize(self.path))
+
+    def test_open_failure(self):
+        spool = SnapshotSpool(os.path.join(self.dir.name, 'missing', 'snapshots.spool'), 1024)
+        self.assertFalse(spool.open())
+
+        spool.add(b'one')
+        spool.flush()
+        self.assertEqual(1, spool.dropped_snapshots)
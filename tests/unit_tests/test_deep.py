@@ -14,9 +14,11 @@
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import unittest
+from unittest.mock import Mock
 
 from deep import start
 from deep.api import Deep
+from deep.config import ConfigService
 
 
 class DeepTest(unittest.TestCase):
@@ -42,3 +44,21 @@ class DeepTest(unittest.TestCase):
             'APP_ROOT': '/some/path'
         })
         self.assertEqual(deep.config.APP_ROOT, '/some/path')
+
+    def test_shutdown_stops_spool_before_channel(self):
+        deep = Deep(ConfigService({}))
+        services = Mock()
+        deep.trigger_handler = services.trigger_handler
+        deep.task_handler = services.task_handler
+        deep.poll = services.poll
+        deep.push = services.push
+        deep.grpc = services.grpc
+        deep.config.plugins = []
+        deep.started = True
+
+        deep.shutdown()
+
+        calls = [name for name, _, _ in services.mock_calls]
+        # the spool drain is stopped before the channel is closed, and the spool is closed after
+        self.assertLess(calls.index('push.stop'), calls.index('grpc.shutdown'))
+        self.assertLess(calls.index('grpc.shutdown'), calls.index('push.shutdown'))
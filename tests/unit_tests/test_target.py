@@ -29,3 +29,19 @@ def some_test_function(arg):
 
 def some_test_error(arg):
     raise Exception(some_test_function(arg))
+
+
+async def some_async_function(arg):
+    val = arg + "something"
+
+    return val
+
+
+async def some_async_caller(arg):
+    return await some_async_function(arg)
+
+
+def some_large_function(arg):
+    v0, v1, v2, v3, v4, v5, v6, v7, v8, v9, v10, v11, v12, v13 = range(14)
+
+    return arg + str(v0 + v1 + v2 + v3 + v4 + v5 + v6 + v7 + v8 + v9 + v10 + v11 + v12 + v13)
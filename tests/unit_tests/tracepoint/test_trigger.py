@@ -49,6 +49,34 @@ class Test(TestCase):
                  'log_msg': None,
              }, LocationAction.ActionType.Snapshot)
          ])],
+        # delta snapshot args are passed to the snapshot
+        ["some.file", 123, {'snapshot_delta': 'true', 'delta_baseline_interval': '5'}, [], [],
+         Trigger(LineLocation("some.file", 123, Location.Position.START), [
+             LocationAction("tp-id", None, {
+                 'watches': [],
+                 'frame_type': 'single_frame',
+                 'stack_type': 'stack',
+                 'fire_count': '1',
+                 'fire_period': '1000',
+                 'log_msg': None,
+                 'snapshot_delta': 'true',
+                 'delta_baseline_interval': '5',
+             }, LocationAction.ActionType.Snapshot)
+         ])],
+        # stack limit args are passed to the snapshot
+        ["some.file", 123, {'stack_type': 'no_stack', 'MAX_FRAMES': '5', 'collapse_frames': 'true'}, [], [],
+         Trigger(LineLocation("some.file", 123, Location.Position.START), [
+             LocationAction("tp-id", None, {
+                 'watches': [],
+                 'frame_type': 'single_frame',
+                 'stack_type': 'no_stack',
+                 'fire_count': '1',
+                 'fire_period': '1000',
+                 'log_msg': None,
+                 'MAX_FRAMES': '5',
+                 'collapse_frames': 'true',
+             }, LocationAction.ActionType.Snapshot)
+         ])],
         # create snapshot and log
         ["some.file", 123, {'log_msg': 'some_log'}, [], [],
          Trigger(LineLocation("some.file", 123, Location.Position.START), [
@@ -131,3 +159,12 @@ class Test(TestCase):
     def test_build_triggers(self, file, line, args, watches, metrics, expected):
         triggers = build_trigger("tp-id", file, line, args, watches, metrics)
         self.assertEqual(expected, triggers)
+
+    def test_tracepoint_is_cached(self):
+        trigger = build_trigger("tp-id", "some.file", 123, {}, ["a"], [])
+        action = trigger.actions[0]
+        tracepoint = action.tracepoint
+        self.assertIs(tracepoint, action.tracepoint)
+        self.assertEqual("tp-id", tracepoint.id)
+        self.assertEqual(123, tracepoint.line_no)
+        self.assertEqual(["a"], tracepoint.watches)
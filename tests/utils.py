@@ -15,6 +15,7 @@
 
 """Utils used for making testing easier."""
 
+import grpc
 # noinspection PyProtectedMember
 from mockito.matchers import Matcher
 
@@ -151,3 +152,16 @@ class Captor(Matcher):
     def get_values(self):
         """Get all captured values."""
         return self.values
+
+
+class MockRpcError(grpc.RpcError):
+    """An error raised by a failed grpc call."""
+
+    def __init__(self, code: grpc.StatusCode):
+        """Create new error with the status code."""
+        super().__init__(code.name)
+        self._code = code
+
+    def code(self):
+        """Get the status code."""
+        return self._code